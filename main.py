@@ -1,14 +1,37 @@
 import flet as ft
 import json
 import os
-import shutil
+import sys
+import importlib
 from datetime import datetime, timedelta
 import calendar
 import locale
 import re
 import hashlib
+import heapq
+import shutil
+import time
+import zlib
+import gzip
+import codecs
+import threading
+import weakref
+import atexit
+import bisect
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+# Trava de arquivo entre processos: fcntl (Linux/macOS) ou msvcrt (Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
 # >>> FIX FUSO HORÁRIO (Brasil - Brasília)
-import os, time
 # define TZ para São Paulo / Brasília
 os.environ["TZ"] = "America/Sao_Paulo"
 # time.tzset() funciona em Linux (servidores). Envolvemos em try/except por segurança.
@@ -20,17 +43,27 @@ except Exception:
 
 
 # --- BIBLIOTECAS OPCIONAIS PARA EXPORTAÇÃO E PDF ---
-try:
-    import pandas as pd
-    from fpdf import FPDF
-except ImportError:
-    print("AVISO: Para usar a exportação, instale: pip install pandas openpyxl fpdf")
+# pandas, fpdf e pdfplumber são pesadas: só são importadas na primeira exportação/importação,
+# para que a tela de login abra rápido (cold start no Render).
+_AVISOS_LIBS_OPCIONAIS = {
+    "pandas": "AVISO: Para usar a exportação, instale: pip install pandas openpyxl fpdf",
+    "fpdf": "AVISO: Para usar a exportação, instale: pip install pandas openpyxl fpdf",
+    "pdfplumber": "AVISO: Para importar PDF, instale: pip install pdfplumber",
+}
+_libs_carregadas = {}
+
+
+def importar_opcional(nome, avisar=True):
+    """Importa uma biblioteca opcional sob demanda. Retorna o módulo ou None se não estiver instalada."""
+    if nome not in _libs_carregadas:
+        try:
+            _libs_carregadas[nome] = importlib.import_module(nome)
+        except ImportError:
+            if avisar:
+                print(_AVISOS_LIBS_OPCIONAIS.get(nome, f"AVISO: biblioteca opcional '{nome}' não instalada."))
+            _libs_carregadas[nome] = None
+    return _libs_carregadas[nome]
 
-try:
-    import pdfplumber
-except ImportError:
-    print("AVISO: Para importar PDF, instale: pip install pdfplumber")
-    pdfplumber = None
 
 # Tenta configurar o idioma do sistema para Português-BR
 try:
@@ -39,1747 +72,1232 @@ except:
     pass
 
 # --- CONFIGURAÇÕES GLOBAIS ---
-ARQUIVO_DADOS = "dados_ponto.json"
+ARQUIVO_DADOS = "dados_ponto.json"  # Formato antigo (arquivo único); migrado para PASTA_DADOS no primeiro uso
+PASTA_DADOS = "dados_ponto"  # Uma partição por mês (AAAA-MM.dat) + manifesto.json
 ARQUIVO_CONFIG = "config.json"  # Arquivo para salvar as preferências
+PASTA_CACHE_EXPORTACOES = "cache_exportacoes"  # XLSX/PDF já gerados (ver CacheExportacoes)
+LIMITE_CACHE_EXPORTACOES = 50 * 1024 * 1024  # Bytes; passando disso, os menos usados são apagados
+
+
+# --- SERIALIZAÇÃO DO ARQUIVO DE DADOS ---
+# Formatos aceitos em config["formato_dados"]:
+#   "json"      -> JSON compacto (usa orjson ou msgspec se estiverem instalados, senão o json padrão)
+#   "json_zlib" -> JSON compacto comprimido com zlib (binário, só biblioteca padrão)
+#   "msgpack"   -> MessagePack via msgspec/msgpack (binário; cai para json_zlib se não houver lib)
+# Na leitura o formato é detectado pelo cabeçalho, então arquivos antigos (JSON indentado) continuam abrindo.
+FORMATOS_DADOS = ("json", "json_zlib", "msgpack")
+_MAGICO_ZLIB = b"PONTOZ1\n"
+_MAGICO_MSGPACK = b"PONTOM1\n"
+
+
+def _json_dumps_compacto(dados):
+    orjson = importar_opcional("orjson", avisar=False)
+    if orjson:
+        return orjson.dumps(dados)
+    msgspec = importar_opcional("msgspec", avisar=False)
+    if msgspec:
+        return msgspec.json.encode(dados)
+    return json.dumps(dados, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _json_loads(conteudo):
+    orjson = importar_opcional("orjson", avisar=False)
+    if orjson:
+        return orjson.loads(conteudo)
+    msgspec = importar_opcional("msgspec", avisar=False)
+    if msgspec:
+        return msgspec.json.decode(conteudo)
+    return json.loads(conteudo.decode("utf-8"))
+
+
+def _lib_msgpack():
+    """Retorna (encode, decode) da primeira biblioteca MessagePack disponível, ou None."""
+    msgspec = importar_opcional("msgspec", avisar=False)
+    if msgspec:
+        return msgspec.msgpack.encode, msgspec.msgpack.decode
+    msgpack = importar_opcional("msgpack", avisar=False)
+    if msgpack:
+        return (lambda d: msgpack.packb(d, use_bin_type=True)), (lambda b: msgpack.unpackb(b, raw=False))
+    return None
+
+
+def serializar_dados(dados, formato="json"):
+    """Converte o dicionário de dados em bytes no formato escolhido."""
+    if formato == "msgpack":
+        lib = _lib_msgpack()
+        if lib:
+            return _MAGICO_MSGPACK + lib[0](dados)
+        print("AVISO: msgspec/msgpack não instalados. Salvando em json_zlib.")
+        formato = "json_zlib"
+    if formato == "json_zlib":
+        return _MAGICO_ZLIB + zlib.compress(_json_dumps_compacto(dados), 1)
+    return _json_dumps_compacto(dados)
+
+
+def desserializar_dados(conteudo):
+    """Lê bytes em qualquer um dos FORMATOS_DADOS, detectando o formato pelo cabeçalho."""
+    if conteudo.startswith(_MAGICO_ZLIB):
+        return _json_loads(zlib.decompress(conteudo[len(_MAGICO_ZLIB):]))
+    if conteudo.startswith(_MAGICO_MSGPACK):
+        lib = _lib_msgpack()
+        if not lib:
+            raise RuntimeError("Arquivo em MessagePack, mas msgspec/msgpack não estão instalados.")
+        return lib[1](conteudo[len(_MAGICO_MSGPACK):])
+    if conteudo.startswith(b"\xef\xbb\xbf"):  # BOM de arquivos editados no Windows
+        conteudo = conteudo[3:]
+    return _json_loads(conteudo)
+
+
+# --- GRAVAÇÃO EM SEGUNDO PLANO ---
+def gravar_arquivo_atomico(caminho, conteudo):
+    """Grava em um arquivo temporário e troca de uma vez, para nunca deixar um arquivo pela metade."""
+    temp = f"{caminho}.{os.getpid()}.tmp"
+    with open(temp, "wb") as f:
+        f.write(conteudo)
+    os.replace(temp, caminho)
+
+
+@contextmanager
+def trava_arquivo(caminho):
+    """Trava exclusiva entre processos (flock no Linux, msvcrt no Windows) enquanto o bloco roda."""
+    os.makedirs(os.path.dirname(caminho) or ".", exist_ok=True)
+    with open(caminho, "a+b") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        elif msvcrt:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
 
 
-# --- CLASSE DE GERENCIAMENTO DE FERIADOS ---
-class GerenciadorFeriados:
-    """Classe utilitária para verificar feriados nacionais e do DF (Brasília)."""
-
-    @staticmethod
-    def calcular_pascoa(ano):
-        """Calcula a data da Páscoa usando o algoritmo de Meeus/Jones/Butcher."""
-        a = ano % 19
-        b = ano // 100
-        c = ano % 100
-        d = b // 4
-        e = b % 4
-        f = (b + 8) // 25
-        g = (b - f + 1) // 3
-        h = (19 * a + b - d - g + 15) % 30
-        i = c // 4
-        k = c % 4
-        l = (32 + 2 * e + 2 * i - h - k) % 7
-        m = (a + 11 * h + 22 * l) // 451
-        mes = (h + l - 7 * m + 114) // 31
-        dia = ((h + l - 7 * m + 114) % 31) + 1
-        return datetime(ano, mes, dia).date()
-
-    @staticmethod
-    def obter_feriados(ano):
-        pascoa = GerenciadorFeriados.calcular_pascoa(ano)
-        carnaval = pascoa - timedelta(days=47)
-        sexta_santa = pascoa - timedelta(days=2)
-        corpus_christi = pascoa + timedelta(days=60)
-
-        feriados = {
-            f"{ano}-01-01", f"{ano}-04-21", f"{ano}-05-01", f"{ano}-09-07",
-            f"{ano}-10-12", f"{ano}-11-02", f"{ano}-11-15", f"{ano}-11-20", f"{ano}-12-25",
-            f"{ano}-04-21", f"{ano}-11-30",  # Distritais DF
-            carnaval.strftime("%Y-%m-%d"), sexta_santa.strftime("%Y-%m-%d"), corpus_christi.strftime("%Y-%m-%d"),
-        }
-        return feriados
-
-    @staticmethod
-    def eh_feriado(data_date):
-        feriados_ano = GerenciadorFeriados.obter_feriados(data_date.year)
-        return data_date.strftime("%Y-%m-%d") in feriados_ano
-
+class GravadorEmSegundoPlano:
+    """
+    Uma única thread por processo que executa as gravações fora dos handlers do Flet.
+    - agendar(chave, tarefa) enfileira e retorna; se a chave já está na fila não duplica
+      (a tarefa pendente grava o estado mais recente quando rodar).
+    - aguardar() bloqueia até tudo estar no disco (usado no desligamento e quando a durabilidade importa).
+    """
 
-# --- CLASSE PRINCIPAL (BACKEND) ---
-class ControlePontoApp:
     def __init__(self):
-        self.config = self.carregar_config()  # Carrega config primeiro
-        self.dados = self.carregar_dados()
-
-    def carregar_dados(self):
-        if os.path.exists(ARQUIVO_DADOS):
-            try:
-                with open(ARQUIVO_DADOS, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
-
-    def carregar_config(self):
-        """Carrega configurações do usuário (Meta, Fatores, Tema)."""
-        default = {
-            "meta_diaria": 8,
-            "fator_dia_util": 1.0,  # Multiplicador normal
-            "fator_fds": 2.0,  # Multiplicador FDS (Dobro)
-            "tema_inicial": "light",
-            "data_inicio_contagem": None,  # Data de corte para o banco de horas
-            "ultimo_hash_pdf": None  # Armazena o hash do último PDF importado
-        }
-        if os.path.exists(ARQUIVO_CONFIG):
+        self._pendentes = OrderedDict()  # chave -> tarefa (callable)
+        self._em_andamento = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self.ultimo_erro = None
+
+    def agendar(self, chave, tarefa):
+        with self._cond:
+            if chave not in self._pendentes:
+                self._pendentes[chave] = tarefa
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name="gravador-ponto", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def aguardar(self, timeout=None):
+        """Espera a fila esvaziar. Retorna False se o timeout acabar antes."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pendentes and not self._em_andamento, timeout)
+
+    def _executar(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pendentes)
+                chave, tarefa = self._pendentes.popitem(last=False)
+                self._em_andamento += 1
             try:
-                with open(ARQUIVO_CONFIG, "r", encoding="utf-8") as f:
-                    salvo = json.load(f)
-                    # Garante que todas as chaves existam mesclando
-                    for k, v in default.items():
-                        if k not in salvo:
-                            salvo[k] = v
-                    return salvo
-            except:
-                return default
-        return default
-
-    def salvar_dados(self):
-        with open(ARQUIVO_DADOS, "w", encoding="utf-8") as f:
-            json.dump(self.dados, f, indent=4, ensure_ascii=False)
-
-    def salvar_config(self, meta=None, f_util=None, f_fds=None, tema=None):
-        # Atualiza apenas o que for passado
-        if meta is not None: self.config["meta_diaria"] = meta
-        if f_util is not None: self.config["fator_dia_util"] = f_util
-        if f_fds is not None: self.config["fator_fds"] = f_fds
-        if tema is not None: self.config["tema_inicial"] = tema
-
-        with open(ARQUIVO_CONFIG, "w", encoding="utf-8") as f:
-            json.dump(self.config, f, indent=4, ensure_ascii=False)
-
-    def zerar_banco_horas(self):
-        """Define a data de hoje como o início da contagem, arquivando o passado virtualmente."""
-        self.config["data_inicio_contagem"] = datetime.now().strftime("%Y-%m-%d")
-        with open(ARQUIVO_CONFIG, "w", encoding="utf-8") as f:
-            json.dump(self.config, f, indent=4, ensure_ascii=False)
-
-    def obter_hoje_str(self):
-        return datetime.now().strftime("%Y-%m-%d")
-
-    def converter_input_tempo_para_minutos(self, valor_str):
-        valor_str = valor_str.strip()
-        try:
-            if ":" in valor_str:
-                sinal = 1
-                if valor_str.startswith("-"):
-                    sinal = -1
-                    valor_str = valor_str.replace("-", "")
-                partes = valor_str.split(":")
-                horas = int(partes[0])
-                minutos = int(partes[1])
-                total = (horas * 60) + minutos
-                return total * sinal
-            else:
-                return int(valor_str)
-        except:
-            return 0
+                tarefa()
+            except Exception as ex:
+                self.ultimo_erro = ex
+                print(f"ERRO ao gravar {chave}: {ex}")
+            finally:
+                with self._cond:
+                    self._em_andamento -= 1
+                    self._cond.notify_all()
 
-    def calcular_segundos_trabalhados(self, horarios):
-        total_segundos = 0
-        formato = "%H:%M"
-        for i in range(0, len(horarios), 2):
-            if i + 1 < len(horarios):
-                try:
-                    entrada = datetime.strptime(horarios[i], formato)
-                    saida = datetime.strptime(horarios[i + 1], formato)
-                    total_segundos += (saida - entrada).total_seconds()
-                except ValueError:
-                    pass  # Ignora horários inválidos
-        return total_segundos
 
-    def formatar_duracao(self, segundos):
-        sinais = ""
-        if segundos < 0:
-            sinais = "-"
-            segundos = abs(segundos)
-        horas = int(segundos // 3600)
-        minutos = int((segundos % 3600) // 60)
-        return f"{sinais}{horas:02d}:{minutos:02d}"
+GRAVADOR = GravadorEmSegundoPlano()
 
-    def obter_saldo_dia(self, data_str, info_dia):
-        """Calcula saldo usando as configurações personalizadas."""
-        horarios = info_dia.get("batidas", [])
-        ajuste_manual_min = info_dia.get("ajuste_manual", 0)
-        eh_folga = info_dia.get("folga", False)
 
-        # Retorna 4 valores para evitar erro de unpack
-        if eh_folga:
-            return 0, 0, 0, False
+def finalizar_gravacoes(timeout=30):
+    """Hook de desligamento: garante que a fila de gravação foi para o disco."""
+    if not GRAVADOR.aguardar(timeout):
+        print("AVISO: gravações pendentes não terminaram antes do desligamento.")
 
-        total_trabalhado_seg = self.calcular_segundos_trabalhados(horarios)
 
-        # --- CORREÇÃO AQUI: Tratamento de erro para data inválida ---
-        try:
-            data_obj = datetime.strptime(data_str, "%Y-%m-%d")
-        except ValueError:
-            # Se a data for "null" ou inválida, retorna zerado para não travar o app
-            print(f"AVISO: Data inválida ignorada: {data_str}")
-            return 0, 0, 0, False
-            # -----------------------------------------------------------
+atexit.register(finalizar_gravacoes)
 
-        eh_fds = data_obj.weekday() >= 5
-        eh_feriado = GerenciadorFeriados.eh_feriado(data_obj.date())
 
-        # --- APLICAÇÃO DAS CONFIGURAÇÕES ---
-        meta_horas = self.config.get("meta_diaria", 8)
-        fator_util = self.config.get("fator_dia_util", 1.0)
-        fator_fds = self.config.get("fator_fds", 2.0)
+# --- CONCORRÊNCIA ENTRE PROCESSOS ---
+# Cada dia gravado leva um contador "_versao". Quem grava trava a pasta (ARQUIVO_TRAVA), relê o mês
+# do disco e, se o dia mudou desde que esta sessão o leu, mescla em vez de sobrescrever.
+ARQUIVO_TRAVA = ".trava"
 
-        meta_segundos = meta_horas * 3600
-        saldo_segundos = 0
 
-        if eh_fds or eh_feriado:
-            # FDS/Feriado: Meta 0, aplica multiplicador configurado
-            meta_segundos = 0
-            saldo_segundos = total_trabalhado_seg * fator_fds
-        else:
-            # Dia Útil
-            saldo_bruto = total_trabalhado_seg - meta_segundos
-            # Aplica multiplicador apenas se for hora extra (positivo)
-            if saldo_bruto > 0:
-                saldo_segundos = saldo_bruto * fator_util
-            else:
-                saldo_segundos = saldo_bruto
+def copiar_dia(info):
+    return {campo: list(valor) if isinstance(valor, list) else valor for campo, valor in info.items()}
 
-        saldo_final = saldo_segundos + (ajuste_manual_min * 60)
 
-        return total_trabalhado_seg, meta_segundos, saldo_final, eh_feriado
+def _conteudo_dia(info):
+    """O dia só com os dados do usuário: campos internos (prefixo "_", como "_versao") ficam de fora."""
+    return None if info is None else {campo: valor for campo, valor in info.items() if not campo.startswith("_")}
 
-    def registrar_batida(self, data_str, hora_str):
-        if data_str not in self.dados:
-            self.dados[data_str] = {"batidas": [], "ajuste_manual": 0, "folga": False}
 
-        if hora_str not in self.dados[data_str]["batidas"]:
-            self.dados[data_str]["batidas"].append(hora_str)
-            self.dados[data_str]["batidas"].sort()
-            self.salvar_dados()
-            return True
+def mesclar_dia(base, local, disco):
+    """
+    Mescla de três vias de um dia (None = dia inexistente):
+    base = o dia no disco quando esta sessão o leu; local = como ficou aqui; disco = como está agora.
+    Batidas são unidas (respeitando o que cada lado removeu); nos demais campos vence quem alterou.
+    """
+    v_base = base.get("_versao", 0) if base else 0
+    v_disco = disco.get("_versao", 0) if disco else 0
+    mesmo_disco = v_disco == v_base  # Ninguém mais gravou o dia desde a base
+
+    if mesmo_disco and _conteudo_dia(base) == _conteudo_dia(disco):
+        resultado = local  # O disco está como esta sessão leu: vale a versão local
+    elif local is None:
+        if mesmo_disco:
+            return None
+        return disco  # Apagamos, mas outro processo alterou depois: preserva a alteração dele
+    elif disco is None:
+        resultado = local  # Outro processo apagou, mas nós alteramos: mantém o nosso
+    else:
+        base = base or {}
+        batidas_base = set(base.get("batidas", []))
+        batidas_local = set(local.get("batidas", []))
+        adicionadas = batidas_local - batidas_base
+        removidas = batidas_base - batidas_local
+        resultado = copiar_dia(disco)
+        for campo, valor in local.items():
+            if campo not in ("batidas", "_versao") and valor != base.get(campo):
+                resultado[campo] = valor
+        resultado["batidas"] = sorted((set(disco.get("batidas", [])) | adicionadas) - removidas)
+
+    if resultado is None:
+        return None
+    resultado = copiar_dia(resultado)
+    resultado["_versao"] = max(v_base, v_disco) + 1
+    return resultado
+
+
+def rebase_dia(local_escrito, gravado):
+    """
+    Nova base para um dia que voltou a ser alterado enquanto a versão `local_escrito` era gravada.
+    A base fica com o conteúdo local e a versão gravada: se a gravação mesclou algo de outro
+    processo, o conteúdo difere do disco e a próxima gravação mescla de novo em vez de sobrescrever.
+    """
+    if local_escrito is None:
+        return None
+    base = copiar_dia(local_escrito)
+    base["_versao"] = gravado.get("_versao", 0) if gravado else 0
+    return base
+
+
+# --- QUALIDADE DOS DADOS (QUARENTENA) ---
+# Dias com data ou campos inválidos (ex: a chave "null" de versões antigas) saem dos dados na abertura
+# e vão para PASTA_DADOS/quarentena.json junto com o motivo. O manifesto guarda a versão da validação,
+# então a varredura roda uma vez por base e o cálculo do saldo não precisa mais se defender.
+ARQUIVO_QUARENTENA = "quarentena.json"
+VERSAO_VALIDACAO = 1  # Aumente quando sanear_dia passar a conferir algo novo (força uma nova varredura)
+_RE_DATA = re.compile(r"\d{4}-\d{2}-\d{2}")
+_RE_HORA = re.compile(r"(?:[01]\d|2[0-3]):[0-5]\d")
+
+
+def data_valida(data_str):
+    """True se `data_str` é uma data AAAA-MM-DD que existe no calendário."""
+    if not isinstance(data_str, str) or not _RE_DATA.fullmatch(data_str):
         return False
-
-    def atualizar_batida(self, data, hora_antiga, hora_nova):
-        if data in self.dados and hora_antiga in self.dados[data]["batidas"]:
-            self.dados[data]["batidas"].remove(hora_antiga)
-            self.dados[data]["batidas"].append(hora_nova)
-            self.dados[data]["batidas"].sort()
-            self.salvar_dados()
-            return True
+    try:
+        datetime.fromisoformat(data_str)
+    except ValueError:
         return False
+    return True
 
-    def remover_batida(self, data_str, hora_str):
-        if data_str in self.dados and hora_str in self.dados[data_str]["batidas"]:
-            self.dados[data_str]["batidas"].remove(hora_str)
-            self.salvar_dados()
-
-    def bater_ponto_agora(self):
-        hoje = self.obter_hoje_str()
-        agora = datetime.now().strftime("%H:%M")
-        self.registrar_batida(hoje, agora)
-        return f"Ponto batido às {agora}"
-
-    def ajustar_manual(self, data, minutos):
-        if data in self.dados:
-            self.dados[data]["ajuste_manual"] = minutos
-            self.salvar_dados()
 
-    # ALTERAÇÃO: Agora aceita parâmetro opcional 'eh_ferias'
-    def definir_folga(self, data, status, eh_ferias=False):
-        if data not in self.dados:
-            self.dados[data] = {"batidas": [], "ajuste_manual": 0, "folga": False}
+def sanear_dia(data_str, info):
+    """
+    Confere um dia. Retorna (info_corrigido, motivos): info_corrigido é None quando o dia inteiro vai
+    para a quarentena (data inválida ou registro irreconhecível); senão é o dia sem os campos inválidos
+    (batidas fora do formato HH:MM são descartadas, as demais ficam ordenadas e sem repetição) e sem
+    os campos internos (ver _conteudo_dia). motivos vazio = o dia já estava correto.
+    """
+    if not data_valida(data_str):
+        return None, ["data inválida"]
+    if not isinstance(info, dict):
+        return None, ["registro do dia não é um objeto"]
+
+    motivos = []
+    corrigido = _conteudo_dia(info)
+    batidas = info.get("batidas", [])
+    if not isinstance(batidas, list):
+        motivos.append("lista de batidas inválida")
+        batidas = []
+    validas = [h for h in batidas if isinstance(h, str) and _RE_HORA.fullmatch(h)]
+    if len(validas) != len(batidas):
+        motivos.append("batidas inválidas: " + ", ".join(repr(h) for h in batidas if h not in validas))
+    normalizadas = sorted(set(validas))
+    if normalizadas != validas and len(validas) == len(batidas):
+        motivos.append("batidas fora de ordem ou repetidas")
+    corrigido["batidas"] = normalizadas
+
+    ajuste = info.get("ajuste_manual", 0)
+    if isinstance(ajuste, bool) or not isinstance(ajuste, (int, float)):
+        motivos.append(f"ajuste manual inválido: {ajuste!r}")
+        corrigido["ajuste_manual"] = 0
+    if not isinstance(info.get("folga", False), bool):
+        motivos.append(f"folga inválida: {info.get('folga')!r}")
+        corrigido["folga"] = False
+    return corrigido, motivos
+
+
+def separar_invalidos(dias):
+    """
+    Passa sanear_dia em {data: info}. Retorna (validos, itens_quarentena): validos tem os dias aceitos
+    (já corrigidos) e itens_quarentena os registros originais com os motivos, para quarentenar().
+    """
+    validos, itens = {}, []
+    for data, info in dias.items():
+        corrigido, motivos = sanear_dia(data, info)
+        if motivos:
+            itens.append(item_quarentena(data, info, motivos, corrigido))
+        if corrigido is not None:
+            validos[data] = corrigido
+    return validos, itens
 
-        self.dados[data]["folga"] = status
 
-        # Salva uma marcação especial se for férias
-        if status and eh_ferias:
-            self.dados[data]["is_ferias"] = True
+def separar_batidas_invalidas(batidas_por_dia):
+    """
+    Confere {data: horas} antes de uma importação. Retorna (entrada, itens_quarentena, invalidas):
+    entrada tem, por data válida, a lista das horas HH:MM válidas (dias sem nenhuma ficam de fora),
+    itens_quarentena os registros recusados e invalidas quantas batidas foram descartadas.
+    """
+    entrada, itens, invalidas = {}, [], 0
+    for data, horas in batidas_por_dia.items():
+        recebidas = list(horas)
+        if not data_valida(data):
+            invalidas += len(recebidas)
+            itens.append(item_quarentena(data, {"batidas": recebidas}, ["data inválida"], None, origem="importação"))
+            continue
+        validas = [h for h in recebidas if isinstance(h, str) and _RE_HORA.fullmatch(h)]
+        if len(validas) != len(recebidas):
+            invalidas += len(recebidas) - len(validas)
+            recusadas = ", ".join(repr(h) for h in recebidas if h not in validas)
+            itens.append(item_quarentena(data, {"batidas": recebidas}, [f"batidas inválidas: {recusadas}"],
+                                         {"batidas": validas}, origem="importação"))
+            if not validas:
+                continue
+        entrada[data] = validas
+    return entrada, itens, invalidas
+
+
+def item_quarentena(data, info, motivos, corrigido, **origem):
+    """Registro da quarentena para um dia que sanear_dia recusou ou corrigiu (`origem`: ex. linha=...)."""
+    return {"data": data, "registro": info, "motivos": motivos, **origem,
+            "destino": "quarentena" if corrigido is None else "corrigido",
+            "em": datetime.now().isoformat(timespec="seconds")}
+
+
+# --- LEITURA DE BACKUP EM FLUXO ---
+# Backups de vários anos não precisam caber na memória: o arquivo é lido em blocos e o decodificador
+# JSON só vê um dia de cada vez (ver ler_backup_em_fluxo e ControlePontoApp.restaurar_backup).
+TAMANHO_BLOCO_BACKUP = 256 * 1024
+MESES_POR_LOTE_RESTAURACAO = 12  # Meses em memória na preparação de uma restauração (ver PreparoRestauracao)
+LIMITE_DIA_BACKUP = 1024 * 1024  # Caracteres; um dia maior que isso só num arquivo corrompido
+
+
+def _blocos_texto_backup(f):
+    """Texto de um backup JSON ou json_zlib em blocos, decodificado e descomprimido aos poucos."""
+    decodificador = codecs.getincrementaldecoder("utf-8")()
+    bloco = f.read(max(TAMANHO_BLOCO_BACKUP, len(_MAGICO_ZLIB)))
+    descomprimir = None
+    if bloco.startswith(_MAGICO_ZLIB):
+        descomprimir = zlib.decompressobj()
+        bloco = bloco[len(_MAGICO_ZLIB):]
+    elif bloco.startswith(b"\xef\xbb\xbf"):  # BOM de arquivos editados no Windows
+        bloco = bloco[3:]
+    while True:
+        if descomprimir:
+            bloco = descomprimir.decompress(bloco)
+        yield decodificador.decode(bloco)
+        bloco = f.read(TAMANHO_BLOCO_BACKUP)
+        if not bloco:
+            break
+    yield decodificador.decode(descomprimir.flush() if descomprimir else b"", final=True)
+
+
+def ler_backup_em_fluxo(caminho):
+    """
+    Lê um backup {data: info} sem carregá-lo inteiro: gera (data, info, linha) um dia por vez.
+    JSON e json_zlib são lidos em blocos; MessagePack não tem leitura em fluxo aqui e é lido inteiro
+    (linha None). Erro de sintaxe vira ValueError com a linha e a coluna do problema, e pode acontecer
+    depois de vários dias já gerados: quem consome só deve aplicar o resultado no fim.
+    """
+    with open(caminho, "rb") as f:
+        if f.read(len(_MAGICO_MSGPACK)) == _MAGICO_MSGPACK:
+            f.seek(0)
+            dados = desserializar_dados(f.read())
+            if not isinstance(dados, dict):
+                raise ValueError("Arquivo de backup inválido: o conteúdo deve ser um objeto {data: dia}.")
+            for data, info in dados.items():
+                yield data, info, None
+            return
+        f.seek(0)
+
+        blocos = _blocos_texto_backup(f)
+        decodificador = json.JSONDecoder()
+        buf, i = "", 0
+        linhas_antes, coluna_antes = 0, 0  # Posição do início de `buf` no arquivo
+        contadas = [0, 0]  # Quebras de linha já contadas em buf[:contadas[0]] (as posições só avançam)
+        fim = False
+
+        def posicao(j):
+            if j < contadas[0]:
+                contadas[:] = [0, 0]
+            contadas[1] += buf.count("\n", contadas[0], j)
+            contadas[0] = j
+            quebra = buf.rfind("\n", 0, j)
+            coluna = j - quebra if quebra >= 0 else coluna_antes + j + 1
+            return linhas_antes + contadas[1] + 1, coluna
+
+        def erro(j, motivo):
+            linha, coluna = posicao(j)
+            return ValueError(f"Backup inválido na linha {linha}, coluna {coluna}: {motivo}.")
+
+        def ler_mais():
+            nonlocal buf, fim
+            try:
+                buf += next(blocos)
+            except StopIteration:
+                fim = True
+            except (UnicodeDecodeError, zlib.error) as ex:
+                raise erro(len(buf), f"conteúdo ilegível ({ex})")
+
+        def pular_espacos():
+            nonlocal i
+            while True:
+                while i < len(buf) and buf[i] in " \t\r\n":
+                    i += 1
+                if i < len(buf) or fim:
+                    return i < len(buf)
+                ler_mais()
+
+        def ler_valor():
+            nonlocal i
+            while True:
+                try:
+                    valor, final = decodificador.raw_decode(buf, i)
+                    if final < len(buf) or fim:  # No fim do buffer um número pode continuar no próximo bloco
+                        i = final
+                        return valor
+                except json.JSONDecodeError as ex:
+                    if fim or len(buf) - i > LIMITE_DIA_BACKUP:
+                        raise erro(ex.pos, ex.msg)
+                ler_mais()
+
+        def esperar(caractere, motivo):
+            nonlocal i
+            if not pular_espacos() or buf[i] != caractere:
+                raise erro(i, motivo)
+            i += 1
+
+        esperar("{", "o backup deve ser um objeto {data: dia}")
+        if pular_espacos() and buf[i] == "}":
+            i += 1
         else:
-            # Se desmarcar ou se for folga normal, remove a marcação de férias
-            self.dados[data]["is_ferias"] = False
-
-        self.salvar_dados()
-
-    # --- NOVA FUNÇÃO: REGISTRAR PERÍODO DE FÉRIAS ---
-    def registrar_ferias_lote(self, data_ini_str, data_fim_str):
-        """Define folga para todos os dias no intervalo."""
-        dt_ini = datetime.strptime(data_ini_str, "%Y-%m-%d")
-        dt_fim = datetime.strptime(data_fim_str, "%Y-%m-%d")
+            while True:
+                pular_espacos()
+                inicio = i
+                data = ler_valor()
+                if not isinstance(data, str):
+                    raise erro(inicio, "a chave de cada dia deve ser um texto")
+                esperar(":", "faltou ':' depois da data")
+                pular_espacos()
+                linha = posicao(i)[0]
+                info = ler_valor()
+                yield data, info, linha
+
+                if i > TAMANHO_BLOCO_BACKUP:  # Descarta o que já foi lido (mantém a posição para os erros)
+                    lido = buf[:i]
+                    quebras = lido.count("\n")
+                    linhas_antes += quebras
+                    coluna_antes = i - lido.rfind("\n") - 1 if quebras else coluna_antes + i
+                    buf, i = buf[i:], 0
+                    contadas[:] = [0, 0]
+                if not pular_espacos():
+                    raise erro(i, "o arquivo terminou antes do '}' final")
+                if buf[i] == ",":
+                    i += 1
+                elif buf[i] == "}":
+                    i += 1
+                    break
+                else:
+                    raise erro(i, "esperava ',' ou '}' depois do dia")
+        if pular_espacos():
+            raise erro(i, "há conteúdo depois do '}' final")
 
-        delta = (dt_fim - dt_ini).days
-        if delta < 0: return  # Data fim menor que inicio
 
-        for i in range(delta + 1):
-            dia = dt_ini + timedelta(days=i)
-            dia_str = dia.strftime("%Y-%m-%d")
-            # AQUI: Passa o True para dizer que é férias
-            self.definir_folga(dia_str, True, eh_ferias=True)
+# --- ARMAZENAMENTO PARTICIONADO POR MÊS ---
+ARQUIVO_MANIFESTO = "manifesto.json"
+PARTICAO_OUTROS = "outros"  # Chaves antigas que não são datas (ex: "null"); validar() as põe em quarentena
+MAX_PARTICOES_EM_MEMORIA = 12  # Meses já salvos que ficam em cache; os demais são descartados
 
-        self.salvar_dados()
 
-    def excluir_dia(self, data):
-        if data in self.dados:
-            del self.dados[data]
-            self.salvar_dados()
+def mes_da_chave(data_str):
+    """Retorna a partição (AAAA-MM) de uma chave de data."""
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", data_str or ""):
+        return data_str[:7]
+    return PARTICAO_OUTROS
 
-    def limpar_tudo(self):
-        # ESTE MÉTODO AGORA É ZERAR BANCO
-        self.zerar_banco_horas()
 
-    def calcular_dias_uteis_mes(self, ano, mes):
-        cal = calendar.monthcalendar(ano, mes)
-        dias_uteis = 0
-        for semana in cal:
-            for dia_da_semana in range(0, 5):  # 0-4 = Seg a Sex
-                dia_mes = semana[dia_da_semana]
-                if dia_mes != 0:
-                    data_atual = datetime(ano, mes, dia_mes).date()
-                    if not GerenciadorFeriados.eh_feriado(data_atual):
-                        dias_uteis += 1
-        return dias_uteis
+class DadosParticionados(MutableMapping):
+    """
+    Dicionário data -> info do dia, gravado em uma partição por mês.
+    - As partições só são lidas do disco quando algum dia do mês é acessado.
+    - O manifesto guarda a lista de dias de cada mês e os totais calculados por `resumir` (a função
+      da sessão aberta mais recente, ver registrar_resumo), então meses antigos entram no banco de
+      horas sem precisarem ser carregados.
+    - Alterações feitas direto no dicionário do dia precisam de marcar_alterado(data).
+    - A gravação (no GRAVADOR) mescla com o que outros processos gravaram no mesmo mês.
+    Use abrir_armazenamento() para obter a instância compartilhada do processo.
+    """
 
-    def gerar_dataframe_exportacao(self, mes_filtro=None):
-        """Prepara dados para Pandas exportar."""
-        registros = []
-        dias_pt = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
-        datas_ordenadas = sorted(self.dados.keys())
-
-        for data in datas_ordenadas:
-            if mes_filtro and not data.startswith(mes_filtro):
-                continue
-
-            info = self.dados[data]
-            trabalhado, meta, saldo, eh_feriado = self.obter_saldo_dia(data, info)
-
-            dt_obj = datetime.strptime(data, "%Y-%m-%d")
-            dia_semana = dias_pt[dt_obj.weekday()]
-
-            batidas_str = " | ".join(info['batidas'])
-            ajuste = info.get("ajuste_manual", 0)
-
-            observacao = ""
-            if info['folga']:
-                # Verifica se é férias para a exportação também
-                if info.get("is_ferias"):
-                    observacao = "FÉRIAS"
+    def __init__(self, pasta, formato="json", resumir=None):
+        self.pasta = pasta
+        self.formato = formato
+        self.versao = 0  # Muda a cada alteração local ou vinda do disco (invalida caches derivados)
+        self._trava = threading.RLock()
+        self._resumidores = []  # Referências fracas às funções de resumo das sessões (ver registrar_resumo)
+        self.registrar_resumo(resumir)
+        self._particoes = OrderedDict()  # mes -> {data: info}, em ordem de uso (LRU)
+        self._base = {}  # mes -> {data: info} como estava no disco na última leitura/gravação
+        self._mudancas = {}  # mes -> {datas alteradas aqui e ainda não enfileiradas}
+        self._fila = {}  # mes -> {data: [base, local]} aguardando o GRAVADOR
+        self._gravando = set()
+        self._totais_pendentes = set()
+        self._mtime_manifesto = None  # Última versão do manifesto vista por sincronizar()
+        self._manifesto = self._ler_manifesto_disco()
+        self._meses_ordenados = None  # Índice dos meses (ver meses()); None quando um mês entra ou sai
+
+    def registrar_resumo(self, resumir):
+        """
+        Registra a função que calcula os totais de um mês (o _resumir_mes de uma sessão). Métodos
+        ficam só com referência fraca: uma sessão encerrada sai da lista sozinha, em vez de ficar
+        presa ao armazenamento do processo, e as outras sessões continuam registradas.
+        """
+        if resumir is None:
+            return
+        referencia = weakref.WeakMethod(resumir) if hasattr(resumir, "__self__") else (lambda: resumir)
+        with self._trava:
+            self._resumidores = [r for r in self._resumidores if r() is not None] + [referencia]
+
+    @property
+    def resumir(self):
+        """Função de resumo da sessão mais recente que ainda existe, ou None."""
+        for referencia in reversed(self._resumidores):
+            funcao = referencia()
+            if funcao is not None:
+                return funcao
+        return None
+
+    def existe(self):
+        return os.path.exists(os.path.join(self.pasta, ARQUIVO_MANIFESTO))
+
+    def _caminho_particao(self, mes):
+        return os.path.join(self.pasta, f"{mes}.dat")
+
+    def _ler_manifesto_disco(self):
+        caminho = os.path.join(self.pasta, ARQUIVO_MANIFESTO)
+        if not os.path.exists(caminho):
+            return {"meses": {}}
+        with open(caminho, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _ler_particao_disco(self, mes):
+        caminho = self._caminho_particao(mes)
+        if not os.path.exists(caminho):
+            return {}
+        with open(caminho, "rb") as f:
+            return desserializar_dados(f.read())
+
+    def versoes_disco(self):
+        """{data: _versao} de todos os dias gravados, lidos do disco um mês por vez."""
+        versoes = {}
+        for mes in self._ler_manifesto_disco()["meses"]:
+            versoes.update((data, info.get("_versao", 0)) for data, info in self._ler_particao_disco(mes).items())
+        return versoes
+
+    def _mes_ocupado(self, mes):
+        return mes in self._mudancas or mes in self._fila or mes in self._gravando
+
+    def particao(self, mes):
+        """Retorna o dicionário do mês, lendo do disco se ainda não estiver em memória."""
+        with self._trava:
+            if mes in self._particoes:
+                self._particoes.move_to_end(mes)
+                return self._particoes[mes]
+
+            dias = self._ler_particao_disco(mes) if mes in self._manifesto["meses"] else {}
+            self._particoes[mes] = dias
+            self._base[mes] = {data: copiar_dia(info) for data, info in dias.items()}
+            self._descartar_excedentes(manter=mes)
+            return dias
+
+    def _descartar_excedentes(self, manter=None):
+        # Só descarta partições sem alterações pendentes (e nunca a que acabou de ser pedida)
+        excesso = len(self._particoes) - MAX_PARTICOES_EM_MEMORIA
+        for mes in list(self._particoes):
+            if excesso <= 0:
+                break
+            if not self._mes_ocupado(mes) and mes != manter:
+                del self._particoes[mes]
+                self._base.pop(mes, None)
+                excesso -= 1
+
+    def _dias_mes(self, mes):
+        return self._manifesto["meses"].get(mes, {}).get("dias", [])
+
+    # --- Interface de dicionário ---
+    def __getitem__(self, data):
+        mes = mes_da_chave(data)
+        if data not in self._dias_mes(mes):
+            raise KeyError(data)
+        return self.particao(mes)[data]
+
+    def __setitem__(self, data, info):
+        if not data_valida(data):
+            raise ValueError(f"Data inválida: {data!r} (use AAAA-MM-DD).")
+        mes = mes_da_chave(data)
+        with self._trava:
+            self.particao(mes)[data] = info
+            if mes not in self._manifesto["meses"]:
+                self._manifesto["meses"][mes] = {"dias": [], "totais": None}
+                self._meses_ordenados = None
+            # A lista de dias do mês é o índice ordenado: inserção por busca binária, sem reordenar
+            dias = self._manifesto["meses"][mes]["dias"]
+            i = bisect.bisect_left(dias, data)
+            if i == len(dias) or dias[i] != data:
+                dias.insert(i, data)
+            self.marcar_alterado(data)
+
+    def __delitem__(self, data):
+        mes = mes_da_chave(data)
+        with self._trava:
+            if data not in self:
+                raise KeyError(data)
+            del self.particao(mes)[data]
+            dias = self._manifesto["meses"][mes]["dias"]
+            del dias[bisect.bisect_left(dias, data)]
+            self.marcar_alterado(data)
+
+    def setdefault(self, data, padrao=None):
+        """Como dict.setdefault, mas atômico entre as sessões do processo (duas criando o mesmo dia)."""
+        with self._trava:
+            if data in self:
+                return self[data]
+            self[data] = padrao
+            return padrao
+
+    def __contains__(self, data):
+        dias = self._dias_mes(mes_da_chave(data))
+        i = bisect.bisect_left(dias, data)
+        return i < len(dias) and dias[i] == data
+
+    def __iter__(self):
+        for mes in self.meses():
+            yield from list(self._dias_mes(mes))
+
+    def __len__(self):
+        return sum(len(m["dias"]) for m in list(self._manifesto["meses"].values()))
+
+    # --- Consultas sem carregar o histórico ---
+    def meses(self):
+        meses = self._meses_ordenados
+        if meses is None:
+            meses = self._meses_ordenados = sorted(self._manifesto["meses"])
+        return meses
+
+    def meses_periodo(self, primeiro, ultimo):
+        """Meses (AAAA-MM) entre `primeiro` e `ultimo`, inclusive, por busca binária no índice."""
+        meses = self.meses()
+        return meses[bisect.bisect_left(meses, primeiro):bisect.bisect_right(meses, ultimo)]
+
+    def datas_periodo(self, inicio=None, fim=None):
+        """
+        Datas ordenadas entre `inicio` e `fim` (AAAA-MM-DD, inclusive; None = sem limite), lendo só o
+        manifesto: busca binária nos meses e nos dias das pontas, então custa O(log n + k).
+        """
+        inicio, fim = inicio or "", fim or "9999-12-31"
+        for mes in self.meses_periodo(inicio[:7], fim[:7]):
+            dias = self._dias_mes(mes)
+            a = bisect.bisect_left(dias, inicio) if mes == inicio[:7] else 0
+            b = bisect.bisect_right(dias, fim) if mes == fim[:7] else len(dias)
+            yield from dias[a:b]
+
+    def datas_com_prefixo(self, prefixo):
+        """Datas ordenadas que começam com `prefixo` (ex: "2025-03" ou "2025"), lendo só o manifesto."""
+        if len(prefixo) >= 7:
+            dias = self._dias_mes(prefixo[:7])
+            return dias[bisect.bisect_left(dias, prefixo):bisect.bisect_left(dias, prefixo + "\uffff")]
+        datas = []
+        for mes in self.meses_periodo(prefixo, prefixo + "\uffff"):
+            datas.extend(self._dias_mes(mes))
+        return datas
+
+    def totais(self, mes):
+        return self._manifesto["meses"].get(mes, {}).get("totais")
+
+    def revisao(self, mes):
+        """Revisão gravada do mês (muda a cada gravação, de qualquer processo; None se nunca gravado)."""
+        return self._manifesto["meses"].get(mes, {}).get("rev")
+
+    def definir_totais(self, mes, totais):
+        """Guarda totais recalculados; são gravados no manifesto em segundo plano."""
+        with self._trava:
+            if mes in self._manifesto["meses"]:
+                self._manifesto["meses"][mes]["totais"] = totais
+                self._totais_pendentes.add(mes)
+        GRAVADOR.agendar((self.pasta, ARQUIVO_MANIFESTO), self._gravar_totais)
+
+    # --- Qualidade dos dados ---
+    def validado(self):
+        return self._manifesto.get("validado") == VERSAO_VALIDACAO
+
+    def validar(self):
+        """
+        Varredura de qualidade, uma vez por VERSAO_VALIDACAO: dias com data inválida saem dos dados e
+        dias com campos inválidos são corrigidos (ver sanear_dia); os originais vão para a quarentena.
+        Marca o manifesto como validado. Retorna os itens quarentenados (lista vazia se estava tudo certo).
+        """
+        if self.validado() or not self.existe():
+            return []
+        itens = []
+        with self._trava:
+            for mes in list(self.meses()):
+                validos, itens_mes = separar_invalidos(self.particao(mes))
+                for item in itens_mes:
+                    if item["data"] in validos:
+                        self[item["data"]] = validos[item["data"]]
+                    else:
+                        del self[item["data"]]
+                itens.extend(itens_mes)
+        self.salvar(esperar=True)
+        self.quarentenar(itens)
+
+        with trava_arquivo(os.path.join(self.pasta, ARQUIVO_TRAVA)):
+            manifesto_disco = self._ler_manifesto_disco()
+            manifesto_disco["validado"] = VERSAO_VALIDACAO
+            self._gravar_manifesto_disco(manifesto_disco)
+        self._manifesto["validado"] = VERSAO_VALIDACAO
+        return itens
+
+    def trocar_por(self, preparado):
+        """
+        Troca todo o conteúdo da pasta pelo de outro DadosParticionados já gravado em disco (restauração;
+        o conteúdo dele já passou por sanear_dia). Tudo roda sob a trava da pasta: as partições novas
+        entram por os.replace, as que sobraram são apagadas e o manifesto, gravado por último, é o ponto
+        de virada. Cada mês ganha uma rev nova, então os outros processos relêem tudo na próxima
+        sincronização. Alterações desta instância ainda não gravadas são descartadas.
+        """
+        with trava_arquivo(os.path.join(self.pasta, ARQUIVO_TRAVA)):
+            atual = self._ler_manifesto_disco()
+            novo = preparado._ler_manifesto_disco()
+            for mes, entrada in novo["meses"].items():
+                entrada["rev"] = atual["meses"].get(mes, {}).get("rev", 0) + 1
+                os.replace(preparado._caminho_particao(mes), self._caminho_particao(mes))
+            for mes in atual["meses"]:
+                if mes not in novo["meses"] and os.path.exists(self._caminho_particao(mes)):
+                    os.remove(self._caminho_particao(mes))
+            novo["validado"] = VERSAO_VALIDACAO
+            self._gravar_manifesto_disco(novo)
+            with self._trava:
+                self._manifesto = novo
+                self._particoes.clear()
+                self._base.clear()
+                self._mudancas.clear()
+                self._fila.clear()
+                self._totais_pendentes.clear()
+                self._meses_ordenados = None
+                self._mtime_manifesto = None
+                self.versao += 1
+
+    def quarentenar(self, itens):
+        """Acrescenta itens (ver separar_invalidos) ao arquivo de quarentena da pasta."""
+        if not itens:
+            return
+        caminho = os.path.join(self.pasta, ARQUIVO_QUARENTENA)
+        with trava_arquivo(os.path.join(self.pasta, ARQUIVO_TRAVA)):
+            quarentena = {"itens": []}
+            if os.path.exists(caminho):
+                with open(caminho, "r", encoding="utf-8") as f:
+                    quarentena = json.load(f)
+            quarentena["itens"].extend(itens)
+            gravar_arquivo_atomico(caminho, json.dumps(quarentena, ensure_ascii=False, indent=2).encode("utf-8"))
+
+    # --- Persistência ---
+    def marcar_alterado(self, data):
+        with self._trava:
+            self._mudancas.setdefault(mes_da_chave(data), set()).add(data)
+            self.versao += 1
+
+    def marcar_tudo_alterado(self):
+        """Força a regravação de todas as partições (ex: troca de formato)."""
+        for mes in self.meses():
+            for data in list(self.particao(mes)):
+                self.marcar_alterado(data)
+
+    def salvar(self, esperar=True):
+        """
+        Enfileira os dias alterados no GRAVADOR (a serialização e a escrita rodam na thread dele).
+        Com esperar=True só retorna quando tudo estiver no disco.
+        """
+        with self._trava:
+            for mes, datas in self._mudancas.items():
+                particao = self._particoes.get(mes, {})
+                fila_mes = self._fila.setdefault(mes, {})
+                for data in datas:
+                    local = copiar_dia(particao[data]) if data in particao else None
+                    if data in fila_mes:
+                        fila_mes[data][1] = local  # Mantém a base original, atualiza o local
+                    else:
+                        fila_mes[data] = [self._base.get(mes, {}).get(data), local]
+                GRAVADOR.agendar((self.pasta, mes), lambda m=mes: self._gravar_mes(m))
+            self._mudancas.clear()
+        if esperar:
+            GRAVADOR.aguardar()
+
+    def _gravar_mes(self, mes):
+        """Roda no GRAVADOR: trava a pasta, relê o mês do disco, mescla e grava partição + manifesto."""
+        with trava_arquivo(os.path.join(self.pasta, ARQUIVO_TRAVA)):
+            with self._trava:
+                pendentes = self._fila.pop(mes, {})
+                self._gravando.add(mes)
+            try:
+                disco = self._ler_particao_disco(mes)
+                for data, (base, local) in pendentes.items():
+                    final = mesclar_dia(base, local, disco.get(data))
+                    if final is None:
+                        disco.pop(data, None)
+                    else:
+                        disco[data] = final
+
+                caminho = self._caminho_particao(mes)
+                if disco:
+                    gravar_arquivo_atomico(caminho, serializar_dados(disco, self.formato))
+                elif os.path.exists(caminho):
+                    os.remove(caminho)
+
+                resumir = self.resumir
+                totais = resumir(mes, disco) if (resumir and disco) else None
+                manifesto_disco = self._ler_manifesto_disco()
+                if disco:
+                    # "rev" muda a cada gravação do mês: é o que os outros processos comparam
+                    rev = manifesto_disco["meses"].get(mes, {}).get("rev", 0) + 1
+                    manifesto_disco["meses"][mes] = {"dias": sorted(disco), "totais": totais, "rev": rev}
                 else:
-                    observacao = "FOLGA"
-            elif eh_feriado:
-                observacao = "FERIADO"
-            elif dt_obj.weekday() >= 5:
-                observacao = "FIM DE SEMANA"
-
-            registros.append({
-                "Data": datetime.strptime(data, "%Y-%m-%d").strftime("%d/%m/%Y"),
-                "Dia da Semana": dia_semana,
-                "Batidas": batidas_str,
-                "Horas Trabalhadas": self.formatar_duracao(trabalhado),
-                "Saldo do Dia": self.formatar_duracao(saldo),
-                "Ajuste Manual (min)": ajuste,
-                "Observação": observacao
-            })
-        return pd.DataFrame(registros)
-
-    # --- IMPORTAÇÃO PDF INTELIGENTE (HÍBRIDA) ---
-    def calcular_hash_arquivo(self, caminho_pdf):
-        try:
-            with open(caminho_pdf, "rb") as f:
-                return hashlib.sha256(f.read()).hexdigest()
-        except Exception:
-            return None
-
-    def processar_pdf(self, caminho_arquivo, substituir=False):
-        if not pdfplumber:
-            return "error", "Biblioteca pdfplumber não instalada."
-
-        novo_hash = self.calcular_hash_arquivo(caminho_arquivo)
-        ultimo_hash = self.config.get("ultimo_hash_pdf")
-
-        if (ultimo_hash == novo_hash) and (not substituir):
-            return "duplicate", "Arquivo já importado."
-
-        dados_temp = {}
-        count_total = 0
-
-        print("-" * 30)
-        print(f"LENDO ARQUIVO: {caminho_arquivo}")
-
-        try:
-            with pdfplumber.open(caminho_arquivo) as pdf:
-                for i, page in enumerate(pdf.pages):
-                    print(f"--- Processando Página {i + 1} ---")
-
-                    leu_tabela_na_pagina = False  # Flag para evitar ler texto se já leu tabela
-
-                    # TENTA LER TABELAS
-                    tabelas = page.extract_tables()
-
-                    # Se achou tabelas, processa linha a linha
-                    if tabelas:
-                        for tabela in tabelas:
-                            for linha in tabela:
-                                # Verifica se a linha tem pelo menos 2 colunas (Data e Batidas)
-                                if len(linha) >= 2:
-                                    # Junta APENAS coluna 0 e 1 (Ignora Ajustes e Resultados)
-                                    raw_data = str(linha[0] or "")
-                                    raw_batidas = str(linha[1] or "")
-
-                                    linha_limpa = f"{raw_data} {raw_batidas}".replace("\n", " ")
-
-                                    if len(linha_limpa) > 5:
-                                        self._extrair_e_adicionar(linha_limpa, dados_temp)
-                                        leu_tabela_na_pagina = True
-
-                    # TENTA LER TEXTO (FALLBACK)
-                    # Só lê texto se NÃO conseguiu ler tabela nesta página
-                    if not leu_tabela_na_pagina:
-                        texto = page.extract_text()
-                        if texto:
-                            for linha_txt in texto.split('\n'):
-                                # Filtra linhas perigosas (Resultados)
-                                if "Banco de Horas" not in linha_txt and "Previstas" not in linha_txt:
-                                    if len(linha_txt) > 5:
-                                        self._extrair_e_adicionar(linha_txt, dados_temp)
-
-            if not dados_temp:
-                print("ERRO: Nenhuma data válida encontrada no dicionário final.")
-                return "error", "Não foi possível identificar datas. Verifique o terminal para detalhes."
-
-            # GRAVAÇÃO
-            datas_processadas = []
-            for data, lista_horas in dados_temp.items():
-                lista_limpa = sorted(list(set(lista_horas)))
-
-                if substituir:
-                    # Atualiza/Substitui o dia
-                    self.dados[data] = {"batidas": lista_limpa, "ajuste_manual": 0, "folga": False}
-                    count_total += len(lista_limpa)
+                    manifesto_disco["meses"].pop(mes, None)
+                self._gravar_manifesto_disco(manifesto_disco)
+            except Exception:
+                # Devolve as alterações para a fila; a próxima gravação tenta de novo
+                with self._trava:
+                    fila_mes = self._fila.setdefault(mes, {})
+                    for data, par in pendentes.items():
+                        if data in fila_mes:
+                            fila_mes[data][0] = par[0]
+                        else:
+                            fila_mes[data] = par
+                raise
+            finally:
+                with self._trava:
+                    self._gravando.discard(mes)
+
+            with self._trava:
+                self._aplicar_disco(mes, disco, totais, manifesto_disco, pendentes)
+
+    def _aplicar_disco(self, mes, disco, totais, manifesto_disco, escritos):
+        """Atualiza a memória com o resultado da mescla, sem pisar em alterações locais mais novas."""
+        base_mes = self._base.setdefault(mes, {})
+        fila_mes = self._fila.get(mes, {})
+        pendentes = self._mudancas.get(mes, set()) | set(fila_mes)
+        for data in set(base_mes) | set(disco) | set(escritos):
+            if data in pendentes:
+                if data in escritos:
+                    # O dia mudou de novo enquanto gravávamos: a próxima mescla parte do que foi escrito
+                    nova_base = rebase_dia(escritos[data][1], disco.get(data))
+                    if nova_base is None:
+                        base_mes.pop(data, None)
+                    else:
+                        base_mes[data] = nova_base
+                    if data in fila_mes:
+                        fila_mes[data][0] = nova_base
+                continue
+            if data in disco:
+                base_mes[data] = copiar_dia(disco[data])
+            else:
+                base_mes.pop(data, None)
+
+        memoria = self._particoes.get(mes)
+        if memoria is not None:
+            for data in set(memoria) | set(disco):
+                if data in pendentes:
+                    continue
+                if data in disco:
+                    memoria[data] = copiar_dia(disco[data])
                 else:
-                    # Modo seguro: Adiciona se não existir
-                    if data not in self.dados: self.dados[data] = {"batidas": [], "ajuste_manual": 0, "folga": False}
-                    for h in lista_limpa:
-                        if h not in self.dados[data]["batidas"]:
-                            self.dados[data]["batidas"].append(h)
-                            count_total += 1
-                    self.dados[data]["batidas"].sort()
-
-            self.config["ultimo_hash_pdf"] = novo_hash
-            self.salvar_config(None, None, None, None)
-            self.salvar_dados()
-
-            ultima_data = sorted(datas_processadas)[-1] if datas_processadas else "N/A"
-            print(f"SUCESSO: {count_total} batidas importadas. Última data: {ultima_data}")
-
-            return "ok", f"Sucesso! {count_total} batidas. (Última: {ultima_data})"
+                    memoria.pop(data, None)
+            dias = sorted(memoria)
+        else:
+            dias = sorted(set(disco) | pendentes)
+        if dias:
+            rev = manifesto_disco["meses"].get(mes, {}).get("rev", 0)
+            self._manifesto["meses"][mes] = {"dias": dias, "totais": None if pendentes else totais, "rev": rev}
+        else:
+            self._manifesto["meses"].pop(mes, None)
+        self._meses_ordenados = None
 
-        except Exception as ex:
-            print(f"ERRO CRÍTICO: {ex}")
-            return "error", f"Erro crítico: {ex}"
+        self._adotar_manifesto(manifesto_disco, ignorar=mes)
+        self.versao += 1
 
-    def _extrair_e_adicionar(self, texto_linha, dic_dados):
+    def _adotar_manifesto(self, manifesto_disco, ignorar=None):
+        """
+        Adota os meses que outros processos gravaram (rev diferente da nossa): a partição em memória
+        é descartada e relida do disco no próximo acesso. Meses com alterações locais ficam de fora,
+        a mescla da próxima gravação cuida deles. Retorna True se algo mudou.
+        """
+        mudou = False
+        for mes, entrada in manifesto_disco["meses"].items():
+            if mes == ignorar or self._mes_ocupado(mes):
+                continue
+            atual = self._manifesto["meses"].get(mes)
+            if atual is None or atual.get("rev") != entrada.get("rev") or atual["dias"] != entrada["dias"]:
+                self._manifesto["meses"][mes] = entrada
+                self._meses_ordenados = None
+                self._particoes.pop(mes, None)
+                self._base.pop(mes, None)
+                mudou = True
+        for mes in list(self._manifesto["meses"]):
+            # Mês esvaziado por outro processo
+            if mes not in manifesto_disco["meses"] and mes != ignorar and not self._mes_ocupado(mes):
+                del self._manifesto["meses"][mes]
+                self._meses_ordenados = None
+                self._particoes.pop(mes, None)
+                self._base.pop(mes, None)
+                mudou = True
+        return mudou
+
+    def sincronizar(self):
         """
-        Extrai data e horas de uma string suja.
+        Invalidação entre processos (modo com vários workers): se o manifesto mudou no disco desde
+        a última olhada, adota os meses alterados por outros processos e muda `versao`, o que
+        invalida os caches das sessões. Custa um os.stat quando nada mudou.
         """
+        caminho = os.path.join(self.pasta, ARQUIVO_MANIFESTO)
         try:
-            # 1. ENCONTRAR DATA (Regex robusto)
-            # Regex: (2 digitos) + (separador opcional) + (2 digitos) + (separador opcional) + (4 digitos)
-            match_data = re.search(r"(\d{2})[\W_]*(\d{2})[\W_]*(\d{4})", texto_linha)
-
-            if match_data:
-                dia, mes, ano = match_data.groups()
-
-                # Validação de segurança
-                if int(mes) > 12 or int(mes) < 1 or int(dia) > 31:
-                    return
-
-                # Monta a data ISO
-                data_iso = f"{ano}-{mes}-{dia}"
-
-                # 2. ENCONTRAR HORAS
-                # Procura padrao HH:MM
-                horas = re.findall(r"(\d{2}:\d{2})", texto_linha)
-
-                # Filtra horas inválidas (ex: 99:99 ou horas > 24)
-                horas_reais = []
-                for h in horas:
-                    hh, mm = map(int, h.split(':'))
-                    if hh <= 24 and mm < 60:
-                        horas_reais.append(h)
-
-                if horas_reais:
-                    if data_iso not in dic_dados: dic_dados[data_iso] = []
-                    dic_dados[data_iso].extend(horas_reais)
-        except Exception as e:
-            pass
-
-
-# --- INTERFACE GRÁFICA ---
-
-def main(page: ft.Page):
-    app = ControlePontoApp()
-
-    page.locale_configuration = ft.LocaleConfiguration(
-        supported_locales=[ft.Locale("pt", "BR"), ft.Locale("en", "US")],
-        current_locale=ft.Locale("pt", "BR")
-    )
-    page.locale = "pt-BR"
-    page.title = "Controle de Ponto - Renan"
-
-    tema_salvo = app.config.get("tema_inicial", "light")
-    page.theme_mode = ft.ThemeMode.DARK if tema_salvo == "dark" else ft.ThemeMode.LIGHT
-
-    page.window_width = 1200
-    page.window_height = 900
-    page.padding = 20
-    page.scroll = ft.ScrollMode.AUTO
-
-    # Variáveis de Estado
-    data_manual_temp = None
-    data_edicao_atual = None
-    var_mes_export = None
-    var_formato_export = "xlsx"
-
-    # --- FUNÇÃO AUXILIAR: MÁSCARA AUTOMÁTICA PARA HORA ---
-    def formatar_hora_input(e):
-        """Formata automaticamente o input de hora para HH:MM enquanto digita."""
-        valor_raw = e.control.value
-        sinal = "-" if valor_raw.startswith("-") else ""
-        digitos = "".join(filter(str.isdigit, valor_raw))
-        if len(digitos) > 4: digitos = digitos[:4]
-        novo_valor = f"{sinal}{digitos[:2]}:{digitos[2:]}" if len(digitos) > 2 else f"{sinal}{digitos}"
-        if e.control.value != novo_valor:
-            e.control.value = novo_valor
-            e.control.update()
-
-    # --- COMPONENTES AUXILIARES ---
-
-    def mostrar_mensagem(texto, cor=ft.Colors.GREEN):
-        snack = ft.SnackBar(ft.Text(texto), bgcolor=cor)
-        page.overlay.append(snack)
-        snack.open = True
-        page.update()
-
-    # --- FILE PICKERS (Backup/Restore/Export/Import) ---
-
-    def importar_pdf_result(e):
-        if not e.files: return
-
-        # 1. Limpa a tela (fecha configs)
-        dlg_config.open = False
-        page.update()
-
-        caminho = e.files[0].path
-        print(f"\n--- INICIANDO IMPORTAÇÃO ---")
-        print(f"Arquivo: {caminho}")
-
-        # 2. Mostra barra de carregamento
-        snack_loading = ft.SnackBar(
-            content=ft.Text("Processando PDF... Aguarde...", color=ft.Colors.WHITE),
-            bgcolor=ft.Colors.BLUE_800,
-            duration=20000,  # Duração longa para não sumir antes da hora
-        )
-        page.overlay.append(snack_loading)
-        snack_loading.open = True
-        page.update()
-
-        # 3. Processa (Pode demorar um pouco)
-        import time
-        # Pequena pausa para garantir que a UI atualizou a barra azul
-        time.sleep(0.5)
-
-        status, msg = app.processar_pdf(caminho, substituir=False)
-        print(f"Status: {status} | Msg: {msg}")
-
-        # 4. REMOVE a barra de carregamento IMEDIATAMENTE
-        snack_loading.open = False
-        page.update()
-
-        # 5. Tratamento de Duplicado
-        if status == "duplicate":
-            def confirmar_subst(evt):
-                dlg_duplicado.open = False
-                page.update()
-
-                # Força substituição
-                st2, m2 = app.processar_pdf(caminho, substituir=True)
-
-                app.dados = app.carregar_dados()
-                atualizar_tabela()
-
-                # Aviso final
-                cor = ft.Colors.GREEN if st2 == "ok" else ft.Colors.RED
-                page.overlay.append(ft.SnackBar(ft.Text(f"Resultado: {m2}"), bgcolor=cor, open=True))
-                page.update()
-
-            dlg_duplicado = ft.AlertDialog(
-                title=ft.Text("Arquivo Duplicado"),
-                content=ft.Text(
-                    "Este arquivo já foi importado anteriormente.\nDeseja processar novamente e substituir os dados?"),
-                actions=[
-                    ft.TextButton("Cancelar",
-                                  on_click=lambda _: setattr(dlg_duplicado, 'open', False) or page.update()),
-                    ft.TextButton("Sim, Substituir", on_click=confirmar_subst),
-                ]
-            )
-            page.dialog = dlg_duplicado
-            dlg_duplicado.open = True
-            page.update()
-
-        else:
-            # SUCESSO OU ERRO
-            cor = ft.Colors.GREEN if status == "ok" else ft.Colors.RED
-
-            if status == "ok":
-                app.dados = app.carregar_dados()
-                atualizar_tabela()
-
-            # Popup de confirmação (mais visível que SnackBar)
-            dlg_resultado = ft.AlertDialog(
-                title=ft.Text("Resultado da Importação"),
-                content=ft.Text(msg),
-                actions=[ft.TextButton("OK", on_click=lambda _: setattr(dlg_resultado, 'open', False) or page.update())]
-            )
-            page.dialog = dlg_resultado
-            dlg_resultado.open = True
-            page.update()
-
-    def salvar_backup_result(e):
-        if e.path:
-            try:
-                shutil.copy(ARQUIVO_DADOS, e.path)
-                mostrar_mensagem("Backup salvo com sucesso!", ft.Colors.GREEN)
-            except Exception as ex:
-                mostrar_mensagem(f"Erro ao salvar backup: {ex}", ft.Colors.RED)
-
-    def restaurar_backup_result(e):
-        if e.files:
-            try:
-                shutil.copy(e.files[0].path, ARQUIVO_DADOS)
-                app.dados = app.carregar_dados()
-                atualizar_tabela()
-                mostrar_mensagem("Dados restaurados com sucesso!", ft.Colors.GREEN)
-            except Exception as ex:
-                mostrar_mensagem(f"Erro ao restaurar: {ex}", ft.Colors.RED)
-
-    def exportar_result(e):
-        if not e.path:
-            return
-        try:
-            df = app.gerar_dataframe_exportacao(var_mes_export)
-
-            if var_formato_export == "xlsx":
-                df.to_excel(e.path, index=False)
-            else:
-                pdf = FPDF()
-                pdf.add_page()
-                pdf.set_font("Arial", size=10)
-                pdf.cell(200, 10, txt="Relatorio de Ponto", ln=1, align='C')
-                pdf.ln(10)
-                for col in df.columns:
-                    w = 40 if col == "Batidas" else 25
-                    pdf.cell(w, 10, str(col)[:12], border=1)
-                pdf.ln()
-                for i in range(len(df)):
-                    for col in df.columns:
-                        w = 40 if col == "Batidas" else 25
-                        val = str(df.iloc[i][col])
-                        pdf.cell(w, 10, val, border=1)
-                    pdf.ln()
-                pdf.output(e.path)
-
-            mostrar_mensagem(f"Arquivo salvo em: {e.path}", ft.Colors.GREEN)
-            dlg_exportar.open = False
-            page.update()
-        except Exception as ex:
-            mostrar_mensagem(f"Erro na exportação: {ex}", ft.Colors.RED)
-
-    # --- DEFINIÇÃO DOS FILE PICKERS ---
-    fp_importar_pdf = ft.FilePicker(on_result=importar_pdf_result)  # CORREÇÃO AQUI
-    fp_backup = ft.FilePicker(on_result=salvar_backup_result)
-    fp_restore = ft.FilePicker(on_result=restaurar_backup_result)
-    fp_export = ft.FilePicker(on_result=exportar_result)
-
-    page.overlay.extend([fp_backup, fp_restore, fp_export, fp_importar_pdf])
-
-    # --- DIALOGO CONFIGURAÇÕES (AVANÇADO) ---
-
-    tf_meta = ft.TextField(label="Meta Diária (h)", value=str(app.config.get("meta_diaria", 8)), width=100)
-    tf_fator_util = ft.TextField(label="Fator Extra Dia Útil (Ex: 1.0 ou 1.5)",
-                                 value=str(app.config.get("fator_dia_util", 1.0)), width=250)
-    tf_fator_fds = ft.TextField(label="Fator Extra FDS (Ex: 2.0)", value=str(app.config.get("fator_fds", 2.0)),
-                                width=250)
-    dd_tema = ft.Dropdown(
-        label="Tema Padrão",
-        width=150,
-        options=[ft.dropdown.Option("light", "Claro"), ft.dropdown.Option("dark", "Escuro")],
-        value=app.config.get("tema_inicial", "light")
-    )
-
-    def salvar_configuracoes(e):
-        try:
-            meta = int(tf_meta.value)
-            f_util = float(tf_fator_util.value)
-            f_fds = float(tf_fator_fds.value)
-            tema = dd_tema.value
-
-            app.salvar_config(meta, f_util, f_fds, tema)
-
-            # Aplica o tema imediatamente
-            page.theme_mode = ft.ThemeMode.DARK if tema == "dark" else ft.ThemeMode.LIGHT
-            footer.bgcolor = ft.Colors.GREY_900 if tema == "dark" else ft.Colors.BLUE_GREY_50
-
-            mostrar_mensagem("Configurações salvas! Tabela recalculada.")
-            atualizar_tabela()
-            dlg_config.open = False
-            page.update()
-        except:
-            mostrar_mensagem("Erro: Verifique os números digitados.", ft.Colors.RED)
-
-    dlg_config = ft.AlertDialog(
-        title=ft.Text("Configurações Gerais"),
-        content=ft.Container(
-            content=ft.Column([
-                ft.Text("Regras de Banco de Horas", weight="bold", size=16),
-                ft.Row([tf_meta, dd_tema]),
-                ft.Text("Multiplicadores:", weight="bold"),
-                tf_fator_util,
-                tf_fator_fds,
-                ft.Divider(),
-                ft.Text("Dados & Backup", weight="bold", size=16),
-                ft.Row([
-                    ft.ElevatedButton("Fazer Backup", icon=ft.Icons.SAVE, on_click=lambda _: fp_backup.save_file(
-                        file_name=f"backup_ponto_{datetime.now().strftime('%Y%m%d')}.json")),
-                    ft.ElevatedButton("Restaurar", icon=ft.Icons.RESTORE_PAGE,
-                                      on_click=lambda _: fp_restore.pick_files(allowed_extensions=["json"])),
-                ]),
-                # BOTÃO IMPORTAR PDF
-                ft.ElevatedButton("Importar PDF", icon=ft.Icons.PICTURE_AS_PDF, bgcolor=ft.Colors.RED_100,
-                                  color=ft.Colors.RED,
-                                  on_click=lambda _: fp_importar_pdf.pick_files(allowed_extensions=["pdf"])),
-            ], spacing=15, scroll=ft.ScrollMode.AUTO),
-            height=500, width=500
-        ),
-        actions=[ft.TextButton("Salvar Alterações", on_click=salvar_configuracoes)]
-    )
-
-    # --- DIALOGO EXPORTAR ---
-
-    def acao_escolher_tipo_export(e, tipo):
-        nonlocal var_mes_export
-        if tipo == "relatorio":
-            var_mes_export = datetime.now().strftime("%Y-%m")
-            tab_export.selected_index = 2
-        else:
-            tab_export.selected_index = 1
-        page.update()
-
-    def acao_escolher_mes_export(e):
-        nonlocal var_mes_export
-        var_mes_export = dd_mes_export.value
-        tab_export.selected_index = 2
-        page.update()
-
-    def acao_escolher_formato_export(e, fmt):
-        nonlocal var_formato_export
-        var_formato_export = fmt
-        ext = "xlsx" if fmt == "xlsx" else "pdf"
-        nome_arq = f"Relatorio_Ponto_{datetime.now().strftime('%Y%m%d')}.{ext}"
-        fp_export.save_file(file_name=nome_arq, allowed_extensions=[ext])
-
-    dd_mes_export = ft.Dropdown(
-        label="Selecione o Período",
-        options=[ft.dropdown.Option(key=None, text="Todo o Histórico")] +
-                [ft.dropdown.Option(key=f"2025-{m:02d}", text=f"{m:02d}/2025") for m in range(1, 13)]
-    )
-
-    tab_export = ft.Tabs(
-        selected_index=0,
-        animation_duration=300,
-        tabs=[
-            ft.Tab(
-                text="1. Tipo",
-                content=ft.Column([
-                    ft.Text("O que deseja exportar?", size=16, weight="bold"),
-                    ft.ElevatedButton("Relatório Mensal (Mês Atual)",
-                                      on_click=lambda e: acao_escolher_tipo_export(e, "relatorio"), width=300),
-                    ft.ElevatedButton("Planilha Completa (Selecionar)",
-                                      on_click=lambda e: acao_escolher_tipo_export(e, "planilha"), width=300),
-                ], spacing=20, alignment=ft.MainAxisAlignment.CENTER)
-            ),
-            ft.Tab(
-                text="2. Período",
-                content=ft.Column([
-                    ft.Text("Qual período deseja?", size=16, weight="bold"),
-                    dd_mes_export,
-                    ft.ElevatedButton("Próximo >", on_click=acao_escolher_mes_export)
-                ], spacing=20, alignment=ft.MainAxisAlignment.CENTER)
-            ),
-            ft.Tab(
-                text="3. Formato",
-                content=ft.Column([
-                    ft.Text("Qual formato de arquivo?", size=16, weight="bold"),
-                    ft.Row([
-                        ft.ElevatedButton("Excel (.xlsx)", icon=ft.Icons.TABLE_VIEW,
-                                          on_click=lambda e: acao_escolher_formato_export(e, "xlsx")),
-                        ft.ElevatedButton("PDF (.pdf)", icon=ft.Icons.PICTURE_AS_PDF,
-                                          on_click=lambda e: acao_escolher_formato_export(e, "pdf")),
-                    ], alignment=ft.MainAxisAlignment.CENTER)
-                ], spacing=20, alignment=ft.MainAxisAlignment.CENTER)
-            )
-        ]
-    )
-
-    dlg_exportar = ft.AlertDialog(
-        title=ft.Text("Exportar Dados"),
-        content=ft.Container(content=tab_export, width=400, height=300)
-    )
-
-    # --- DIALOGO DE EDIÇÃO GRANULAR ---
-
-    lv_batidas = ft.ListView(expand=True, spacing=10, height=150)
-
-    # Input Nova Batida com MÁSCARA e ENTER
-    input_nova_batida = ft.TextField(
-        hint_text="00:00", width=100, text_align=ft.TextAlign.CENTER,
-        on_change=formatar_hora_input,  # Máscara
-        on_submit=lambda e: adicionar_batida_individual(e)  # Enter
-    )
-
-    def salvar_alteracao_batida(e, data, hora_antiga, novo_valor):
-        try:
-            datetime.strptime(novo_valor, "%H:%M")
-            app.atualizar_batida(data, hora_antiga, novo_valor)
-            mostrar_mensagem("Horário atualizado com sucesso!")
-            carregar_lista_edicao(data)
-            atualizar_tabela()
-        except ValueError:
-            mostrar_mensagem("Formato inválido! Use HH:MM", ft.Colors.RED)
-
-    def carregar_lista_edicao(data):
-        lv_batidas.controls.clear()
-        batidas = app.dados.get(data, {}).get("batidas", [])
-
-        if not batidas:
-            lv_batidas.controls.append(ft.Text("Nenhuma batida registrada.", color=ft.Colors.GREY))
-
-        cor_item = ft.Colors.GREY_200 if page.theme_mode == ft.ThemeMode.LIGHT else ft.Colors.GREY_800
-
-        for b in batidas:
-            # Campo existente com MÁSCARA e ENTER
-            txt_hora = ft.TextField(
-                value=b,
-                width=80,
-                height=40,
-                content_padding=5,
-                text_align=ft.TextAlign.CENTER,
-                text_size=14,
-                on_change=formatar_hora_input,  # Máscara
-                on_submit=lambda e, h=b: salvar_alteracao_batida(e, data, h, e.control.value)  # Enter
-            )
-
-            btn_salvar = ft.IconButton(
-                icon=ft.Icons.CHECK_CIRCLE,
-                icon_color=ft.Colors.GREEN,
-                tooltip="Salvar Alteração",
-                on_click=lambda e, h=b, t=txt_hora: salvar_alteracao_batida(e, data, h, t.value)
-            )
-
-            btn_excluir = ft.IconButton(
-                icon=ft.Icons.DELETE_OUTLINE,
-                icon_color=ft.Colors.RED,
-                tooltip="Apagar esta batida",
-                on_click=lambda e, h=b, d=data: remover_batida_individual(d, h)
-            )
-
-            row = ft.Row([
-                ft.Icon(ft.Icons.ACCESS_TIME, size=16),
-                txt_hora,
-                btn_salvar,
-                btn_excluir
-            ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
-
-            lv_batidas.controls.append(ft.Container(content=row, bgcolor=cor_item, padding=5, border_radius=5))
-
-        page.update()
-
-    def remover_batida_individual(data, hora):
-        app.remover_batida(data, hora)
-        carregar_lista_edicao(data)
-        atualizar_tabela()
-        mostrar_mensagem(f"Batida {hora} removida.")
-
-    def adicionar_batida_individual(e):
-        hora = input_nova_batida.value
-        try:
-            datetime.strptime(hora, "%H:%M")
-            app.registrar_batida(data_edicao_atual, hora)
-            input_nova_batida.value = ""
-            carregar_lista_edicao(data_edicao_atual)
-            atualizar_tabela()
-        except:
-            mostrar_mensagem("Formato inválido. Use HH:MM", ft.Colors.RED)
-
-    def abrir_edicao(e):
-        nonlocal data_edicao_atual
-        data_edicao_atual = e.control.data
-        carregar_lista_edicao(data_edicao_atual)
-        page.dialog = dlg_editar
-        dlg_editar.open = True
-        page.update()
-
-    dlg_editar = ft.AlertDialog(
-        title=ft.Text("Gerenciar Batidas"),
-        content=ft.Container(
-            content=ft.Column([
-                ft.Text("Edite ou remova batidas específicas:"),
-                ft.Divider(),
-                lv_batidas,
-                ft.Divider(),
-                ft.Row([
-                    ft.Text("Adicionar Nova:"),
-                    input_nova_batida,
-                    ft.IconButton(ft.Icons.ADD_CIRCLE, icon_color=ft.Colors.BLUE, on_click=adicionar_batida_individual)
-                ], alignment=ft.MainAxisAlignment.CENTER)
-            ]),
-            width=400, height=400
-        ),
-        actions=[
-            ft.TextButton("Concluir", on_click=lambda e: setattr(dlg_editar, 'open', False) or page.update()),
-        ],
-    )
-
-    # --- DIALOGO AJUSTE MANUAL ---
-
-    dlg_ajuste_input = ft.TextField(
-        label="Valor (ex: 60 ou 01:00)", hint_text="Minutos ou HH:MM",
-        on_change=formatar_hora_input,
-        on_submit=lambda e: salvar_ajuste_click(e)
-    )
-    dlg_ajuste_data_ref = ft.Text(visible=False)
-
-    def salvar_ajuste_click(e):
-        val_minutos = app.converter_input_tempo_para_minutos(dlg_ajuste_input.value)
-        app.ajustar_manual(dlg_ajuste_data_ref.value, val_minutos)
-        dlg_ajuste.open = False
-        atualizar_tabela()
-        mostrar_mensagem("Ajuste salvo!")
-
-    def abrir_ajuste(e):
-        data = e.control.data
-        dlg_ajuste_data_ref.value = data
-        ajuste_atual = app.dados[data].get("ajuste_manual", 0)
-        dlg_ajuste_input.value = app.formatar_duracao(ajuste_atual * 60)
-        page.dialog = dlg_ajuste
-        dlg_ajuste.open = True
-        page.update()
-
-    dlg_ajuste = ft.AlertDialog(
-        title=ft.Text("Ajuste Manual de Banco"),
-        content=ft.Column([
-            ft.Text("Adicione tempo (ex: 01:30) ou subtraia (ex: -00:15)"),
-            dlg_ajuste_data_ref,
-            dlg_ajuste_input
-        ], height=120),
-        actions=[ft.TextButton("Confirmar", on_click=salvar_ajuste_click)]
-    )
-
-    # --- DIALOGO FÉRIAS EM LOTE ---
-    txt_ini_ferias = ft.TextField(label="Início", width=120, read_only=True)
-    txt_fim_ferias = ft.TextField(label="Fim", width=120, read_only=True)
-
-    def confirmar_ferias_click(e):
-        if txt_ini_ferias.value and txt_fim_ferias.value:
-            app.registrar_ferias_lote(txt_ini_ferias.value, txt_fim_ferias.value)
-            dlg_ferias.open = False
-            atualizar_tabela()
-            mostrar_mensagem("Férias registradas com sucesso!")
-        else:
-            mostrar_mensagem("Selecione início e fim.", ft.Colors.RED)
-
-    def abrir_dp_ini(e):
-        page.open(dp_ini_ferias)
-
-    def abrir_dp_fim(e):
-        page.open(dp_fim_ferias)
-
-    dp_ini_ferias = ft.DatePicker(
-        on_change=lambda e: setattr(txt_ini_ferias, 'value', e.control.value.strftime("%Y-%m-%d")) or page.update()
-    )
-    dp_fim_ferias = ft.DatePicker(
-        on_change=lambda e: setattr(txt_fim_ferias, 'value', e.control.value.strftime("%Y-%m-%d")) or page.update()
-    )
-
-    dlg_ferias = ft.AlertDialog(
-        title=ft.Text("Registrar Férias"),
-        content=ft.Column([
-            ft.Text("Selecione o período para marcar como folga:"),
-            ft.Row([
-                txt_ini_ferias,
-                ft.IconButton(ft.Icons.CALENDAR_MONTH, on_click=abrir_dp_ini)
-            ]),
-            ft.Row([
-                txt_fim_ferias,
-                ft.IconButton(ft.Icons.CALENDAR_MONTH, on_click=abrir_dp_fim)
-            ])
-        ], height=200),
-        actions=[
-            ft.TextButton("Cancelar", on_click=lambda e: setattr(dlg_ferias, 'open', False) or page.update()),
-            ft.TextButton("Confirmar", on_click=confirmar_ferias_click),
-        ]
-    )
-
-    # --- DIALOGOS DE EXCLUSÃO E LIMPEZA ---
-
-    dlg_excluir_data_ref = ft.Text(visible=False)
-
-    def confirmar_exclusao_click(e):
-        app.excluir_dia(dlg_excluir_data_ref.value)
-        dlg_confirmar_exclusao.open = False
-        atualizar_tabela()
-        mostrar_mensagem("Dia excluído.")
-
-    def abrir_exclusao(e):
-        dlg_excluir_data_ref.value = e.control.data
-        page.dialog = dlg_confirmar_exclusao
-        dlg_confirmar_exclusao.open = True
-        page.update()
-
-    dlg_confirmar_exclusao = ft.AlertDialog(
-        title=ft.Text("Excluir Dia Inteiro?"),
-        content=ft.Column([ft.Text("Isso apagará todos os registros desta data."), dlg_excluir_data_ref], height=50),
-        actions=[
-            ft.TextButton("Cancelar",
-                          on_click=lambda e: setattr(dlg_confirmar_exclusao, 'open', False) or page.update()),
-            ft.TextButton("Sim, Excluir", on_click=confirmar_exclusao_click, style=ft.ButtonStyle(color=ft.Colors.RED)),
-        ]
-    )
-
-    def limpar_tudo_final(e):
-        app.limpar_tudo()
-        dlg_certeza_absoluta.open = False
-        atualizar_tabela()
-        mostrar_mensagem("Banco Reiniciado! (Histórico preservado)", ft.Colors.GREEN)
-
-    dlg_certeza_absoluta = ft.AlertDialog(
-        title=ft.Text("ZERAR BANCO?"),
-        content=ft.Text("Isso zerará o saldo total, começando a contagem de agora.\nO histórico antigo será mantido."),
-        actions=[
-            ft.TextButton("CANCELAR", on_click=lambda e: setattr(dlg_certeza_absoluta, 'open', False) or page.update()),
-            ft.TextButton("ZERAR", on_click=limpar_tudo_final,
-                          style=ft.ButtonStyle(color=ft.Colors.RED, bgcolor=ft.Colors.RED_50)),
-        ]
-    )
-
-    dlg_confirmar_limpeza = ft.AlertDialog(
-        title=ft.Text("Zerar Banco de Horas?"),
-        content=ft.Text("Deseja zerar o banco atual e começar um novo ciclo?"),
-        actions=[
-            ft.TextButton("Não", on_click=lambda e: setattr(dlg_confirmar_limpeza, 'open', False) or page.update()),
-            ft.TextButton("Sim", on_click=lambda e: (
-                    setattr(dlg_confirmar_limpeza, 'open', False) or setattr(dlg_certeza_absoluta, 'open',
-                                                                             True) or page.update()),
-                          style=ft.ButtonStyle(color=ft.Colors.RED)),
-        ]
-    )
-
-    # --- SISTEMA DE INSERÇÃO MANUAL ---
-
-    def abrir_calendario_manual(e):
-        page.open(date_picker)
-
-    def ao_escolher_data_manual(e):
-        nonlocal data_manual_temp
-        if date_picker.value:
-            data_manual_temp = date_picker.value
-            page.open(time_picker)
-
-    def ao_escolher_hora_manual(e):
-        if time_picker.value and data_manual_temp:
-            data_str = data_manual_temp.strftime("%Y-%m-%d")
-            hora_str = time_picker.value.strftime("%H:%M")
-            if app.registrar_batida(data_str, hora_str):
-                mostrar_mensagem(f"Inserido: {data_str} às {hora_str}")
-                atualizar_tabela()
-            else:
-                mostrar_mensagem("Horário já existe para este dia.", ft.Colors.ORANGE)
-
-    date_picker = ft.DatePicker(
-        on_change=ao_escolher_data_manual,
-        confirm_text="Confirmar", cancel_text="Cancelar",
-        help_text="Selecione a data",
-    )
-    time_picker = ft.TimePicker(
-        on_change=ao_escolher_hora_manual,
-        confirm_text="Confirmar", cancel_text="Cancelar",
-        help_text="Selecione o horário"
-    )
-
-    # --- ADICIONAR COMPONENTES AO OVERLAY ---
-    page.overlay.extend([
-        dlg_editar, dlg_ajuste, dlg_ferias,
-        dlg_confirmar_exclusao, dlg_confirmar_limpeza, dlg_certeza_absoluta,
-        dlg_exportar, dlg_config,
-        date_picker, time_picker, dp_ini_ferias, dp_fim_ferias,
-        fp_backup, fp_restore, fp_export, fp_importar_pdf
-    ])
-
-    # --- FUNÇÕES DA UI (BOTÕES) ---
-
-    def toggle_folga(e):
-        # Se clicou no Checkbox, é FOLGA MANUAL (is_ferias=False)
-        app.definir_folga(e.control.data, e.control.value, eh_ferias=False)
-        atualizar_tabela()
-
-    def bater_ponto_click(e):
-        msg = app.bater_ponto_agora()
-        mostrar_mensagem(msg)
-        atualizar_tabela()
-
-    def alternar_tema(e):
-        is_light = page.theme_mode == ft.ThemeMode.LIGHT
-        page.theme_mode = ft.ThemeMode.DARK if is_light else ft.ThemeMode.LIGHT
-        e.control.icon = ft.Icons.LIGHT_MODE if is_light else ft.Icons.DARK_MODE
-
-        # Atualiza cor do rodapé
-        footer.bgcolor = ft.Colors.GREY_900 if is_light else ft.Colors.BLUE_GREY_50
-
-        page.update()
-        atualizar_tabela()
-
-    # --- GRÁFICO VISUAL ---
-
-    chart = ft.LineChart(
-        data_series=[],
-        border=ft.border.all(1, ft.Colors.GREY_400),
-        left_axis=ft.ChartAxis(labels_size=40, title=ft.Text("Horas Saldo")),
-        bottom_axis=ft.ChartAxis(
-            labels_size=30,
-            title=ft.Text("Dia do Mês"),
-            labels_interval=1
-        ),
-        horizontal_grid_lines=ft.ChartGridLines(color=ft.Colors.GREY_200, width=1, dash_pattern=[3, 3]),
-        vertical_grid_lines=ft.ChartGridLines(color=ft.Colors.GREY_200, width=1),
-        tooltip_bgcolor=ft.Colors.with_opacity(0.9, ft.Colors.BLACK),
-        min_y=-10, max_y=10,
-        expand=True, height=250
-    )
-
-    # --- ALTERAÇÃO NO GRÁFICO (ROLAGEM HORIZONTAL) ---
-    container_grafico = ft.Container(
-        content=ft.Column([
-            ft.Text("Evolução do Banco no Mês:", weight="bold", size=16),
-            # Envolvemos o gráfico em uma Row com Scroll
-            ft.Row(
-                controls=[
-                    ft.Container(
-                        content=chart,
-                        width=1000,  # LARGURA FIXA: O gráfico sempre terá 1000px
-                        height=250  # Isso garante que ele fique "bonito" e rolável no celular
-                    )
-                ],
-                scroll=ft.ScrollMode.ALWAYS  # Habilita o scroll horizontal
-            )
-        ]),
-        padding=20,
-        bgcolor=ft.Colors.with_opacity(0.05, ft.Colors.BLUE),
-        border_radius=10,
-        visible=False,
-        margin=ft.margin.only(top=20, bottom=50)
-    )
-
-
-    # 1. CRIAÇÃO DA TABELA (Sem largura fixa para aceitar responsividade)
-    tabela = ft.DataTable(
-        columns=[
-            ft.DataColumn(ft.Text("Data", weight="bold")),
-            ft.DataColumn(ft.Text("Dia")),
-            ft.DataColumn(ft.Text("Batidas")),
-            ft.DataColumn(ft.Text("Horas")),
-            ft.DataColumn(ft.Text("Saldo (Puro)")),
-            ft.DataColumn(ft.Text("Ajuste (Manual)")),
-            ft.DataColumn(ft.Text("Ações")),
-        ],
-        heading_row_color=ft.Colors.BLUE_GREY_500,
-        data_row_min_height=55,
-        column_spacing=20,
-    )
-
-    # 2. LABELS DO RESUMO
-    lbl_trab_mes = ft.Text("00:00")
-    lbl_prev_mes = ft.Text("00:00")
-    lbl_banco_mes = ft.Text("00:00", weight="bold")
-    lbl_banco_ant = ft.Text("00:00")
-    lbl_banco_total = ft.Text("00:00", weight="bold", size=16)
-
-    linha_resumo_1 = ft.Row([
-        ft.Column([ft.Text("Trabalhado"), lbl_trab_mes]),
-        ft.Column([ft.Text("Previsto"), lbl_prev_mes]),
-        ft.Column([ft.Text("Banco Mês"), lbl_banco_mes]),
-        ft.Column([ft.Text("Banco Ant."), lbl_banco_ant]),
-        ft.Column([ft.Text("TOTAL GERAL"), lbl_banco_total]),
-    ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
-
-    # 3. CRIAÇÃO DOS BOTÕES E INPUTS (Importante criar antes de usar)
-    # Precisamos criar o filtro aqui para a função 'atualizar_tabela' conseguir ler ele
-    txt_filtro = ft.TextField(
-        label="Filtro",
-        value=datetime.now().strftime("%Y-%m"),
-        width=100,
-        on_submit=lambda e: atualizar_tabela()  # Agora vai funcionar pois a função vem logo abaixo
-    )
-
-    btn_bater = ft.ElevatedButton(
-        "BATER PONTO",
-        icon=ft.Icons.TOUCH_APP,
-        on_click=bater_ponto_click,
-        style=ft.ButtonStyle(bgcolor=ft.Colors.BLUE, color=ft.Colors.WHITE, padding=20,
-                             shape=ft.RoundedRectangleBorder(radius=10))
-    )
-
-    btn_manual = ft.ElevatedButton(
-        "Inserir Manual",
-        icon=ft.Icons.CALENDAR_MONTH,
-        on_click=abrir_calendario_manual
-    )
-
-    btn_ferias = ft.ElevatedButton(
-        "FÉRIAS",
-        icon=ft.Icons.BEACH_ACCESS,
-        color=ft.Colors.ORANGE,
-        on_click=lambda e: (setattr(dlg_ferias, 'open', True), page.update())
-    )
-
-    btn_exportar = ft.IconButton(icon=ft.Icons.PIE_CHART, tooltip="Exportar Relatório",
-                                 on_click=lambda e: (setattr(dlg_exportar, 'open', True), page.update()))
-    btn_config = ft.IconButton(icon=ft.Icons.SETTINGS, tooltip="Configurações/Backup",
-                               on_click=lambda e: (setattr(dlg_config, 'open', True), page.update()))
-
-    # 4. A FUNÇÃO QUE TINHA SUMIDO (Restaurada)
-    def atualizar_tabela():
-        tabela.rows.clear()
-        datas_ordenadas = sorted(app.dados.keys())
-
-        filtro_input = txt_filtro.value.strip()
-        filtro_ano_mes = ""
-        try:
-            if "-" not in filtro_input:
-                filtro_ano_mes = datetime.now().strftime("%Y-%m")
-            else:
-                filtro_ano_mes = filtro_input
-        except:
-            filtro_ano_mes = datetime.now().strftime("%Y-%m")
-
-        soma_trab_mes = 0
-        soma_banco_mes = 0
-        soma_banco_anterior = 0
-
-        hoje_str = app.obter_hoje_str()
-        is_dark = page.theme_mode == ft.ThemeMode.DARK
-        data_corte = app.config.get("data_inicio_contagem")
-
-        pontos_grafico = []
-        saldo_acumulado_grafico = 0
-
-        for i, data in enumerate(datas_ordenadas):
-            info = app.dados[data]
-            trabalhado, meta, saldo_final, eh_feriado = app.obter_saldo_dia(data, info)
-
-            ajuste_min = info.get("ajuste_manual", 0)
-            saldo_puro_segundos = saldo_final - (ajuste_min * 60)
-
-            eh_mes_corrente = data.startswith(filtro_ano_mes)
-
-            if not data_corte or data >= data_corte:
-                if eh_mes_corrente:
-                    soma_trab_mes += trabalhado
-                    soma_banco_mes += saldo_final
-                    saldo_acumulado_grafico += saldo_final
-                    dia_mes = int(data.split("-")[2])
-                    pontos_grafico.append(ft.LineChartDataPoint(
-                        x=dia_mes,
-                        y=saldo_acumulado_grafico / 3600,
-                        tooltip=f"Dia {dia_mes}: {app.formatar_duracao(saldo_acumulado_grafico)}",
-                        show_tooltip=True, point=True
-                    ))
-                elif data < (filtro_ano_mes + "-01"):
-                    soma_banco_anterior += saldo_final
-
-            if not eh_mes_corrente:
-                continue
-
-            # Montagem visual da linha
-            batidas_str = " | ".join(info['batidas'])
-            coluna_batidas_content = [ft.Text(batidas_str)]
-
-            # Badge de Saída
-            if len(info['batidas']) % 2 != 0:
-                batidas_str += " ..."
-                parcial = app.calcular_segundos_trabalhados(info['batidas'] + [datetime.now().strftime("%H:%M")])
-                meta_atual = app.config.get("meta_diaria", 8)
-                falta = (meta_atual * 3600) - parcial
-                if falta > 0:
-                    saida_dt = datetime.now() + timedelta(seconds=falta)
-                    badge_saida = ft.Container(
-                        content=ft.Text(f"Saída: {saida_dt.strftime('%H:%M')}", size=12, color=ft.Colors.WHITE,
-                                        weight="bold"),
-                        bgcolor=ft.Colors.BLUE_700, padding=ft.padding.symmetric(horizontal=6, vertical=2),
-                        border_radius=4, margin=ft.margin.only(top=4)
-                    )
-                    coluna_batidas_content.append(badge_saida)
-
-            cor_base = ft.Colors.GREY_900 if is_dark and i % 2 == 0 else ft.Colors.GREY_800 if is_dark else ft.Colors.WHITE if i % 2 == 0 else ft.Colors.GREY_200
-            if data == hoje_str:
-                cor_base = ft.Colors.BLUE_900 if is_dark else ft.Colors.BLUE_50
-
-            str_saldo = app.formatar_duracao(saldo_puro_segundos)
-            cor_saldo = ft.Colors.GREEN if saldo_puro_segundos >= 0 else ft.Colors.RED
-
-            txt_ajuste = ""
-            color_ajuste = ft.Colors.GREY
-            if ajuste_min != 0:
-                val_fmt = app.formatar_duracao(ajuste_min * 60)
-                txt_ajuste = f"+{val_fmt}" if ajuste_min > 0 else f"{val_fmt}"
-                color_ajuste = ft.Colors.GREEN if ajuste_min > 0 else ft.Colors.RED
-
-            dt_obj = datetime.strptime(data, "%Y-%m-%d")
-            dias_sem = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
-            dia_txt = dias_sem[dt_obj.weekday()]
-
-            txt_saldo_ui = ft.Text(str_saldo, color=cor_saldo, weight="bold")
-            if info['folga']:
-                if info.get("is_ferias"):
-                    txt_saldo_ui = ft.Text("FÉRIAS", color=ft.Colors.BLUE, weight="bold")
-                else:
-                    txt_saldo_ui = ft.Text("FOLGA", color=ft.Colors.ORANGE, weight="bold")
-            elif eh_feriado:
-                cor_feriado = ft.Colors.PURPLE_200 if is_dark else ft.Colors.PURPLE
-                txt_saldo_ui = ft.Text(f"{str_saldo} (FERIADO)", color=cor_feriado, weight="bold")
-                dia_txt += " (F)"
-            elif dt_obj.weekday() >= 5:
-                fator_fds_show = app.config.get('fator_fds', 2.0)
-                txt_saldo_ui = ft.Text(f"{str_saldo} (x{fator_fds_show})", color=ft.Colors.GREEN, weight="bold")
-
-            tabela.rows.append(
-                ft.DataRow(
-                    color={ft.ControlState.DEFAULT: cor_base},
-                    cells=[
-                        ft.DataCell(ft.Text(dt_obj.strftime("%d/%m"))),
-                        ft.DataCell(ft.Text(dia_txt, color=ft.Colors.ORANGE if (
-                                    dt_obj.weekday() >= 5 or eh_feriado) else ft.Colors.ON_SURFACE)),
-                        ft.DataCell(ft.Column(coluna_batidas_content, spacing=0)),
-                        ft.DataCell(ft.Text(app.formatar_duracao(trabalhado))),
-                        ft.DataCell(txt_saldo_ui),
-                        ft.DataCell(ft.Row([
-                            ft.Text(txt_ajuste, color=color_ajuste, size=12, weight="bold"),
-                            ft.IconButton(icon=ft.Icons.TUNE, tooltip="Ajuste Manual", on_click=abrir_ajuste, data=data,
-                                          icon_size=20),
-                        ], spacing=5)),
-                        ft.DataCell(ft.Row([
-                            ft.Checkbox(value=info['folga'], label="Folga",
-                                        on_change=lambda e, d=data: toggle_folga(e)),
-                            ft.IconButton(ft.Icons.EDIT_NOTE, on_click=abrir_edicao, data=data,
-                                          icon_color=ft.Colors.BLUE),
-                            ft.IconButton(ft.Icons.DELETE, icon_color="red", on_click=lambda e, d=data: (
-                            setattr(dlg_excluir_data_ref, 'value', d), setattr(dlg_confirmar_exclusao, 'open', True),
-                            page.update()))
-                        ]))
-                    ]
-                )
-            )
-
-        lbl_trab_mes.value = app.formatar_duracao(soma_trab_mes)
-        try:
-            partes_data = filtro_ano_mes.split("-")
-            dias_uteis = app.calcular_dias_uteis_mes(int(partes_data[0]), int(partes_data[1]))
-            previsto_seg = dias_uteis * app.config.get("meta_diaria", 8) * 3600
-            lbl_prev_mes.value = app.formatar_duracao(previsto_seg)
-        except:
-            lbl_prev_mes.value = "--:--"
-
-        lbl_banco_mes.value = app.formatar_duracao(soma_banco_mes)
-        lbl_banco_mes.color = ft.Colors.GREEN if soma_banco_mes >= 0 else ft.Colors.RED
-        lbl_banco_ant.value = app.formatar_duracao(soma_banco_anterior)
-        lbl_banco_ant.color = ft.Colors.GREEN if soma_banco_anterior >= 0 else ft.Colors.RED
-
-        total_geral = soma_banco_mes + soma_banco_anterior
-        lbl_banco_total.value = app.formatar_duracao(total_geral)
-        lbl_banco_total.color = ft.Colors.GREEN if total_geral >= 0 else ft.Colors.RED
-
-        # Atualiza Gráfico
-        if pontos_grafico:
-            container_grafico.visible = True
-            cor_linha = (ft.Colors.GREEN_400 if saldo_acumulado_grafico >= 0 else ft.Colors.RED_400) if is_dark else (
-                ft.Colors.GREEN if saldo_acumulado_grafico >= 0 else ft.Colors.RED)
-            chart.data_series = [
-                ft.LineChartData(data_points=pontos_grafico, stroke_width=4, color=cor_linha, curved=True,
-                                 stroke_cap_round=True, below_line_bgcolor=ft.Colors.with_opacity(0.1, cor_linha),
-                                 point=True)]
-            vals = [p.y for p in pontos_grafico]
-            chart.min_y = min(vals) - 2 if vals else -10
-            chart.max_y = max(vals) + 2 if vals else 10
-            chart.bottom_axis.labels = [ft.ChartAxisLabel(value=p.x, label=ft.Container(
-                ft.Text(str(int(p.x)), size=10, weight=ft.FontWeight.BOLD), padding=ft.padding.only(top=5))) for p in
-                                        pontos_grafico]
-        else:
-            container_grafico.visible = False
-
-        page.update()
-
-    # 5. HEADER, FOOTER E LÓGICA DE RESPONSIVIDADE
-
-    header_content = ft.Row([
-        ft.Column([
-            ft.Text("CONTROLE DE PONTO", size=24, weight="bold"),
-            ft.Text("RENAN", size=16, color=ft.Colors.ORANGE, weight="bold")
-        ], spacing=0),
-        ft.Container(width=20),
-        txt_filtro,
-        ft.IconButton(ft.Icons.SEARCH, on_click=lambda e: atualizar_tabela()),
-        btn_exportar, btn_config,
-        ft.IconButton(ft.Icons.DARK_MODE, on_click=alternar_tema, tooltip="Tema"),
-        btn_manual, btn_ferias, btn_bater
-    ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
-
-    header_container = ft.Row(controls=[header_content], scroll=ft.ScrollMode.AUTO)
-
-    footer = ft.Container(
-        content=ft.Column([
-            ft.Divider(),
-            # A Row agora tem scroll AUTO para permitir deslizar o resumo no celular
-            ft.Row([linha_resumo_1], scroll=ft.ScrollMode.AUTO),
-            ft.Divider(height=10, color="transparent"),
-            ft.Row([ft.TextButton("Zerar Banco (Mantém Histórico)", icon=ft.Icons.RESTART_ALT, icon_color="orange",
-                                  on_click=lambda e: (setattr(dlg_confirmar_limpeza, 'open', True), page.update()))]),
-            ft.Row([ft.Text("© 2025 Controle de Ponto - Desenvolvido por YannaMedova", size=12, color=ft.Colors.GREY)],
-                   alignment=ft.MainAxisAlignment.CENTER)
-        ]),
-        # ALTERAÇÃO AQUI: Usamos symmetric para zerar a horizontal
-        padding=ft.padding.symmetric(vertical=20, horizontal=0),
-        bgcolor=ft.Colors.BLUE_GREY_50 if page.theme_mode == ft.ThemeMode.LIGHT else ft.Colors.GREY_900,
-        border_radius=10
-    )
-
-    # --- 5. LÓGICA DE REDIMENSIONAMENTO
-
-    def ajustar_layout(e):
-        # Calcula a largura disponível na tela
-        largura_tela = page.width if page.width else (page.window_width if page.window_width else 1000)
-
-        # Define um padding de segurança da página (ex: 20px de cada lado)
-        padding_pagina = 40
-
-        # Largura real disponível
-        largura_disponivel = largura_tela - padding_pagina
-
-        # Lógica de Responsividade:
-        # Se a tela for pequena (celular), travamos em 950px para forçar a rolagem horizontal.
-        # Se for monitor grande, usa a largura total da tela.
-        largura_minima_tabela = 950
-
-        if largura_disponivel < largura_minima_tabela:
-            w_final = largura_minima_tabela
-        else:
-            w_final = largura_disponivel
-
-        # APLICA A MESMA LARGURA PARA TODOS OS ELEMENTOS
-        # Isso garante que o início e o fim deles fiquem perfeitamente alinhados visualmente
-
-        # 1. Tabela
-        tabela.width = w_final
-
-        # 2. Resumo (Rodapé)
-        linha_resumo_1.width = w_final
-
-        # 3. Cabeçalho
-        try:
-            header_content.width = w_final
-        except NameError:
-            pass
-
-        # 4. Gráfico (opcional, mas bom manter alinhado)
-        try:
-            # O container do gráfico dentro do scroll deve seguir a mesma largura
-            chart.parent.width = w_final
-        except:
-            pass
-
-        page.update()
-
-    # Vincula o evento de redimensionamento
-    page.on_resized = ajustar_layout
-
-    # --- 6. MONTAGEM FINAL DA PÁGINA ---
-
-    # Define a altura da tabela dinamicamente (Tela inteira - Cabeçalho/Rodapé)
-    # Isso evita ter duas barras de rolagem verticais
-    altura_tabela = 500  # Valor padrão seguro
-
-    page.add(
-        header_container,
-        ft.Divider(),
-
-        # Container da Tabela
-        ft.Column(
-            controls=[
-                ft.Row(
-                    controls=[tabela],
-                    scroll=ft.ScrollMode.ALWAYS,  # Habilita rolagem HORIZONTAL (Crucial para celular)
-                )
-            ],
-            scroll=ft.ScrollMode.AUTO,  # Habilita rolagem VERTICAL
-            height=altura_tabela,  # Define altura fixa para a rolagem vertical funcionar
-            expand=True  # Tenta ocupar espaço vertical disponível
-        ),
-
-        footer,
-        container_grafico
-    )
-
-    # INICIALIZAÇÃO
-    atualizar_tabela()
-    # Força o layout a se ajustar imediatamente
-    page.update()
-    ajustar_layout(None)
-
-# =============================
-# 🔐 LOGIN PROTECT
-# =============================
-
-# >>> SENHA: carregar via variável de ambiente (segurança)
-import os
-
-_ENV_KEY_SENHA = "PONTO_PASSWORD"
-
-# Tenta ler a senha do ambiente
-SENHA_CORRETA = os.getenv(_ENV_KEY_SENHA)
-print(">>> DEBUG: SENHA_CORRETA lida do ambiente =", SENHA_CORRETA)
-
-
-# Segurança: se estiver em desenvolvimento e a variável não existir, define uma senha temporária
-# **** Só para DEV local: remova/override no servidor! ****
-if not SENHA_CORRETA:
-    #senha amigável para DEV local. Troque ou remova em produção.
-    SENHA_CORRETA = "dev_local_change_me"
-    print("⚠️ AVISO: variável de ambiente PONTO_PASSWORD não definida. Usando senha de DEV local.")
-
-
-def tela_login(page: ft.Page):
-    """
-    Tela de login futurista + responsiva
-    - Enter confirma
-    - Card translúcido
-    - Imagem centralizada
-    - Rodapé adicionado
-    """
-
-    # Config da página
-    page.title = "Login - Controle de Ponto"
-    page.window_scroll = "auto"
-    page.bgcolor = None
-
-    # --- INPUT / MENSAGENS ---
-    senha_input = ft.TextField(
-        label="Senha",
-        password=True,
-        can_reveal_password=True,
-        width=320,
-        filled=True,
-        bgcolor=ft.Colors.SURFACE,
-        color=None,
-        label_style=ft.TextStyle(color=ft.Colors.ON_SURFACE),
-    )
-
-    mensagem_erro = ft.Text("", color=ft.Colors.RED_300, size=13)
-
-    texto_motivacional = ft.Text(
-        "Você é totalmente substituível no trabalho, mas não pode ser substituído em casa.\nMantenha isso em perspectiva.",
-        size=12,
-        italic=True,
-        color="#9fb7ff",
-        text_align=ft.TextAlign.CENTER
-    )
-
-    # --- LOGIN ---
-    def tentar_entrar(e=None):
-        if senha_input.value == SENHA_CORRETA:
-            page.clean()
-            main(page)
-        else:
-            mensagem_erro.value = "Senha incorreta!"
-            page.update()
-
-    senha_input.on_submit = tentar_entrar
-
-    def on_key(e):
-        k = getattr(e, "key", None) or getattr(e, "key_name", None)
-        if k in ("Enter", "Return"):
-            tentar_entrar()
-
-    page.on_keyboard_event = on_key
-
-    # --- BOTÃO ---
-    btn_entrar = ft.Container(
-        content=ft.Row(
-            [
-                ft.Icon(ft.Icons.LOGIN, color="white", size=16),
-                ft.Text("Entrar", size=15, weight="bold", color="white"),
-            ],
-            alignment=ft.MainAxisAlignment.CENTER
-        ),
-        width=320,
-        height=48,
-        border_radius=12,
-        bgcolor="#0f62fe",
-        on_click=tentar_entrar
-    )
-
-    # --- CARD LOGIN ---
-    card = ft.Container(
-        content=ft.Column(
-            [
-                ft.Row(
-                    [
-                        ft.Container(
-                            ft.Icon(ft.Icons.ACCESS_TIME_FILLED, size=46, color="#a9d1ff"),
-                            padding=ft.padding.all(8),
-                            bgcolor="#071b2b",
-                            border_radius=12
-                        ),
-                        ft.Column(
-                            [
-                                ft.Text("CONTROLE DE PONTO", size=20, weight="bold", color="white"),
-                                ft.Text("Acesso Seguro", size=12, color="#9fb7ff")
-                            ],
-                            spacing=4
-                        )
-                    ],
-                    alignment=ft.MainAxisAlignment.START,
-                    spacing=12
-                ),
-                ft.Divider(height=12, color="transparent"),
-                senha_input,
-                ft.Divider(height=8, color="transparent"),
-                btn_entrar,
-                ft.Divider(height=10, color="transparent"),
-                mensagem_erro,
-                ft.Divider(height=8, color="transparent"),
-                texto_motivacional,
-            ],
-            spacing=12,
-            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-        ),
-        width=420,
-        padding=ft.padding.symmetric(vertical=22, horizontal=20),
-        border_radius=16,
-        bgcolor=ft.Colors.with_opacity(0.35, "#071831"),
-        border=ft.border.all(1, "#11304f"),
-        shadow=ft.BoxShadow(blur_radius=22, color=ft.Colors.with_opacity(0.35, "black")),
-    )
-
-    # --- BACKGROUND (compatível com Flet 0.28.3) ---
-    bg = ft.Container(
-        content=ft.Image(
-            src="https://images.unsplash.com/photo-1535223289827-42f1e9919769?auto=format&fit=crop&w=1500&q=80",
-            fit=ft.ImageFit.COVER,
-        ),
-        expand=True,
-    )
-
-    overlay = ft.Container(
-        expand=True,
-        bgcolor=ft.Colors.with_opacity(0.15, ft.Colors.SURFACE)
-    )
-
+            mtime = os.stat(caminho).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime_manifesto:
+            return False
+        try:
+            manifesto_disco = self._ler_manifesto_disco()  # Gravado com os.replace: nunca lemos pela metade
+        except (OSError, ValueError) as ex:
+            print(f"AVISO: manifesto ilegível durante a sincronização: {ex}")
+            return False
+        with self._trava:
+            self._mtime_manifesto = mtime
+            mudou = self._adotar_manifesto(manifesto_disco)
+            if mudou:
+                self.versao += 1
+        return mudou
+
+    def _gravar_manifesto_disco(self, manifesto):
+        conteudo = json.dumps(manifesto, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        gravar_arquivo_atomico(os.path.join(self.pasta, ARQUIVO_MANIFESTO), conteudo)
+
+    def _gravar_totais(self):
+        """Roda no GRAVADOR: grava no manifesto os totais recalculados (se o mês não mudou no disco)."""
+        with self._trava:
+            meses = self._totais_pendentes
+            self._totais_pendentes = set()
+        if not meses:
+            return
+        with trava_arquivo(os.path.join(self.pasta, ARQUIVO_TRAVA)):
+            manifesto_disco = self._ler_manifesto_disco()
+            for mes in meses:
+                entrada_disco = manifesto_disco["meses"].get(mes)
+                entrada = self._manifesto["meses"].get(mes)
+                if (entrada_disco and entrada and entrada_disco["dias"] == entrada["dias"]
+                        and entrada_disco.get("rev") == entrada.get("rev")):
+                    entrada_disco["totais"] = entrada["totais"]
+            self._gravar_manifesto_disco(manifesto_disco)
+
+
+class PreparoRestauracao:
+    """
+    Monta uma pasta de dados nova (partições + manifesto) com dias que chegam em qualquer ordem, com
+    poucos meses em memória: a cada MESES_POR_LOTE_RESTAURACAO meses o lote vai para o disco, e o
+    manifesto é gravado uma vez só, em concluir(). Depois, DadosParticionados.trocar_por() faz a troca.
+    """
 
-    # Neon decor
-    neon_top = ft.Container(
-        height=6,
-        bgcolor="#0f62fe",
-        opacity=0.08,
-        margin=ft.margin.only(bottom=18),
-        border_radius=8,
-        width=420
-    )
+    def __init__(self, pasta, formato="json", resumir=None):
+        self.pasta = pasta
+        self.formato = formato
+        self.resumir = resumir
+        self._lote = {}  # mes -> {data: info} ainda não gravados
+        self._meses = {}  # mes -> entrada do manifesto dos meses já gravados
+        shutil.rmtree(pasta, ignore_errors=True)
+        os.makedirs(pasta)
+
+    def adicionar(self, data, info):
+        mes = data[:7]
+        if mes not in self._lote and len(self._lote) >= MESES_POR_LOTE_RESTAURACAO:
+            self._gravar_lote()
+        self._lote.setdefault(mes, {})[data] = info
+
+    def _gravar_lote(self):
+        for mes, dias in self._lote.items():
+            caminho = os.path.join(self.pasta, f"{mes}.dat")
+            if mes in self._meses:  # O mês voltou a aparecer (backup fora de ordem): junta com o já gravado
+                with open(caminho, "rb") as f:
+                    dias = {**desserializar_dados(f.read()), **dias}
+            gravar_arquivo_atomico(caminho, serializar_dados(dias, self.formato))
+            self._meses[mes] = {"dias": sorted(dias), "totais": self.resumir(mes, dias) if self.resumir else None,
+                                "rev": 0}
+        self._lote = {}
+
+    def concluir(self):
+        """Grava o que falta e o manifesto; retorna o DadosParticionados da pasta preparada."""
+        self._gravar_lote()
+        conteudo = json.dumps({"meses": self._meses}, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        gravar_arquivo_atomico(os.path.join(self.pasta, ARQUIVO_MANIFESTO), conteudo)
+        return DadosParticionados(self.pasta, self.formato)
+
+
+_ARMAZENAMENTOS = {}
+_TRAVA_ARMAZENAMENTOS = threading.Lock()
+
+
+def abrir_armazenamento(pasta, formato="json", resumir=None):
+    """
+    Retorna o DadosParticionados da pasta, um por processo: todas as sessões do navegador
+    compartilham o mesmo estado em memória, e a mescla na gravação cuida dos outros processos.
+    """
+    chave = os.path.abspath(pasta)
+    with _TRAVA_ARMAZENAMENTOS:
+        dados = _ARMAZENAMENTOS.get(chave)
+        if dados is None:
+            dados = DadosParticionados(pasta, formato, resumir)
+            _ARMAZENAMENTOS[chave] = dados
+        else:
+            dados.formato = formato
+            dados.registrar_resumo(resumir)
+        return dados
 
 
-    rodape = ft.Text(
-        "© 2025 Controle de Ponto — Desenvolvido por YannaMedova",
-        size=11,
-        color="#9fb7ff",
-        text_align=ft.TextAlign.CENTER
-    )
+# --- BACKUPS INCREMENTAIS ---
+# PASTA_BACKUPS guarda cadeias de backups: um completo seguido de incrementais só com os dias que
+# mudaram (e os que foram apagados) desde o anterior. Cada backup é um JSON comprimido (zstd se o
+# pacote `zstandard` estiver instalado, senão gzip). O índice lista os backups em ordem e guarda, do
+# último, a "rev" de cada mês e a "_versao" e a assinatura do conteúdo de cada dia: meses com a mesma
+# rev nem são lidos, então o tempo e o tamanho do backup acompanham o quanto mudou. Um dia entra no
+# incremental quando a assinatura muda; a versão sozinha não basta, porque uma restauração ou uma
+# reescrita da partição podem repetir um número já visto com outro conteúdo.
+PASTA_BACKUPS = "backups"
+ARQUIVO_INDICE_BACKUPS = "indice.json"
 
-    # --- MONTAGEM FINAL ---
-    stack = ft.Stack(
-        [
-            bg,
-            overlay,
-            ft.Container(
-                content=ft.Column(
-                    [
-                        neon_top,
-                        card,
-                        ft.Divider(height=22, color="transparent"),
-                        rodape
-                    ],
-                    alignment=ft.MainAxisAlignment.CENTER,
-                    horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                ),
-                alignment=ft.alignment.center,
-                expand=True
-            ),
-        ],
-        expand=True
-    )
 
-    page.controls.clear()
-    page.add(stack)
-    page.update()
+def assinatura_dia(info):
+    """CRC32 do conteúdo do dia (sem os campos internos), para saber se ele mudou desde o último backup."""
+    conteudo = json.dumps(_conteudo_dia(info), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return zlib.crc32(conteudo.encode("utf-8"))
 
 
-# =============================
-# APP STARTER
-# =============================
-if __name__ == "__main__":
-    ft.app(
-        target=tela_login,
-        view=ft.WEB_BROWSER,
-        host="0.0.0.0",
-        port=8000
-    )
+def _comprimir_backup(conteudo):
+    """Retorna (bytes comprimidos, extensão do arquivo)."""
+    zstd = importar_opcional("zstandard", avisar=False)
+    if zstd:
+        return zstd.ZstdCompressor(level=10).compress(conteudo), ".json.zst"
+    return gzip.compress(conteudo, compresslevel=6), ".json.gz"
 
-import flet as ft
-import json
-import os
-import shutil
-from datetime import datetime, timedelta
-import calendar
-import locale
-import re
-import hashlib
-# >>> FIX FUSO HORÁRIO (Brasil - Brasília)
-import os, time
-# define TZ para São Paulo / Brasília
-os.environ["TZ"] = "America/Sao_Paulo"
-# time.tzset() funciona em Linux (servidores). Envolvemos em try/except por segurança.
-try:
-    time.tzset()
-except Exception:
-    # No Windows ou ambientes sem suporte, ignoramos sem travar
-    pass
 
+def _descomprimir_backup(nome, conteudo):
+    if nome.endswith(".zst"):
+        zstd = importar_opcional("zstandard", avisar=False)
+        if not zstd:
+            raise RuntimeError(f"O backup {nome} está em zstd, mas o pacote zstandard não está instalado.")
+        return zstd.ZstdDecompressor().decompress(conteudo)
+    return gzip.decompress(conteudo)
 
-# --- BIBLIOTECAS OPCIONAIS PARA EXPORTAÇÃO E PDF ---
-try:
-    import pandas as pd
-    from fpdf import FPDF
-except ImportError:
-    print("AVISO: Para usar a exportação, instale: pip install pandas openpyxl fpdf")
 
-try:
-    import pdfplumber
-except ImportError:
-    print("AVISO: Para importar PDF, instale: pip install pdfplumber")
-    pdfplumber = None
+class BackupsIncrementais:
+    """
+    Backups automáticos de um DadosParticionados (ver PASTA_BACKUPS). As partições são lidas direto
+    do disco, então entra só o que já foi gravado, e com vários workers a trava da pasta de backups
+    garante um backup por vez.
+    - fazer() grava um incremental (ou o completo que abre cada cadeia) e aplica a retenção:
+      ficam as `cadeias` mais recentes, e uma cadeia nunca é apagada pela metade.
+    - pontos() lista os backups; estado_em() reconstrói os dados de qualquer um deles.
+    """
 
-# Tenta configurar o idioma do sistema para Português-BR
-try:
-    locale.setlocale(locale.LC_ALL, 'pt_BR.UTF-8')
-except:
-    pass
+    def __init__(self, dados, pasta=PASTA_BACKUPS, cadeias=4, incrementais=30):
+        self.dados = dados
+        self.pasta = pasta
+        self.cadeias = cadeias
+        self.incrementais = incrementais  # Incrementais por cadeia; depois disso começa outra com um completo
+
+    def _caminho_indice(self):
+        return os.path.join(self.pasta, ARQUIVO_INDICE_BACKUPS)
+
+    def _ler_indice(self):
+        if not os.path.exists(self._caminho_indice()):
+            return {"seq": 0, "backups": [], "estado": {}}
+        with open(self._caminho_indice(), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def pontos(self):
+        """Backups em ordem cronológica: [{"arquivo", "tipo", "em", "dias", "removidos", "bytes", "segundos"}]."""
+        return self._ler_indice()["backups"]
+
+    def ultimo(self):
+        backups = self.pontos()
+        return backups[-1] if backups else None
+
+    def versoes_registradas(self):
+        """{data: _versao} de cada dia como estava no último backup."""
+        versoes = {}
+        for visto in self._ler_indice()["estado"].values():
+            versoes.update(visto["versoes"])
+        return versoes
+
+    def ponto_ate(self, quando):
+        """Último backup feito até `quando` (datetime), ou None."""
+        limite = quando.isoformat(timespec="seconds")
+        anteriores = [b for b in self.pontos() if b["em"] <= limite]
+        return anteriores[-1] if anteriores else None
+
+    def fazer(self, completo=False, intervalo=None):
+        """
+        Faz um backup e retorna a entrada dele no índice. Retorna None se nada mudou desde o último,
+        ou se `intervalo` (timedelta) foi passado e o último backup é mais recente que isso.
+        """
+        if not self.dados.existe():
+            return None  # Base ainda vazia
+        os.makedirs(self.pasta, exist_ok=True)
+        with trava_arquivo(os.path.join(self.pasta, ARQUIVO_TRAVA)):
+            inicio = time.perf_counter()
+            agora = datetime.now()
+            indice = self._ler_indice()
+            backups = indice["backups"]
+            if intervalo and backups and agora - datetime.fromisoformat(backups[-1]["em"]) < intervalo:
+                return None
+            completos = [i for i, b in enumerate(backups) if b["tipo"] == "completo"]
+            completo = completo or not completos or len(backups) - 1 - completos[-1] >= self.incrementais
+            anterior = {} if completo else indice["estado"]
+
+            # O manifesto é lido antes das partições: se um mês for regravado no meio do caminho, a rev
+            # guardada fica velha e o próximo backup relê o mês (as assinaturas dos dias evitam duplicar)
+            manifesto = self.dados._ler_manifesto_disco()
+            estado, dias, removidos = {}, {}, []
+            for mes, entrada in manifesto["meses"].items():
+                visto = anterior.get(mes)
+                if visto and visto["rev"] == entrada.get("rev"):
+                    estado[mes] = visto
+                    continue
+                particao = self.dados._ler_particao_disco(mes)
+                versoes, assinaturas = {}, {}
+                # Índices antigos não têm assinaturas: o mês inteiro entra de novo, uma vez
+                vistas = visto.get("assinaturas", {}) if visto else {}
+                for data, info in particao.items():
+                    versoes[data] = info.get("_versao", 0)
+                    assinaturas[data] = assinatura_dia(info)
+                    if vistas.get(data) != assinaturas[data]:
+                        dias[data] = _conteudo_dia(info)
+                if visto:
+                    removidos.extend(data for data in visto["versoes"] if data not in particao)
+                estado[mes] = {"rev": entrada.get("rev"), "versoes": versoes, "assinaturas": assinaturas}
+            for mes, visto in anterior.items():
+                if mes not in manifesto["meses"]:
+                    removidos.extend(visto["versoes"])
+            if not completo and not dias and not removidos:
+                return None
+
+            tipo = "completo" if completo else "incremental"
+            conteudo, extensao = _comprimir_backup(_json_dumps_compacto(
+                {"tipo": tipo, "em": agora.isoformat(timespec="seconds"), "dias": dias, "removidos": sorted(removidos)}))
+            indice["seq"] = indice.get("seq", 0) + 1
+            nome = f"{indice['seq']:06d}-{agora:%Y%m%d-%H%M%S}-{tipo}{extensao}"
+            gravar_arquivo_atomico(os.path.join(self.pasta, nome), conteudo)
+
+            entrada = {"arquivo": nome, "tipo": tipo, "em": agora.isoformat(timespec="seconds"), "dias": len(dias),
+                       "removidos": len(removidos), "bytes": len(conteudo),
+                       "segundos": round(time.perf_counter() - inicio, 3)}
+            backups.append(entrada)
+            indice["estado"] = estado
+
+            # Retenção: apaga as cadeias mais antigas inteiras (um incremental sem o seu completo não serve)
+            completos = [i for i, b in enumerate(backups) if b["tipo"] == "completo"]
+            if len(completos) > self.cadeias:
+                corte = completos[-self.cadeias]
+                for b in backups[:corte]:
+                    try:
+                        os.remove(os.path.join(self.pasta, b["arquivo"]))
+                    except FileNotFoundError:
+                        pass
+                del backups[:corte]
+            gravar_arquivo_atomico(self._caminho_indice(),
+                                   json.dumps(indice, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            return entrada
+
+    def estado_em(self, arquivo):
+        """Dados ({data: info}) como estavam no backup `arquivo`: aplica a cadeia, do completo até ele."""
+        backups = self.pontos()
+        posicao = next((i for i, b in enumerate(backups) if b["arquivo"] == arquivo), None)
+        if posicao is None:
+            raise ValueError(f"Backup {arquivo} não encontrado.")
+        inicio = max(i for i in range(posicao + 1) if backups[i]["tipo"] == "completo")
+        dados = {}
+        for b in backups[inicio:posicao + 1]:
+            with open(os.path.join(self.pasta, b["arquivo"]), "rb") as f:
+                parte = _json_loads(_descomprimir_backup(b["arquivo"], f.read()))
+            dados.update(parte["dias"])
+            for data in parte["removidos"]:
+                dados.pop(data, None)
+        return dados
+
+
+def agendar_backup_automatico(backups, horas):
+    """
+    Agenda no LEMBRETES o próximo backup automático da pasta, `horas` depois do último (na hora, se já
+    passou). O backup roda no GRAVADOR e se reagenda; com vários workers, o primeiro a chegar faz e
+    os outros pulam (ver `intervalo` em fazer). horas=0 desliga.
+    """
+    chave = ("backup", os.path.abspath(backups.pasta))
+    if not horas:
+        LEMBRETES.cancelar(chave)
+        return
+    intervalo = timedelta(hours=horas)
+    ultimo = backups.ultimo()
+    agora = datetime.now()
+    quando = max(agora, datetime.fromisoformat(ultimo["em"]) + intervalo) if ultimo else agora
+
+    def tarefa():
+        try:
+            backups.fazer(intervalo=intervalo)
+        except Exception as ex:
+            print(f"ERRO no backup automático: {ex}")
+        ultimo = backups.ultimo()
+        proximo = datetime.fromisoformat(ultimo["em"]) + intervalo if ultimo else datetime.now()
+        if proximo <= datetime.now():  # Nada mudou desde o último backup: olha de novo daqui a `horas`
+            proximo = datetime.now() + intervalo
+        LEMBRETES.agendar(chave, proximo, lambda: GRAVADOR.agendar(chave, tarefa))
 
-# --- CONFIGURAÇÕES GLOBAIS ---
-ARQUIVO_DADOS = "dados_ponto.json"
-ARQUIVO_CONFIG = "config.json"  # Arquivo para salvar as preferências
+    LEMBRETES.agendar(chave, quando, lambda: GRAVADOR.agendar(chave, tarefa))
 
 
 # --- CLASSE DE GERENCIAMENTO DE FERIADOS ---
@@ -1826,33 +1344,984 @@ class GerenciadorFeriados:
         return data_date.strftime("%Y-%m-%d") in feriados_ano
 
 
+# --- REDUÇÃO DE PONTOS DO GRÁFICO ---
+PONTOS_MAX_GRAFICO = 120  # Limite de pontos enviados ao navegador, qualquer que seja o período
+ROTULOS_MAX_GRAFICO = 12  # Limite de rótulos no eixo X nos modos Ano/Histórico
+
+
+def reduzir_lttb(pontos, limite):
+    """
+    Largest-Triangle-Three-Buckets: reduz uma série [(x, y, ...)] a `limite` pontos,
+    mantendo o primeiro, o último e os picos/vales que dão forma à curva.
+    """
+    n = len(pontos)
+    if limite >= n or limite < 3:
+        return list(pontos)
+
+    tam_balde = (n - 2) / (limite - 2)
+    amostra = [pontos[0]]
+    a = 0
+    for i in range(limite - 2):
+        # Média do próximo balde (o terceiro vértice do triângulo)
+        ini_prox = int((i + 1) * tam_balde) + 1
+        fim_prox = min(int((i + 2) * tam_balde) + 1, n)
+        qtd = fim_prox - ini_prox
+        media_x = sum(p[0] for p in pontos[ini_prox:fim_prox]) / qtd
+        media_y = sum(p[1] for p in pontos[ini_prox:fim_prox]) / qtd
+
+        ax, ay = pontos[a][0], pontos[a][1]
+        maior_area = -1
+        escolhido = a
+        for j in range(int(i * tam_balde) + 1, int((i + 1) * tam_balde) + 1):
+            area = abs((ax - media_x) * (pontos[j][1] - ay) - (ax - pontos[j][0]) * (media_y - ay))
+            if area > maior_area:
+                maior_area = area
+                escolhido = j
+        amostra.append(pontos[escolhido])
+        a = escolhido
+
+    amostra.append(pontos[-1])
+    return amostra
+
+
+# --- AGREGADOS PARA RELATÓRIOS ---
+# Cada mês guarda no manifesto a soma destes campos (e a mesma soma por semana ISO),
+# então um relatório de qualquer período soma meses/semanas em vez de percorrer dias.
+VERSAO_RESUMO = 3  # Mude quando o formato do resumo mudar, para os totais antigos serem recalculados
+# meta_folgas: segundos de meta dos dias úteis de folga (a meta pode variar ao longo do tempo)
+CAMPOS_AGREGADO = ("dias", "trabalhado", "saldo", "ajuste", "folgas", "ferias", "folgas_dia_util", "meta_folgas")
+# Regras de saldo; config["regras_vigencia"] guarda mudanças delas a partir de uma data
+REGRAS_PADRAO = {"meta_diaria": 8, "fator_dia_util": 1.0, "fator_fds": 2.0}
+GRANULARIDADES_RELATORIO = ("semana", "mes", "trimestre", "personalizado")
+
+
+def agregado_vazio():
+    agregado = {campo: 0 for campo in CAMPOS_AGREGADO}
+    agregado["extras"] = {}  # fator (str) -> segundos de hora extra antes do multiplicador
+    return agregado
+
+
+def somar_agregado(destino, origem):
+    for campo in CAMPOS_AGREGADO:
+        destino[campo] += origem.get(campo, 0)
+    for fator, segundos in origem.get("extras", {}).items():
+        destino["extras"][fator] = destino["extras"].get(fator, 0) + segundos
+    return destino
+
+
+def chave_semana(data_str):
+    """Semana ISO de uma data AAAA-MM-DD, no formato AAAA-Wnn."""
+    ano, semana, _ = datetime.strptime(data_str, "%Y-%m-%d").isocalendar()
+    return f"{ano}-W{semana:02d}"
+
+
+# --- CACHE DE EXPORTAÇÕES ---
+class CacheExportacoes:
+    """
+    Arquivos de exportação já gerados, guardados em disco pela chave (dono, mês, formato, versão).
+    - Um acerto só copia o arquivo pronto; qualquer mudança nos dados muda a chave.
+    - Passando de `limite_bytes`, os usados há mais tempo são apagados (o mtime marca o último uso).
+    A pasta pode ser compartilhada entre workers: cada arquivo é gravado de forma atômica.
+    """
+
+    def __init__(self, pasta, limite_bytes):
+        self.pasta = pasta
+        self.limite_bytes = limite_bytes
+
+    def _caminho(self, chave, formato):
+        return os.path.join(self.pasta, f"{chave}.{formato}")
+
+    def servir(self, chave, formato, destino):
+        """Copia o arquivo em cache para `destino`. Retorna False se não houver."""
+        origem = self._caminho(chave, formato)
+        try:
+            shutil.copyfile(origem, destino)
+        except FileNotFoundError:
+            return False
+        try:
+            os.utime(origem)  # Marca o uso para o LRU
+        except OSError:
+            pass
+        return True
+
+    def guardar(self, chave, formato, arquivo):
+        os.makedirs(self.pasta, exist_ok=True)
+        with open(arquivo, "rb") as f:
+            gravar_arquivo_atomico(self._caminho(chave, formato), f.read())
+        self._descartar_excedentes()
+
+    def _descartar_excedentes(self):
+        entradas = []
+        with os.scandir(self.pasta) as itens:
+            for item in itens:
+                if item.is_file() and not item.name.endswith(".tmp"):
+                    info = item.stat()
+                    entradas.append((info.st_mtime, info.st_size, item.path))
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for _, tamanho, caminho in sorted(entradas):
+            if total <= self.limite_bytes:
+                break
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass  # Outro worker já apagou
+            total -= tamanho
+
+
+CACHE_EXPORTACOES = CacheExportacoes(PASTA_CACHE_EXPORTACOES, LIMITE_CACHE_EXPORTACOES)
+
+
+# --- PDFs JÁ LIDOS (PRÉVIA E SUBSTITUIÇÃO) ---
+TTL_PDFS_LIDOS = 10 * 60  # Segundos que o resultado da leitura de um PDF continua valendo
+MAX_PDFS_LIDOS = 8
+
+
+class CachePdfsLidos:
+    """
+    Resultado da leitura de PDFs ({data: [horas]}) por hash do arquivo, por pouco tempo: a prévia
+    do arquivo duplicado e o "Sim, Substituir" que vem logo depois usam a mesma leitura.
+    """
+
+    def __init__(self, ttl, limite):
+        self.ttl = ttl
+        self.limite = limite
+        self._itens = OrderedDict()  # hash -> (expira_em, mapa)
+        self._trava = threading.Lock()
+
+    def obter(self, hash_arquivo):
+        with self._trava:
+            item = self._itens.get(hash_arquivo)
+            if item is None or item[0] < time.monotonic():
+                self._itens.pop(hash_arquivo, None)
+                return None
+            return item[1]
+
+    def guardar(self, hash_arquivo, mapa):
+        with self._trava:
+            self._itens[hash_arquivo] = (time.monotonic() + self.ttl, mapa)
+            self._itens.move_to_end(hash_arquivo)
+            while len(self._itens) > self.limite:
+                self._itens.popitem(last=False)
+
+
+PDFS_LIDOS = CachePdfsLidos(TTL_PDFS_LIDOS, MAX_PDFS_LIDOS)
+LIMITE_PREVIA_PDF = 30  # Dias listados na prévia da substituição; o resto só entra na contagem
+
+# Layout do PDF: decidido pelas primeiras páginas e usado no resto do documento (ver ler_pdf).
+# "tabela" lê extract_tables (com config_tabela, se houver); "texto" lê extract_text linha a linha.
+AMOSTRA_LAYOUT_PDF = 2  # Páginas usadas para detectar o layout
+LAYOUT_PDF_TABELA = {"nome": "tabela", "estrategia": "tabela", "config_tabela": None}
+LAYOUT_PDF_TEXTO = {"nome": "texto", "estrategia": "texto"}
+# Modelos conhecidos, reconhecidos por textos da primeira página; acrescente aqui novos relatórios
+MODELOS_PDF = [
+    {"nome": "espelho_ponto_grade", "marcadores": ["Espelho de Ponto"], "estrategia": "tabela",
+     "config_tabela": {"vertical_strategy": "lines", "horizontal_strategy": "lines"}},
+    {"nome": "cartao_ponto_texto", "marcadores": ["Cartão de Ponto"], "estrategia": "texto"},
+]
+LAYOUTS_PDF = {}  # (produtor, criador, largura, altura) -> layout já detectado para PDFs desse gerador
+
+
+# --- LEMBRETES (UM AGENDADOR POR PROCESSO) ---
+class AgendadorLembretes:
+    """
+    Agendador único do processo para os lembretes de todas as sessões: um heap de
+    (horário, seq, chave) e uma thread que dorme até o próximo horário, sem polling por sessão.
+    - agendar() substitui o lembrete anterior da mesma chave; custa O(log n).
+    - cancelar() só esquece a chave; a entrada velha é descartada quando chega ao topo do heap.
+    - O callback roda na thread do agendador: deve ser curto (ex: mostrar um aviso na página).
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._ativos = {}  # chave -> (seq, callback); entradas do heap com outro seq estão obsoletas
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def agendar(self, chave, quando, callback):
+        """Agenda `callback()` para o datetime `quando`."""
+        with self._cond:
+            self._seq += 1
+            self._ativos[chave] = (self._seq, callback)
+            heapq.heappush(self._heap, (quando.timestamp(), self._seq, chave))
+            self._compactar()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._executar, name="lembretes", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def cancelar(self, chave):
+        with self._cond:
+            self._ativos.pop(chave, None)
+
+    def pendentes(self):
+        return len(self._ativos)
+
+    def agendado(self, chave):
+        with self._cond:
+            return chave in self._ativos
+
+    def _obsoleta(self, item):
+        return self._ativos.get(item[2], (None,))[0] != item[1]
+
+    def _compactar(self):
+        # Reagendamentos deixam entradas obsoletas; se forem a maioria, reconstrói o heap (O(n), raro)
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._ativos):
+            self._heap = [item for item in self._heap if not self._obsoleta(item)]
+            heapq.heapify(self._heap)
+
+    def _executar(self):
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._obsoleta(self._heap[0]):
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    espera = self._heap[0][0] - time.time()
+                    if espera <= 0:
+                        break
+                    self._cond.wait(espera)
+                _, _, chave = heapq.heappop(self._heap)
+                _, callback = self._ativos.pop(chave)
+            try:
+                callback()
+            except Exception as ex:
+                print(f"AVISO: lembrete {chave} falhou: {ex}")
+
+
+LEMBRETES = AgendadorLembretes()
+
+
+class TickerSessoes:
+    """
+    Relógio único do processo para os mostradores ao vivo (trabalhado hoje / tempo até a saída).
+    A cada virada de minuto chama o callback de cada sessão inscrita; só se inscreve quem tem
+    batida em aberto, e sem inscritos nada fica agendado. Usa o heap do agendador de lembretes.
+    Um callback que retorna False (ou falha) é desinscrito.
+    """
+
+    def __init__(self, agendador, intervalo=60):
+        self._agendador = agendador
+        self.intervalo = intervalo
+        self._inscritos = {}
+        self._trava = threading.Lock()
+        self._ativo = False
+
+    def inscrever(self, chave, callback):
+        with self._trava:
+            self._inscritos[chave] = callback
+            if not self._ativo:
+                self._ativo = True
+                self._agendar_proximo()
+
+    def desinscrever(self, chave):
+        with self._trava:
+            self._inscritos.pop(chave, None)
+
+    def _agendar_proximo(self):
+        proximo = (time.time() // self.intervalo + 1) * self.intervalo
+        self._agendador.agendar(("ticker", id(self)), datetime.fromtimestamp(proximo), self._tique)
+
+    def _tique(self):
+        with self._trava:
+            inscritos = list(self._inscritos.items())
+        for chave, callback in inscritos:
+            try:
+                continuar = callback()
+            except Exception as ex:
+                print(f"AVISO: mostrador ao vivo {chave} falhou: {ex}")
+                continuar = False
+            if continuar is False:
+                with self._trava:
+                    if self._inscritos.get(chave) is callback:
+                        del self._inscritos[chave]
+        with self._trava:
+            if self._inscritos:
+                self._agendar_proximo()
+            else:
+                self._ativo = False
+
+
+TICKER = TickerSessoes(LEMBRETES)
+
+
+# --- SESSÕES ABERTAS (MEMÓRIA E DESCARTE POR OCIOSIDADE) ---
+PASTA_SESSOES = "sessoes"  # Resumo de cada worker (<pid>.json), lido pela tela "Sessões do Servidor"
+OCIOSIDADE_SESSAO_MIN = 20  # Padrão de "sessao_ociosidade_min": sem interação há mais que isso, a sessão é pausada
+INTERVALO_VARREDURA_SESSOES = 60  # Segundos entre varreduras (e entre gravações do resumo do worker)
+
+
+def memoria_aproximada(raizes):
+    """
+    Estimativa em bytes do que `raizes` ocupam no servidor: controles do Flet (o próprio objeto,
+    seus atributos e os filhos de _get_children) e dicts/listas/tuplas com o que guardam.
+    Cada objeto conta uma vez; controles só são seguidos como filhos, para não subir pelo
+    `parent`/`page` e medir a página inteira.
+    """
+    vistos = set()
+    pilha = list(raizes)
+    total = 0
+    while pilha:
+        obj = pilha.pop()
+        if id(obj) in vistos:
+            continue
+        vistos.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, ft.Control):
+            pilha.append(vars(obj))
+            pilha.extend(obj._get_children())
+        elif isinstance(obj, dict):
+            pilha.extend(v for par in list(obj.items()) for v in par if not isinstance(v, ft.Control))
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pilha.extend(v for v in list(obj) if not isinstance(v, ft.Control))
+    return total
+
+
+def memoria_processo():
+    """Memória residente (RSS) do processo em bytes, ou None fora do Linux."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class RegistroSessoes:
+    """
+    Sessões abertas neste processo, com a memória estimada de cada uma e o descarte das ociosas.
+    - registrar() recebe medir() -> bytes e descartar(limite) -> bool (True se liberou o estado pesado).
+      descartar confere de novo, sob a trava da própria sessão, que não houve interação desde `limite`.
+    - tocar() marca interação; a sessão pausada volta a ser ativa quando se refaz.
+    - A varredura roda no heap do agendador de lembretes enquanto houver sessões: pausa as que
+      passaram de `ociosidade` segundos sem interação e grava o resumo do worker em PASTA_SESSOES.
+    Os callbacks rodam na thread do agendador: devem ser curtos.
+    """
+
+    def __init__(self, agendador, ociosidade=OCIOSIDADE_SESSAO_MIN * 60, intervalo=INTERVALO_VARREDURA_SESSOES):
+        self._agendador = agendador
+        self.ociosidade = ociosidade
+        self.intervalo = intervalo
+        self._sessoes = {}  # chave -> {"inicio", "atividade", "pausada", "bytes", "medir", "descartar"}
+        self._trava = threading.Lock()
+        self._ativo = False
+        self.descartes = 0  # Sessões pausadas desde que o processo subiu
+
+    def registrar(self, chave, medir, descartar):
+        agora = time.time()
+        with self._trava:
+            self._sessoes[chave] = {"inicio": agora, "atividade": agora, "pausada": False, "bytes": 0,
+                                    "medir": medir, "descartar": descartar}
+            if not self._ativo:
+                self._ativo = True
+                self._agendar_varredura()
+
+    def remover(self, chave):
+        with self._trava:
+            self._sessoes.pop(chave, None)
+
+    def tocar(self, chave):
+        with self._trava:
+            sessao = self._sessoes.get(chave)
+            if sessao:
+                sessao["atividade"] = time.time()
+                sessao["pausada"] = False
+
+    def quantidade(self):
+        return len(self._sessoes)
+
+    def ultima_atividade(self, chave):
+        """Horário (time.time) da última interação da sessão; infinito se ela não está registrada."""
+        with self._trava:
+            sessao = self._sessoes.get(chave)
+            return sessao["atividade"] if sessao else float("inf")
+
+    def descartar_ociosas(self, ociosidade=None):
+        """Pausa as sessões sem interação há mais de `ociosidade` segundos (0 = nunca); retorna quantas."""
+        ociosidade = self.ociosidade if ociosidade is None else ociosidade
+        if not ociosidade:
+            return 0
+        limite = time.time() - ociosidade
+        with self._trava:
+            candidatas = [(chave, s) for chave, s in self._sessoes.items()
+                          if not s["pausada"] and s["atividade"] <= limite]
+        pausadas = 0
+        for chave, sessao in candidatas:
+            try:
+                if sessao["descartar"](limite):
+                    with self._trava:
+                        sessao["pausada"] = sessao["atividade"] <= limite  # Quem voltou logo depois segue ativa
+                    pausadas += 1
+            except Exception as ex:
+                print(f"AVISO: descarte da sessão {chave} falhou: {ex}")
+        self.descartes += pausadas
+        return pausadas
+
+    def resumo(self):
+        """Contagem e memória estimada das sessões deste processo (mede cada uma agora)."""
+        agora = time.time()
+        with self._trava:
+            sessoes = list(self._sessoes.items())
+        lista = []
+        for chave, sessao in sessoes:
+            try:
+                sessao["bytes"] = sessao["medir"]()
+            except Exception:
+                pass  # Controles mudando no meio da medição: fica a medida anterior
+            lista.append({"chave": str(chave), "inicio": sessao["inicio"], "ociosa_s": agora - sessao["atividade"],
+                          "pausada": sessao["pausada"], "bytes": sessao["bytes"]})
+        return {"pid": os.getpid(), "em": agora, "sessoes": len(lista),
+                "pausadas": sum(1 for s in lista if s["pausada"]), "bytes_sessoes": sum(s["bytes"] for s in lista),
+                "rss": memoria_processo(), "descartes": self.descartes, "lista": lista}
+
+    def gravar_resumo(self, pasta=PASTA_SESSOES):
+        resumo = self.resumo()
+        try:
+            os.makedirs(pasta, exist_ok=True)
+            gravar_arquivo_atomico(os.path.join(pasta, f"{resumo['pid']}.json"),
+                                   json.dumps(resumo, ensure_ascii=False).encode("utf-8"))
+        except OSError as ex:
+            print(f"AVISO: não foi possível gravar o resumo de sessões: {ex}")
+        return resumo
+
+    def _agendar_varredura(self):
+        self._agendador.agendar(("sessoes", id(self)), datetime.fromtimestamp(time.time() + self.intervalo),
+                                self._varrer)
+
+    def _varrer(self):
+        self.descartar_ociosas()
+        self.gravar_resumo()
+        with self._trava:
+            if self._sessoes:
+                self._agendar_varredura()
+            else:
+                self._ativo = False
+
+
+def resumo_workers(pasta=PASTA_SESSOES, validade=3 * INTERVALO_VARREDURA_SESSOES):
+    """
+    Resumos de sessões de todos os workers que usam a mesma pasta, do mais novo ao mais velho.
+    O de um worker que parou de gravar há mais de `validade` segundos é apagado (worker que saiu).
+    """
+    resumos = []
+    try:
+        nomes = os.listdir(pasta)
+    except FileNotFoundError:
+        return resumos
+    for nome in nomes:
+        caminho = os.path.join(pasta, nome)
+        try:
+            if time.time() - os.path.getmtime(caminho) > validade:
+                os.remove(caminho)
+                continue
+            with open(caminho, encoding="utf-8") as f:
+                resumos.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sorted(resumos, key=lambda r: r.get("em", 0), reverse=True)
+
+
+SESSOES = RegistroSessoes(LEMBRETES)
+
+
+# --- ARQUIVOS AFD DO RELÓGIO DE PONTO (REP) ---
+# AFD: um registro de largura fixa por linha, NSR (9 dígitos) + tipo (1) + campos do tipo.
+# Marcações: tipo 3 da Portaria 1510 (DDMMAAAA HHMM + PIS) ou tipos 3/7 da Portaria 671
+# ("AAAA-MM-DDThh:mm:00-0300" + CPF). O cabeçalho (tipo 1) traz o número de fabricação do REP.
+TAMANHO_LOTE_AFD = 5000  # Marcações acumuladas antes de mesclar nos dados e enfileirar a gravação
+
+
+def somente_digitos(valor):
+    """PIS/CPF só com os dígitos significativos ("012.345.678-90" -> "1234567890")."""
+    return re.sub(r"\D", "", str(valor or "")).lstrip("0")
+
+
+def rep_do_cabecalho_afd(linha):
+    """Número de fabricação do REP no cabeçalho (leiaute 671 tem CNO/CAEPF com 14 posições, o 1510 CEI com 12)."""
+    if len(linha) >= 216 and linha[210] == "-":
+        return linha[189:206].strip()
+    return linha[187:204].strip()
+
+
+def marcacao_afd(linha):
+    """(identificador, "AAAA-MM-DD", "HH:MM") de um registro de marcação, ou None se estiver malformado."""
+    try:
+        if linha[14] == "-":  # Portaria 671
+            ident, ano, mes, dia = int(linha[34:46]), linha[10:14], linha[15:17], linha[18:20]
+            hh, mm = linha[21:23], linha[24:26]
+        else:  # Portaria 1510
+            ident, dia, mes, ano = int(linha[22:34]), linha[10:12], linha[12:14], linha[14:18]
+            hh, mm = linha[18:20], linha[20:22]
+        datetime(int(ano), int(mes), int(dia), int(hh), int(mm))
+    except (ValueError, IndexError):
+        return None
+    return ident, f"{ano}-{mes}-{dia}", f"{hh}:{mm}"
+
+
+# Exportação no leiaute da Portaria 671: AFD (largura fixa) e AEJ (campos separados por "|")
+FORMATOS_LEGAIS = ("afd", "aej")
+FUSO_AFD = "-0300"  # Horário de Brasília, como o TZ configurado em start_app
+REP_EXPORTACAO = "0" * 17  # Número de fabricação informado no cabeçalho (o sistema não é um REP físico)
+MODELO_EXPORTACAO = "CONTROLE DE PONTO WEB"
+
+
+def _tabela_crc16_kermit():
+    tabela = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+        tabela.append(crc)
+    return tabela
+
+
+_CRC16_KERMIT = _tabela_crc16_kermit()
+
+
+def crc16_afd(registro):
+    """CRC-16/KERMIT do registro, em 4 dígitos hexadecimais (campo final dos registros do AFD)."""
+    crc = 0
+    for byte in registro.encode("latin-1", "replace"):
+        crc = (crc >> 8) ^ _CRC16_KERMIT[(crc ^ byte) & 0xFF]
+    return f"{crc:04X}"
+
+
+def data_hora_afd(data, hora):
+    return f"{data}T{hora}:00{FUSO_AFD}"
+
+
+class GeradorArquivoLegal:
+    """
+    Escreve um AFD ou AEJ registro a registro, direto no arquivo: nada além da linha atual fica
+    em memória, e as contagens do trailer são acumuladas enquanto as marcações passam.
+    """
+
+    def __init__(self, arquivo, formato, inicio, fim, cpf, empregador, nome_funcionario, jornada_min):
+        self.arquivo = arquivo
+        self.formato = formato
+        self.cpf = cpf
+        self.marcacoes = 0
+        self._nsr = 0
+        self._dia_atual, self._seq_dia = None, 0
+        gerado_em = datetime.now().strftime("%Y-%m-%dT%H:%M:00") + FUSO_AFD
+        cnpj, razao_social = empregador
+        tipo_empregador = "2" if len(cnpj) == 11 else "1"  # CPF ou CNPJ
+        if formato == "afd":
+            self._linha("000000000" + "1" + tipo_empregador + cnpj.zfill(14) + "0" * 14
+                        + razao_social[:150].ljust(150) + REP_EXPORTACAO + inicio + fim + gerado_em + "003"
+                        + "1" + "0" * 14 + MODELO_EXPORTACAO.ljust(30), crc=True)
+        else:
+            self._campos("01", tipo_empregador, cnpj, "", "", razao_social, inicio, fim, gerado_em, "001")
+            self._campos("02", "1", "3", REP_EXPORTACAO)
+            self._campos("03", "1", cpf, nome_funcionario)
+            self._campos("04", "1", jornada_min)
+
+    def _linha(self, registro, crc=False):
+        self.arquivo.write(registro + (crc16_afd(registro) if crc else "") + "\r\n")
+
+    def _campos(self, *campos):
+        self.arquivo.write("|".join(str(c) for c in campos) + "\r\n")
+
+    def marcacao(self, data, hora):
+        self.marcacoes += 1
+        if self.formato == "afd":
+            self._nsr += 1
+            self._linha(f"{self._nsr:09d}3{data_hora_afd(data, hora)}{self.cpf.zfill(12)}", crc=True)
+            return
+        # AEJ: entrada/saída alternadas no dia, numeradas por par (1ª entrada e 1ª saída = 1...)
+        if data != self._dia_atual:
+            self._dia_atual, self._seq_dia = data, 0
+        tipo = "E" if self._seq_dia % 2 == 0 else "S"
+        self._campos("05", "1", data_hora_afd(data, hora), "1", tipo, self._seq_dia // 2 + 1, "O", "1", "")
+        self._seq_dia += 1
+
+    def finalizar(self):
+        if self.formato == "afd":
+            self._linha("999999999" + "0" * 9 + f"{self.marcacoes:09d}" + "0" * 36 + "9")
+        else:
+            self._campos("99", 1, 1, 1, 1, self.marcacoes, 0, 0, 0)
+
+
 # --- CLASSE PRINCIPAL (BACKEND) ---
+class ErroMesFechado(ValueError):
+    """Tentativa de alterar um dia de um mês fechado (ver ControlePontoApp.fechar_mes)."""
+
+
 class ControlePontoApp:
     def __init__(self):
+        self._cache_series = {}
+        self._cache_dias_uteis = {}
+        self._mtime_config = None
         self.config = self.carregar_config()  # Carrega config primeiro
         self.dados = self.carregar_dados()
+        if not LEMBRETES.agendado(("backup", os.path.abspath(PASTA_BACKUPS))):
+            agendar_backup_automatico(self.backups, self.config.get("backup_intervalo_horas", 24))
+
+    @property
+    def backups(self):
+        """Backups automáticos da pasta de dados, com a retenção da config (ver BackupsIncrementais)."""
+        return BackupsIncrementais(self.dados, PASTA_BACKUPS, self.config.get("backup_cadeias", 4),
+                                   self.config.get("backup_incrementais", 30))
+
+    @property
+    def versao_dados(self):
+        """Muda a cada alteração (desta ou de outra sessão); invalida os caches derivados dos dados."""
+        return self.dados.versao
 
     def carregar_dados(self):
-        if os.path.exists(ARQUIVO_DADOS):
+        """
+        Abre o armazenamento por mês compartilhado do processo (só o manifesto é lido agora).
+        Na primeira abertura de uma base ainda não validada roda a varredura de qualidade (ver validar).
+        """
+        dados = abrir_armazenamento(PASTA_DADOS, self.config.get("formato_dados", "json"), resumir=self._resumir_mes)
+
+        # Migração: primeiro uso após a troca do arquivo único para partições mensais
+        if not dados.existe() and os.path.exists(ARQUIVO_DADOS):
             try:
-                with open(ARQUIVO_DADOS, "r", encoding="utf-8") as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
+                with open(ARQUIVO_DADOS, "rb") as f:
+                    legado = desserializar_dados(f.read())
+                validos, quarentena = separar_invalidos(legado)
+                for data, info in validos.items():
+                    dados[data] = info
+                dados.salvar()
+                dados.quarentenar(quarentena)
+                os.replace(ARQUIVO_DADOS, ARQUIVO_DADOS + ".migrado")
+                print(f"Dados migrados para {PASTA_DADOS}/ ({len(legado)} dias).")
+            except Exception as ex:
+                print(f"ERRO ao migrar {ARQUIVO_DADOS}: {ex}")
+
+        if not dados.validado():
+            try:
+                itens = dados.validar()
+            except Exception as ex:
+                print(f"ERRO na validação dos dados: {ex}")
+            else:
+                if itens:
+                    fora = sum(1 for item in itens if item["destino"] == "quarentena")
+                    print(f"AVISO: validação dos dados: {fora} dia(s) movido(s) para a quarentena e "
+                          f"{len(itens) - fora} corrigido(s). Detalhes em {PASTA_DADOS}/{ARQUIVO_QUARENTENA}.")
+        return dados
+
+    # --- CONSULTAS POR PERÍODO (ÍNDICE ORDENADO DE DATAS) ---
+    def iterar_periodo(self, inicio=None, fim=None):
+        """(data, info) em ordem entre `inicio` e `fim` (inclusive; None = sem limite), via índice do manifesto."""
+        for data in self.dados.datas_periodo(inicio, fim):
+            yield data, self.dados[data]
+
+    def iterar_mes(self, mes):
+        """(data, info) em ordem dos dias do mês AAAA-MM."""
+        for data in self.dados.datas_com_prefixo(mes):
+            yield data, self.dados[data]
+
+    # --- REGRAS COM VIGÊNCIA ---
+    def _linha_do_tempo(self):
+        """
+        Regras de saldo em ordem de vigência: [(desde, regras)]. O primeiro trecho (desde "")
+        são as chaves meta_diaria/fator_* do config; cada item de config["regras_vigencia"]
+        ({"desde": AAAA-MM-DD, ...}) vale da sua data em diante, até a próxima mudança.
+        """
+        if self._linha_tempo is None:
+            base = {k: self.config.get(k, padrao) for k, padrao in REGRAS_PADRAO.items()}
+            linha = [("", base)]
+            for mudanca in sorted(self.config.get("regras_vigencia") or [], key=lambda m: m["desde"]):
+                regras = dict(linha[-1][1])
+                regras.update({k: mudanca[k] for k in REGRAS_PADRAO if k in mudanca})
+                linha.append((mudanca["desde"], regras))
+            self._linha_tempo = (linha, [desde for desde, _ in linha])
+        return self._linha_tempo
+
+    def regras_em(self, data_str=None):
+        """Regras de saldo vigentes na data (hoje, se omitida)."""
+        linha, datas = self._linha_do_tempo()
+        data_str = data_str or self.obter_hoje_str()
+        return linha[bisect.bisect_right(datas, data_str) - 1][1]
+
+    def _regras_saldo(self, mes=None):
+        """
+        Parâmetros que influenciam o saldo de um mês (ou de todo o histórico, sem `mes`); se mudarem,
+        os totais do manifesto daquele mês ficam inválidos. Uma mudança com vigência a partir de
+        uma data só muda a assinatura dos meses dali em diante: os anteriores reaproveitam os totais.
+        """
+        linha, datas = self._linha_do_tempo()
+        if mes is None:
+            trechos = linha
+        else:
+            i = bisect.bisect_right(datas, f"{mes}-01") - 1
+            trechos = [(None, linha[i][1])] + [t for t in linha[i + 1:] if t[0][:7] == mes]
+        return [[desde] + [regras[k] for k in REGRAS_PADRAO] for desde, regras in trechos] + [VERSAO_RESUMO]
+
+    def meta_periodo(self, inicio, fim):
+        """Segundos previstos entre duas datas: dias úteis de cada trecho da vigência × a meta do trecho."""
+        linha, _ = self._linha_do_tempo()
+        total = 0
+        for i, (desde, regras) in enumerate(linha):
+            fim_trecho = fim
+            if i + 1 < len(linha):
+                fim_trecho = (datetime.strptime(linha[i + 1][0], "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+            a, b = max(inicio, desde), min(fim, fim_trecho)
+            if a <= b:
+                total += self.dias_uteis_periodo(a, b) * regras["meta_diaria"] * 3600
+        return total
+
+    def _agregado_dia(self, data, info):
+        """Contribuição de um dia para os agregados de relatório."""
+        dt_obj = datetime.fromisoformat(data)  # Chaves já validadas (ver DadosParticionados.validar)
+        trabalhado, meta, saldo, eh_feriado = self.obter_saldo_dia(data, info)
+        agregado = agregado_vazio()
+        agregado["dias"] = 1
+        agregado["trabalhado"] = trabalhado
+        agregado["saldo"] = saldo
+        agregado["ajuste"] = info.get("ajuste_manual", 0) * 60
+
+        regras = self.regras_em(data)
+        dia_util = dt_obj.weekday() < 5 and not eh_feriado
+        if info.get("folga"):
+            agregado["ferias" if info.get("is_ferias") else "folgas"] = 1
+            if dia_util:
+                agregado["folgas_dia_util"] = 1
+                agregado["meta_folgas"] = regras["meta_diaria"] * 3600
+        elif dia_util:
+            if trabalhado > meta:
+                agregado["extras"][str(regras["fator_dia_util"])] = trabalhado - meta
+        elif trabalhado > 0:
+            agregado["extras"][str(regras["fator_fds"])] = trabalhado
+        return agregado
+
+    def _resumir_mes(self, mes, dias):
+        total = agregado_vazio()
+        semanas = {}
+        for data, info in dias.items():
+            agregado = self._agregado_dia(data, info)
+            somar_agregado(total, agregado)
+            somar_agregado(semanas.setdefault(chave_semana(data), agregado_vazio()), agregado)
+        total["semanas"] = semanas
+        total["regras"] = self._regras_saldo(mes)
+        return total
+
+    def totais_mes(self, mes):
+        """
+        Totais do mês vindos do manifesto; recalcula (lendo a partição) se as regras do mês mudaram.
+        Mês fechado devolve os totais congelados no fechamento.
+        """
+        fechamento = self.fechamento(mes)
+        if fechamento and fechamento.get("totais"):
+            return fechamento["totais"]
+        totais = self.dados.totais(mes)
+        if not totais or totais.get("regras") != self._regras_saldo(mes):
+            totais = self._resumir_mes(mes, self.dados.particao(mes))
+            self.dados.definir_totais(mes, totais)
+        return totais
+
+    def saldo_mes(self, mes):
+        """Saldo do mês que entra no banco de horas, respeitando a data de início da contagem."""
+        data_corte = self.config.get("data_inicio_contagem")
+        if data_corte and mes < data_corte[:7]:
+            return 0
+        fechamento = self.fechamento(mes)
+        if fechamento and fechamento.get("inicio_contagem") == data_corte:
+            return fechamento["saldo"]
+        if data_corte and mes == data_corte[:7]:
+            # Mês do corte: só conta os dias a partir da data de início
+            return sum(self.obter_saldo_dia(data, info)[2]
+                       for data, info in self.dados.particao(mes).items() if data >= data_corte)
+        return self.totais_mes(mes)["saldo"]
+
+    def saldo_anterior(self, mes_ref):
+        """Banco de horas acumulado antes de `mes_ref`: parte do último fechamento e soma só os meses abertos."""
+        data_corte = self.config.get("data_inicio_contagem")
+        fechamentos = self.config.get("fechamentos") or {}
+        inicio, acumulado = "", 0
+        ultimo = max((mes for mes in fechamentos if mes < mes_ref), default=None)
+        if ultimo and fechamentos[ultimo].get("inicio_contagem") == data_corte:
+            inicio, acumulado = ultimo, fechamentos[ultimo]["acumulado"]
+        return acumulado + sum(self.saldo_mes(mes) for mes in self.dados.meses() if inicio < mes < mes_ref)
+
+    # --- FECHAMENTO DE MÊS ---
+    def fechamento(self, mes):
+        """Fotografia do mês fechado ({saldo, acumulado, totais, ...}) ou None se o mês está aberto."""
+        return (self.config.get("fechamentos") or {}).get(mes)
+
+    def ultimo_mes_fechado(self):
+        """AAAA-MM do último fechamento (todos os meses até ele estão fechados) ou None."""
+        return max(self.config.get("fechamentos") or {}, default=None)
+
+    def mes_fechado(self, data_ou_mes):
+        """True se a data (AAAA-MM-DD) ou o mês (AAAA-MM) já foi fechado."""
+        ultimo = self.ultimo_mes_fechado()
+        return ultimo is not None and data_ou_mes[:7] <= ultimo
+
+    def _exigir_aberto(self, data_ou_mes):
+        self.sincronizar()  # Um mês fechado por outra sessão/processo vale na hora
+        if self.mes_fechado(data_ou_mes):
+            raise ErroMesFechado(f"O mês {data_ou_mes[5:7]}/{data_ou_mes[:4]} está fechado. Reabra-o para editar.")
+
+    def fechar_mes(self, mes):
+        """
+        Fecha `mes` e os meses abertos antes dele: o saldo, o banco acumulado e os totais de cada um
+        viram uma fotografia em config["fechamentos"] que não muda mais (nem com novas regras).
+        O banco de horas passa a partir do último fechamento e os meses fechados só aceitam edição
+        depois de reabertos. Retorna os meses fechados agora.
+        """
+        datetime.strptime(mes, "%Y-%m")  # ValueError se o mês for inválido
+        if mes >= datetime.now().strftime("%Y-%m"):
+            raise ValueError("Só é possível fechar meses que já terminaram.")
+
+        # Garante que o que outras sessões/processos gravaram entre na fotografia
+        self.aguardar_gravacao()
+        self.sincronizar()
+
+        def fechar(config):
+            ultimo = max(config.get("fechamentos") or {}, default="")
+            if mes <= ultimo:
+                return []  # Outra sessão já fechou
+            com_dados = set(self.dados.meses())
+            meses = sorted({m for m in com_dados if ultimo < m <= mes} | {mes})
+            data_corte = config.get("data_inicio_contagem")
+            fechamentos = dict(config.get("fechamentos") or {})
+            acumulado = self.saldo_anterior(meses[0])
+            for m in meses:
+                saldo = self.saldo_mes(m) if m in com_dados else 0
+                acumulado += saldo
+                totais = {k: v for k, v in self.totais_mes(m).items() if k != "regras"} if m in com_dados else None
+                fechamentos[m] = {"saldo": saldo, "acumulado": acumulado, "totais": totais,
+                                  "inicio_contagem": data_corte,
+                                  "fechado_em": datetime.now().strftime("%Y-%m-%d %H:%M")}
+            config["fechamentos"] = fechamentos
+            return meses
+
+        return self._alterar_config(fechar)
+
+    def reabrir_mes(self, mes):
+        """Reabre `mes` e os fechamentos posteriores (o acumulado deles dependia deste). Retorna os reabertos."""
+        def reabrir(config):
+            fechamentos = dict(config.get("fechamentos") or {})
+            reabertos = sorted(m for m in fechamentos if m >= mes)
+            for m in reabertos:
+                del fechamentos[m]
+            config["fechamentos"] = fechamentos
+            return reabertos
+
+        return self._alterar_config(reabrir)
+
+    def serie_saldo(self, modo, referencia=None):
+        """
+        Série [(x, saldo acumulado em segundos, rótulo)] para o gráfico de períodos longos.
+        - "ano": um ponto por dia do ano `referencia` (AAAA), partindo do banco acumulado até janeiro.
+        - "historico": um ponto por mês, usando só os totais do manifesto.
+        O resultado fica em cache até os dados, as regras ou a data de corte mudarem.
+        """
+        assinatura = (self.versao_dados, self._regras_saldo(), self.config.get("data_inicio_contagem"),
+                      self.ultimo_mes_fechado())
+        em_cache = self._cache_series.get((modo, referencia))
+        if em_cache and em_cache[0] == assinatura:
+            return em_cache[1]
+
+        serie = []
+        if modo == "ano":
+            data_corte = self.config.get("data_inicio_contagem")
+            inicio_ano = datetime(int(referencia), 1, 1).toordinal()
+            acumulado = self.saldo_anterior(f"{referencia}-01")
+            for data, info in self.iterar_periodo(max(f"{referencia}-01-01", data_corte or ""), f"{referencia}-12-31"):
+                acumulado += self.obter_saldo_dia(data, info)[2]
+                dt = datetime.strptime(data, "%Y-%m-%d")
+                serie.append((dt.toordinal() - inicio_ano + 1, acumulado, dt.strftime("%d/%m")))
+        else:
+            acumulado = 0
+            for i, mes in enumerate(m for m in self.dados.meses() if m != PARTICAO_OUTROS):
+                acumulado += self.saldo_mes(mes)
+                serie.append((i + 1, acumulado, f"{mes[5:7]}/{mes[2:4]}"))
+
+        self._cache_series[(modo, referencia)] = (assinatura, serie)
+        return serie
+
+    def exportar_backup(self, caminho):
+        """Grava todo o histórico em um único JSON (formato de backup/restauração), só com os dados do usuário."""
+        with open(caminho, "wb") as f:
+            f.write(serializar_dados({data: _conteudo_dia(self.dados[data]) for data in self.dados}, "json"))
+
+    def restaurar_backup(self, caminho):
+        """
+        Substitui todos os dados pelo conteúdo de um backup (JSON ou outro formato de FORMATOS_DADOS),
+        lido em fluxo (ver ler_backup_em_fluxo). Um erro de sintaxe levanta ValueError com a linha e
+        nada muda; dias inválidos vão para a quarentena com a linha onde estavam (retorna esses itens).
+        """
+        return self._restaurar_de(ler_backup_em_fluxo(caminho))
+
+    def restaurar_ponto(self, arquivo):
+        """
+        Volta os dados ao estado do backup automático `arquivo` (ver BackupsIncrementais.estado_em).
+        Antes faz um backup do estado atual, para a restauração poder ser desfeita.
+        """
+        if self.ultimo_mes_fechado():
+            raise ErroMesFechado("Há meses fechados. Reabra-os antes de restaurar um backup.")
+        novos = self.backups.estado_em(arquivo)
+        return self._restaurar_de((data, info, None) for data, info in novos.items())
+
+    def _restaurar_de(self, dias):
+        """
+        Restauração: `dias` gera (data, info, linha). Cada dia é conferido (sanear_dia) e vai para uma
+        pasta de preparação em lotes de meses, então a memória fica limitada a alguns meses mesmo
+        para backups de vários anos. Só com tudo lido os dados são trocados, de uma vez (trocar_por),
+        depois de um backup automático do estado atual para a restauração poder ser desfeita.
+        Cada dia restaurado ganha uma _versao acima da do disco e da do último backup, então a
+        próxima edição dele nunca repete um número que o backup incremental já registrou.
+        """
+        if self.ultimo_mes_fechado():
+            raise ErroMesFechado("Há meses fechados. Reabra-os antes de restaurar um backup.")
+        pasta_preparo = PASTA_DADOS + ".restauracao"
+        quarentena = []
+        try:
+            # O backup de antes da troca registra as versões que estão no disco depois desta gravação
+            self.salvar_dados(esperar=True)
+            versoes_disco = self.dados.versoes_disco()
+            versoes_backup = self.backups.versoes_registradas()
+
+            preparo = PreparoRestauracao(pasta_preparo, self.dados.formato, self._resumir_mes)
+            for data, info, linha in dias:
+                corrigido, motivos = sanear_dia(data, info)
+                if motivos:
+                    quarentena.append(item_quarentena(data, info, motivos, corrigido, linha=linha))
+                if corrigido is None:
+                    continue
+                corrigido["_versao"] = max(versoes_disco.get(data, 0), versoes_backup.get(data, 0)) + 1
+                preparo.adicionar(data, corrigido)
+            preparado = preparo.concluir()
+
+            self.backups.fazer()
+            self.dados.trocar_por(preparado)
+        finally:
+            shutil.rmtree(pasta_preparo, ignore_errors=True)
+        self.dados.quarentenar(quarentena)
+        return quarentena
 
     def carregar_config(self):
         """Carrega configurações do usuário (Meta, Fatores, Tema)."""
+        self._linha_tempo = None
         default = {
             "meta_diaria": 8,
             "fator_dia_util": 1.0,  # Multiplicador normal
             "fator_fds": 2.0,  # Multiplicador FDS (Dobro)
+            "regras_vigencia": [],  # Mudanças de meta/fatores a partir de uma data (ver _linha_do_tempo)
+            "fechamentos": {},  # AAAA-MM -> fotografia do mês fechado (ver fechar_mes)
             "tema_inicial": "light",
             "data_inicio_contagem": None,  # Data de corte para o banco de horas
-            "ultimo_hash_pdf": None  # Armazena o hash do último PDF importado
+            "ultimo_hash_pdf": None,  # Armazena o hash do último PDF importado
+            "afd_identificadores": [],  # PIS/CPF do funcionário nos arquivos AFD do relógio (ver importar_afd)
+            "afd_ultimo_nsr": {},  # Número de fabricação do REP -> último NSR já importado
+            "empregador_cnpj": "",  # Cabeçalho dos arquivos AFD/AEJ exportados (ver exportar_arquivo_legal)
+            "empregador_razao_social": "",
+            "funcionario_nome": "",
+            "backup_intervalo_horas": 24,  # Backup automático incremental (0 desliga; ver BackupsIncrementais)
+            "backup_cadeias": 4,  # Cadeias (completo + incrementais) mantidas em PASTA_BACKUPS
+            "backup_incrementais": 30,  # Incrementais antes de um novo backup completo
+            "sessao_ociosidade_min": OCIOSIDADE_SESSAO_MIN,  # Sessão parada há mais que isso é pausada (0 desliga; ver SESSOES)
+            "formato_dados": "json",  # Ver FORMATOS_DADOS (json compacto, json_zlib ou msgpack)
+            "gravacao_assincrona": True  # Grava em segundo plano; o handler não espera o disco
         }
         if os.path.exists(ARQUIVO_CONFIG):
             try:
+                self._mtime_config = os.stat(ARQUIVO_CONFIG).st_mtime_ns
                 with open(ARQUIVO_CONFIG, "r", encoding="utf-8") as f:
                     salvo = json.load(f)
                     # Garante que todas as chaves existam mesclando
@@ -1864,25 +2333,93 @@ class ControlePontoApp:
                 return default
         return default
 
-    def salvar_dados(self):
-        with open(ARQUIVO_DADOS, "w", encoding="utf-8") as f:
-            json.dump(self.dados, f, indent=4, ensure_ascii=False)
+    def salvar_dados(self, esperar=False):
+        """
+        Persiste as alterações. Em modo assíncrono o handler retorna na hora (o estado em memória
+        já está atualizado); use esperar=True quando precisar da garantia de que está no disco.
+        """
+        self.dados.salvar(esperar=esperar or not self.config.get("gravacao_assincrona", True))
 
-    def salvar_config(self, meta=None, f_util=None, f_fds=None, tema=None):
-        # Atualiza apenas o que for passado
-        if meta is not None: self.config["meta_diaria"] = meta
-        if f_util is not None: self.config["fator_dia_util"] = f_util
-        if f_fds is not None: self.config["fator_fds"] = f_fds
-        if tema is not None: self.config["tema_inicial"] = tema
+    def aguardar_gravacao(self, timeout=None):
+        """Bloqueia até todas as gravações pendentes estarem no disco."""
+        return GRAVADOR.aguardar(timeout)
 
-        with open(ARQUIVO_CONFIG, "w", encoding="utf-8") as f:
-            json.dump(self.config, f, indent=4, ensure_ascii=False)
+    def sincronizar(self):
+        """
+        Traz para esta sessão o que outras sessões/processos mudaram (dados e config).
+        Chamado antes de redesenhar a tela; sem mudanças custa só dois os.stat.
+        """
+        try:
+            mtime = os.stat(ARQUIVO_CONFIG).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None and mtime != self._mtime_config:
+            self.config = self.carregar_config()
+            self.dados.formato = self.config.get("formato_dados", "json")
+        return self.dados.sincronizar()
+
+    def _gravar_config(self):
+        """Grava o config.json de forma atômica (outros workers podem estar lendo)."""
+        conteudo = json.dumps(self.config, indent=4, ensure_ascii=False).encode("utf-8")
+        gravar_arquivo_atomico(ARQUIVO_CONFIG, conteudo)
+        self._mtime_config = os.stat(ARQUIVO_CONFIG).st_mtime_ns
+
+    def _alterar_config(self, alteracao):
+        """
+        Muda o config.json sem perder o que outras sessões/processos gravaram: sob a trava da pasta de
+        dados (entre processos) e a do armazenamento (entre as sessões deste processo), relê o arquivo,
+        aplica `alteracao(config)` e grava. self.config passa a ser o resultado; retorna o que
+        `alteracao` retornar. Não chame com a trava do armazenamento já tomada (a ordem é arquivo,
+        depois memória).
+        """
+        with trava_arquivo(os.path.join(self.dados.pasta, ARQUIVO_TRAVA)), self.dados._trava:
+            self.config = self.carregar_config()
+            resultado = alteracao(self.config)
+            self._gravar_config()
+        return resultado
+
+    def salvar_config(self, meta=None, f_util=None, f_fds=None, tema=None, formato=None, vigencia=None,
+                      identificadores_afd=None):
+        """
+        Atualiza apenas o que for passado. Com `vigencia` (AAAA-MM-DD), meta e fatores valem só a
+        partir daquela data (entram em regras_vigencia) e o saldo antes dela não muda; sem ela,
+        mudam as regras base, que valem para todo o histórico. O que outras sessões gravaram no
+        config.json nesse meio tempo (ex: outra regra com vigência) é preservado (ver _alterar_config).
+        """
+        novas = {"meta_diaria": meta, "fator_dia_util": f_util, "fator_fds": f_fds}
+        if vigencia is not None:
+            datetime.strptime(vigencia, "%Y-%m-%d")  # ValueError se a data for inválida
+
+        def alterar(config):
+            if vigencia is not None:
+                regras = dict(self.regras_em(vigencia))
+                regras.update({k: v for k, v in novas.items() if v is not None})
+                if regras != self.regras_em(vigencia):
+                    linha = [m for m in config.get("regras_vigencia") or [] if m["desde"] != vigencia]
+                    linha.append({"desde": vigencia, **regras})
+                    config["regras_vigencia"] = sorted(linha, key=lambda m: m["desde"])
+            else:
+                for chave, valor in novas.items():
+                    if valor is not None: config[chave] = valor
+            if tema is not None: config["tema_inicial"] = tema
+            if identificadores_afd is not None:
+                config["afd_identificadores"] = [d for d in map(somente_digitos, identificadores_afd) if d]
+            # Trocar o formato regrava o arquivo de dados já no novo formato
+            trocou = formato is not None and formato != config.get("formato_dados", "json")
+            if trocou:
+                config["formato_dados"] = formato
+            return trocou
+
+        trocou_formato = self._alterar_config(alterar)
+        self._linha_tempo = None
+        if trocou_formato:
+            self.dados.formato = formato
+            self.dados.marcar_tudo_alterado()
+            self.salvar_dados(esperar=True)
 
     def zerar_banco_horas(self):
         """Define a data de hoje como o início da contagem, arquivando o passado virtualmente."""
-        self.config["data_inicio_contagem"] = datetime.now().strftime("%Y-%m-%d")
-        with open(ARQUIVO_CONFIG, "w", encoding="utf-8") as f:
-            json.dump(self.config, f, indent=4, ensure_ascii=False)
+        self._alterar_config(lambda config: config.update(data_inicio_contagem=datetime.now().strftime("%Y-%m-%d")))
 
     def obter_hoje_str(self):
         return datetime.now().strftime("%Y-%m-%d")
@@ -1918,6 +2455,30 @@ class ControlePontoApp:
                     pass  # Ignora horários inválidos
         return total_segundos
 
+    def previsao_saida(self, data_str=None, agora=None):
+        """
+        Horário previsto de saída de um dia com batida em aberto (número ímpar de batidas):
+        agora + o que falta para a meta diária. None se não há batida em aberto ou a meta já foi cumprida.
+        """
+        agora = (agora or datetime.now()).replace(second=0, microsecond=0)
+        data_str = data_str or agora.strftime("%Y-%m-%d")
+        info = self.dados.get(data_str)
+        if not info or len(info["batidas"]) % 2 == 0:
+            return None
+        falta = (self.regras_em(data_str)["meta_diaria"] * 3600) - self.trabalhado_ate_agora(data_str, agora)
+        if falta <= 0:
+            return None
+        return agora + timedelta(seconds=falta)
+
+    def trabalhado_ate_agora(self, data_str=None, agora=None):
+        """Segundos trabalhados no dia contando a batida em aberto até `agora`."""
+        agora = agora or datetime.now()
+        data_str = data_str or agora.strftime("%Y-%m-%d")
+        batidas = self.dados.get(data_str, {}).get("batidas", [])
+        if len(batidas) % 2 != 0:
+            batidas = batidas + [agora.strftime("%H:%M")]
+        return self.calcular_segundos_trabalhados(batidas)
+
     def formatar_duracao(self, segundos):
         sinais = ""
         if segundos < 0:
@@ -1939,22 +2500,16 @@ class ControlePontoApp:
 
         total_trabalhado_seg = self.calcular_segundos_trabalhados(horarios)
 
-        # --- CORREÇÃO AQUI: Tratamento de erro para data inválida ---
-        try:
-            data_obj = datetime.strptime(data_str, "%Y-%m-%d")
-        except ValueError:
-            # Se a data for "null" ou inválida, retorna zerado para não travar o app
-            print(f"AVISO: Data inválida ignorada: {data_str}")
-            return 0, 0, 0, False
-            # -----------------------------------------------------------
-
+        # Datas inválidas (ex: "null") não chegam aqui: ficam na quarentena (ver DadosParticionados.validar)
+        data_obj = datetime.fromisoformat(data_str)
         eh_fds = data_obj.weekday() >= 5
         eh_feriado = GerenciadorFeriados.eh_feriado(data_obj.date())
 
-        # --- APLICAÇÃO DAS CONFIGURAÇÕES ---
-        meta_horas = self.config.get("meta_diaria", 8)
-        fator_util = self.config.get("fator_dia_util", 1.0)
-        fator_fds = self.config.get("fator_fds", 2.0)
+        # --- APLICAÇÃO DAS CONFIGURAÇÕES (as vigentes na data) ---
+        regras = self.regras_em(data_str)
+        meta_horas = regras["meta_diaria"]
+        fator_util = regras["fator_dia_util"]
+        fator_fds = regras["fator_fds"]
 
         meta_segundos = meta_horas * 3600
         saldo_segundos = 0
@@ -1977,28 +2532,72 @@ class ControlePontoApp:
         return total_trabalhado_seg, meta_segundos, saldo_final, eh_feriado
 
     def registrar_batida(self, data_str, hora_str):
-        if data_str not in self.dados:
-            self.dados[data_str] = {"batidas": [], "ajuste_manual": 0, "folga": False}
+        self._exigir_aberto(data_str)
+        return self.mesclar_batidas({data_str: [hora_str]})["adicionadas"] > 0
+
+    def mesclar_batidas(self, batidas_por_dia, substituir=False):
+        """
+        Upsert em lote: {data: horas (qualquer iterável)} entra nos dados com operações de conjunto,
+        e as horas novas são intercaladas na lista já ordenada do dia (sem reordenar tudo).
+        Com substituir=True o dia passa a ter exatamente as horas recebidas (ajuste e folga zerados,
+        como na reimportação de PDF). Dias de meses fechados ficam de fora. Grava uma vez só, no fim.
+        Datas e horas inválidas são separadas antes de qualquer alteração e vão para a quarentena.
+        Retorna {"adicionadas", "duplicadas", "substituidas", "dias_fechados", "invalidas"}.
+        """
+        entrada, quarentena, invalidas = separar_batidas_invalidas(batidas_por_dia)
+        r = {"adicionadas": 0, "duplicadas": 0, "substituidas": 0, "dias_fechados": 0, "invalidas": invalidas}
+
+        alterou = False
+        self.sincronizar()  # Fechamentos feitos por outras sessões/processos
+        for data, recebidas in entrada.items():
+            if self.mes_fechado(data):
+                r["dias_fechados"] += 1
+                continue
+            novas = set(recebidas)
+            r["duplicadas"] += len(recebidas) - len(novas)  # Repetidas na própria entrada
+            # Leitura, diferença e escrita do dia sob a trava do armazenamento: duas sessões do processo
+            # batendo o mesmo minuto não acrescentam a batida duas vezes (nem a gravação vê a lista pela metade)
+            with self.dados._trava:
+                info = self.dados[data] if data in self.dados else None
+                existentes = set(info["batidas"]) if info else set()
+                faltam = novas - existentes
+                r["adicionadas"] += len(faltam)
+                r["duplicadas"] += len(novas) - len(faltam)
 
-        if hora_str not in self.dados[data_str]["batidas"]:
-            self.dados[data_str]["batidas"].append(hora_str)
-            self.dados[data_str]["batidas"].sort()
+                if substituir:
+                    r["substituidas"] += len(existentes - novas)
+                    novo = {"batidas": sorted(novas), "ajuste_manual": 0, "folga": False}
+                    if info is None or any(info.get(k) != v for k, v in novo.items()):
+                        self.dados[data] = novo
+                        alterou = True
+                elif faltam:
+                    if info is None:
+                        info = self.dados.setdefault(data, {"batidas": [], "ajuste_manual": 0, "folga": False})
+                    info["batidas"].extend(sorted(faltam))
+                    info["batidas"].sort()  # O timsort só intercala as duas sequências ordenadas
+                    self.dados.marcar_alterado(data)
+                    alterou = True
+        if alterou:
             self.salvar_dados()
-            return True
-        return False
+        self.dados.quarentenar(quarentena)
+        return r
 
     def atualizar_batida(self, data, hora_antiga, hora_nova):
+        self._exigir_aberto(data)
         if data in self.dados and hora_antiga in self.dados[data]["batidas"]:
             self.dados[data]["batidas"].remove(hora_antiga)
             self.dados[data]["batidas"].append(hora_nova)
             self.dados[data]["batidas"].sort()
+            self.dados.marcar_alterado(data)
             self.salvar_dados()
             return True
         return False
 
     def remover_batida(self, data_str, hora_str):
+        self._exigir_aberto(data_str)
         if data_str in self.dados and hora_str in self.dados[data_str]["batidas"]:
             self.dados[data_str]["batidas"].remove(hora_str)
+            self.dados.marcar_alterado(data_str)
             self.salvar_dados()
 
     def bater_ponto_agora(self):
@@ -2008,12 +2607,15 @@ class ControlePontoApp:
         return f"Ponto batido às {agora}"
 
     def ajustar_manual(self, data, minutos):
+        self._exigir_aberto(data)
         if data in self.dados:
             self.dados[data]["ajuste_manual"] = minutos
+            self.dados.marcar_alterado(data)
             self.salvar_dados()
 
     # ALTERAÇÃO: Agora aceita parâmetro opcional 'eh_ferias'
     def definir_folga(self, data, status, eh_ferias=False):
+        self._exigir_aberto(data)
         if data not in self.dados:
             self.dados[data] = {"batidas": [], "ajuste_manual": 0, "folga": False}
 
@@ -2026,6 +2628,7 @@ class ControlePontoApp:
             # Se desmarcar ou se for folga normal, remove a marcação de férias
             self.dados[data]["is_ferias"] = False
 
+        self.dados.marcar_alterado(data)
         self.salvar_dados()
 
     # --- NOVA FUNÇÃO: REGISTRAR PERÍODO DE FÉRIAS ---
@@ -2036,6 +2639,7 @@ class ControlePontoApp:
 
         delta = (dt_fim - dt_ini).days
         if delta < 0: return  # Data fim menor que inicio
+        self._exigir_aberto(data_ini_str)  # Os fechados vêm antes dos abertos: basta olhar o início
 
         for i in range(delta + 1):
             dia = dt_ini + timedelta(days=i)
@@ -2046,6 +2650,7 @@ class ControlePontoApp:
         self.salvar_dados()
 
     def excluir_dia(self, data):
+        self._exigir_aberto(data)
         if data in self.dados:
             del self.dados[data]
             self.salvar_dados()
@@ -2066,17 +2671,120 @@ class ControlePontoApp:
                         dias_uteis += 1
         return dias_uteis
 
+    # --- RELATÓRIOS POR PERÍODO ---
+    def dias_uteis_periodo(self, inicio, fim):
+        """Dias úteis (seg-sex sem feriado) entre duas datas AAAA-MM-DD, inclusive."""
+        dt_ini = datetime.strptime(inicio, "%Y-%m-%d").date()
+        dt_fim = datetime.strptime(fim, "%Y-%m-%d").date()
+        total = 0
+        dia = dt_ini
+        while dia <= dt_fim:
+            ultimo_do_mes = dia.replace(day=calendar.monthrange(dia.year, dia.month)[1])
+            if dia.day == 1 and ultimo_do_mes <= dt_fim:
+                # Mês inteiro: usa a contagem do calendário (em cache)
+                chave = (dia.year, dia.month)
+                if chave not in self._cache_dias_uteis:
+                    self._cache_dias_uteis[chave] = self.calcular_dias_uteis_mes(dia.year, dia.month)
+                total += self._cache_dias_uteis[chave]
+                dia = ultimo_do_mes + timedelta(days=1)
+                continue
+            if dia.weekday() < 5 and not GerenciadorFeriados.eh_feriado(dia):
+                total += 1
+            dia += timedelta(days=1)
+        return total
+
+    def _finalizar_relatorio(self, rotulo, inicio, fim, agregado):
+        previsto = self.meta_periodo(inicio, fim) - agregado["meta_folgas"]
+        linha = {"periodo": rotulo, "inicio": inicio, "fim": fim, "previsto": previsto}
+        linha.update({campo: agregado[campo] for campo in CAMPOS_AGREGADO})
+        linha["extras"] = dict(agregado["extras"])
+        return linha
+
+    def agregado_periodo(self, inicio, fim):
+        """
+        Soma dos agregados entre duas datas (inclusive). Meses inteiros vêm dos totais do manifesto;
+        só os meses das pontas, quando cortados, são lidos dia a dia.
+        """
+        total = agregado_vazio()
+        for mes in self.dados.meses_periodo(inicio[:7], fim[:7]):
+            ano, num_mes = int(mes[:4]), int(mes[5:7])
+            primeiro = f"{mes}-01"
+            ultimo = f"{mes}-{calendar.monthrange(ano, num_mes)[1]:02d}"
+            if inicio <= primeiro and ultimo <= fim:
+                somar_agregado(total, self.totais_mes(mes))
+                continue
+            for data, info in self.iterar_periodo(max(inicio, primeiro), min(fim, ultimo)):
+                somar_agregado(total, self._agregado_dia(data, info))
+        return total
+
+    def _agregado_semanas(self, inicio, fim):
+        """Agregados por semana ISO, juntando os parciais guardados em cada mês."""
+        semanas = {}
+        for mes in self.dados.meses_periodo(inicio[:7], fim[:7]):
+            for semana, parcial in self.totais_mes(mes).get("semanas", {}).items():
+                somar_agregado(semanas.setdefault(semana, agregado_vazio()), parcial)
+        return semanas
+
+    def gerar_relatorio(self, granularidade, inicio, fim):
+        """
+        Relatório entre `inicio` e `fim` (AAAA-MM-DD), uma linha por semana, mês, trimestre
+        ou uma única linha ("personalizado"). Cada linha traz trabalhado, previsto, saldo,
+        ajuste, extras por multiplicador, folgas e férias (tempos em segundos).
+        """
+        if granularidade not in GRANULARIDADES_RELATORIO:
+            raise ValueError(f"Granularidade inválida: {granularidade}")
+        dt_ini = datetime.strptime(inicio, "%Y-%m-%d").date()
+        dt_fim = datetime.strptime(fim, "%Y-%m-%d").date()
+        if dt_fim < dt_ini:
+            raise ValueError("A data final é anterior à inicial.")
+
+        if granularidade == "personalizado":
+            return [self._finalizar_relatorio(f"{dt_ini:%d/%m/%Y} a {dt_fim:%d/%m/%Y}", inicio, fim,
+                                              self.agregado_periodo(inicio, fim))]
+
+        linhas = []
+        if granularidade == "semana":
+            # Semanas inteiras (seg-dom) que tocam o intervalo
+            seg = dt_ini - timedelta(days=dt_ini.weekday())
+            ultimo_dom = dt_fim + timedelta(days=6 - dt_fim.weekday())
+            semanas = self._agregado_semanas(seg.strftime("%Y-%m-%d"), ultimo_dom.strftime("%Y-%m-%d"))
+            while seg <= dt_fim:
+                dom = seg + timedelta(days=6)
+                ini_str, fim_str = seg.strftime("%Y-%m-%d"), dom.strftime("%Y-%m-%d")
+                agregado = semanas.get(chave_semana(ini_str), agregado_vazio())
+                linhas.append(self._finalizar_relatorio(f"{seg:%d/%m} a {dom:%d/%m/%Y}", ini_str, fim_str, agregado))
+                seg = dom + timedelta(days=1)
+            return linhas
+
+        meses_por_periodo = 1 if granularidade == "mes" else 3
+        ano, mes = dt_ini.year, dt_ini.month
+        if meses_por_periodo == 3:
+            mes = ((mes - 1) // 3) * 3 + 1  # Início do trimestre
+        while (ano, mes) <= (dt_fim.year, dt_fim.month):
+            mes_fim, ano_fim = mes + meses_por_periodo - 1, ano
+            ini_periodo = datetime(ano, mes, 1).date()
+            fim_periodo = datetime(ano_fim, mes_fim, calendar.monthrange(ano_fim, mes_fim)[1]).date()
+            # Recorta o período ao intervalo pedido
+            ini_str = max(ini_periodo, dt_ini).strftime("%Y-%m-%d")
+            fim_str = min(fim_periodo, dt_fim).strftime("%Y-%m-%d")
+            if meses_por_periodo == 1:
+                rotulo = f"{mes:02d}/{ano}"
+            else:
+                rotulo = f"{(mes - 1) // 3 + 1}º tri/{ano}"
+            linhas.append(self._finalizar_relatorio(rotulo, ini_str, fim_str, self.agregado_periodo(ini_str, fim_str)))
+            mes += meses_por_periodo
+            if mes > 12:
+                mes -= 12
+                ano += 1
+        return linhas
+
     def gerar_dataframe_exportacao(self, mes_filtro=None):
         """Prepara dados para Pandas exportar."""
         registros = []
         dias_pt = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
-        datas_ordenadas = sorted(self.dados.keys())
-
-        for data in datas_ordenadas:
-            if mes_filtro and not data.startswith(mes_filtro):
-                continue
+        dias = self.iterar_mes(mes_filtro) if mes_filtro else self.iterar_periodo()
 
-            info = self.dados[data]
+        for data, info in dias:
             trabalhado, meta, saldo, eh_feriado = self.obter_saldo_dia(data, info)
 
             dt_obj = datetime.strptime(data, "%Y-%m-%d")
@@ -2106,8 +2814,203 @@ class ControlePontoApp:
                 "Ajuste Manual (min)": ajuste,
                 "Observação": observacao
             })
+        pd = importar_opcional("pandas")
+        if pd is None:
+            raise RuntimeError("Biblioteca pandas não instalada (pip install pandas openpyxl).")
         return pd.DataFrame(registros)
 
+    def versao_exportacao(self, mes_filtro=None):
+        """
+        Versão dos dados de uma exportação: a revisão gravada de cada mês envolvido + as regras
+        de saldo. Ao contrário de versao_dados (contador em memória do processo), vale entre
+        reinícios e entre workers, por isso é ela que entra na chave do cache em disco.
+        """
+        self.aguardar_gravacao()  # A revisão só muda quando a gravação termina
+        self.sincronizar()
+        meses = [m for m in self.dados.meses()
+                 if not mes_filtro or m.startswith(mes_filtro) or mes_filtro.startswith(m)]
+        return [{m: [self.dados.revisao(m), self._regras_saldo(m)] for m in meses}]
+
+    def exportar_relatorio(self, mes_filtro, formato, caminho):
+        """
+        Gera o XLSX/PDF do período em `caminho`, reaproveitando o arquivo do cache se os dados
+        não mudaram desde a última exportação igual. Retorna True se veio do cache.
+        """
+        dono = os.path.abspath(PASTA_DADOS)  # Um conjunto de dados por pasta (usuário)
+        cabecalho = None
+        if formato in FORMATOS_LEGAIS:  # Os arquivos legais também dependem de quem é o funcionário/empregador
+            cabecalho = [self.config.get(k) for k in ("afd_identificadores", "empregador_cnpj",
+                                                     "empregador_razao_social", "funcionario_nome")]
+        assinatura = json.dumps([dono, mes_filtro, formato, self.versao_exportacao(mes_filtro), cabecalho],
+                                sort_keys=True)
+        chave = hashlib.sha256(assinatura.encode("utf-8")).hexdigest()
+        if CACHE_EXPORTACOES.servir(chave, formato, caminho):
+            return True
+
+        if formato in FORMATOS_LEGAIS:
+            datas = self.dados.datas_com_prefixo(mes_filtro or "")
+            if mes_filtro:
+                ano, mes = map(int, mes_filtro.split("-"))
+                inicio, fim = f"{mes_filtro}-01", f"{mes_filtro}-{calendar.monthrange(ano, mes)[1]:02d}"
+            else:
+                inicio, fim = (datas[0], datas[-1]) if datas else (self.obter_hoje_str(),) * 2
+            self.exportar_arquivo_legal(caminho, inicio, fim, formato)
+        elif formato == "xlsx":
+            df = self.gerar_dataframe_exportacao(mes_filtro)
+            df.to_excel(caminho, index=False)
+        else:
+            df = self.gerar_dataframe_exportacao(mes_filtro)
+            fpdf = importar_opcional("fpdf")
+            if fpdf is None:
+                raise RuntimeError("Biblioteca fpdf não instalada (pip install fpdf).")
+            pdf = fpdf.FPDF()
+            pdf.add_page()
+            pdf.set_font("Arial", size=10)
+            pdf.cell(200, 10, txt="Relatorio de Ponto", ln=1, align='C')
+            pdf.ln(10)
+            for col in df.columns:
+                w = 40 if col == "Batidas" else 25
+                pdf.cell(w, 10, str(col)[:12], border=1)
+            pdf.ln()
+            for i in range(len(df)):
+                for col in df.columns:
+                    w = 40 if col == "Batidas" else 25
+                    val = str(df.iloc[i][col])
+                    pdf.cell(w, 10, val, border=1)
+                pdf.ln()
+            pdf.output(caminho)
+
+        try:
+            CACHE_EXPORTACOES.guardar(chave, formato, caminho)
+        except OSError as ex:
+            print(f"AVISO: não foi possível guardar a exportação no cache: {ex}")
+        return False
+
+    def marcacoes_periodo(self, inicio, fim):
+        """Gera (data, hora) em ordem entre duas datas, um mês por vez (só a partição do mês é lida)."""
+        for data, info in self.iterar_periodo(inicio, fim):
+            for hora in sorted(info["batidas"]):
+                yield data, hora
+
+    def exportar_arquivo_legal(self, caminho, inicio, fim, formato="afd", identificador=None):
+        """
+        Grava as batidas entre `inicio` e `fim` (AAAA-MM-DD) como AFD ou AEJ (ver FORMATOS_LEGAIS)
+        em `caminho`, escrevendo direto no arquivo enquanto percorre os meses. As marcações saem no
+        CPF/PIS `identificador` (por padrão o primeiro de config["afd_identificadores"]).
+        Retorna o número de marcações gravadas.
+        """
+        if formato not in FORMATOS_LEGAIS:
+            raise ValueError(f"Formato inválido: {formato}")
+        if fim < inicio:
+            raise ValueError("A data final é anterior à inicial.")
+        identificador = somente_digitos(identificador or next(iter(self.config.get("afd_identificadores") or []), ""))
+        if not identificador:
+            raise ValueError("Cadastre o PIS/CPF do funcionário nas configurações antes de exportar AFD/AEJ.")
+
+        empregador = (somente_digitos(self.config.get("empregador_cnpj")),
+                      self.config.get("empregador_razao_social") or "")
+        jornada_min = int(self.regras_em(inicio)["meta_diaria"] * 60)
+        temporario = caminho + ".tmp"
+        with open(temporario, "w", encoding="latin-1", errors="replace", newline="") as arquivo:
+            gerador = GeradorArquivoLegal(arquivo, formato, inicio, fim, identificador, empregador,
+                                          self.config.get("funcionario_nome") or "", jornada_min)
+            for data, hora in self.marcacoes_periodo(inicio, fim):
+                gerador.marcacao(data, hora)
+            gerador.finalizar()
+        os.replace(temporario, caminho)
+        return gerador.marcacoes
+
+    # --- IMPORTAÇÃO AFD (RELÓGIO DE PONTO) ---
+    def importar_afd(self, caminho, lote=TAMANHO_LOTE_AFD):
+        """
+        Importa as marcações de um AFD lendo linha a linha (memória limitada ao lote, não ao arquivo).
+        Só entram as marcações dos PIS/CPF de config["afd_identificadores"]; as de outros funcionários
+        são contadas e descartadas. Registros com NSR até o último já importado daquele REP são pulados,
+        então reimportar o mesmo arquivo (ou a versão mais nova dele) só processa o que é novo.
+        Marcações de meses fechados não entram e seguram a marca do REP antes delas: depois de
+        reabrir o mês, reimportar o arquivo as traz (as posteriores voltam só como repetidas).
+        A cada `lote` marcações, elas são mescladas nos dados e a gravação é enfileirada.
+        Retorna as contagens e a vazão da importação.
+        """
+        self.sincronizar()  # Parte das marcas de NSR e dos fechamentos mais recentes
+        identificadores = {int(d) for d in map(somente_digitos, self.config.get("afd_identificadores") or []) if d}
+        if not identificadores:
+            raise ValueError("Cadastre o PIS/CPF do funcionário nas configurações antes de importar um AFD.")
+
+        ultimos_nsr = dict(self.config.get("afd_ultimo_nsr") or {})
+        retidos = {}  # REP -> menor NSR pulado por mês fechado (a marca não passa dele)
+        rep, limite = "", ultimos_nsr.get("", 0)
+        r = {"linhas": 0, "marcacoes": 0, "importadas": 0, "duplicadas": 0, "ja_importadas": 0,
+             "outros_funcionarios": 0, "meses_fechados": 0, "invalidas": 0}
+        lote_atual, no_lote = {}, 0
+        inicio = time.perf_counter()
+
+        with open(caminho, "r", encoding="latin-1", newline="") as f:
+            for linha in f:
+                r["linhas"] += 1
+                tipo = linha[9:10]
+                if tipo == "1":
+                    rep = rep_do_cabecalho_afd(linha)
+                    limite = ultimos_nsr.get(rep, 0)
+                    continue
+                if tipo not in ("3", "7"):
+                    continue  # Empresa, ajuste de relógio, cadastro de empregado, trailer...
+                try:
+                    nsr = int(linha[:9])
+                except ValueError:
+                    r["invalidas"] += 1
+                    continue
+                if nsr <= limite:
+                    r["ja_importadas"] += 1
+                    continue
+                ultimos_nsr[rep] = max(ultimos_nsr.get(rep, 0), nsr)
+
+                marcacao = marcacao_afd(linha)
+                if marcacao is None:
+                    r["invalidas"] += 1
+                    continue
+                ident, data, hora = marcacao
+                if ident not in identificadores:
+                    r["outros_funcionarios"] += 1
+                    continue
+                if self.mes_fechado(data):
+                    r["meses_fechados"] += 1
+                    retidos[rep] = min(retidos.get(rep, nsr), nsr)
+                    continue
+                r["marcacoes"] += 1
+                lote_atual.setdefault(data, set()).add(hora)
+                no_lote += 1
+                if no_lote >= lote:
+                    self._mesclar_lote_afd(lote_atual, r)
+                    lote_atual, no_lote = {}, 0
+
+        self._mesclar_lote_afd(lote_atual, r)
+        for rep_lido, nsr in retidos.items():
+            ultimos_nsr[rep_lido] = min(ultimos_nsr[rep_lido], nsr - 1)
+
+        def marcar_nsr(config):
+            # Outra importação pode ter avançado a marca de algum REP enquanto este arquivo era lido
+            marcas = dict(config.get("afd_ultimo_nsr") or {})
+            for rep_lido, nsr in ultimos_nsr.items():
+                marcas[rep_lido] = max(marcas.get(rep_lido, 0), nsr)
+            config["afd_ultimo_nsr"] = marcas
+
+        self._alterar_config(marcar_nsr)
+
+        r["segundos"] = time.perf_counter() - inicio
+        r["linhas_por_segundo"] = r["linhas"] / r["segundos"] if r["segundos"] else 0
+        print(f"AFD: {r['linhas']} linhas em {r['segundos']:.2f}s ({r['linhas_por_segundo']:.0f} linhas/s), "
+              f"{r['importadas']} batidas novas, {r['duplicadas']} repetidas, {r['ja_importadas']} já importadas (NSR), "
+              f"{r['outros_funcionarios']} de outros funcionários")
+        return r
+
+    def _mesclar_lote_afd(self, lote, resumo):
+        """Junta um lote {data: {horas}} às batidas existentes e enfileira a gravação (uma por lote)."""
+        r = self.mesclar_batidas(lote)
+        resumo["importadas"] += r["adicionadas"]
+        resumo["duplicadas"] += r["duplicadas"]
+        resumo["invalidas"] += r["invalidas"]
+
     # --- IMPORTAÇÃO PDF INTELIGENTE (HÍBRIDA) ---
     def calcular_hash_arquivo(self, caminho_pdf):
         try:
@@ -2117,6 +3020,7 @@ class ControlePontoApp:
             return None
 
     def processar_pdf(self, caminho_arquivo, substituir=False):
+        pdfplumber = importar_opcional("pdfplumber")
         if not pdfplumber:
             return "error", "Biblioteca pdfplumber não instalada."
 
@@ -2126,87 +3030,150 @@ class ControlePontoApp:
         if (ultimo_hash == novo_hash) and (not substituir):
             return "duplicate", "Arquivo já importado."
 
-        dados_temp = {}
-        count_total = 0
-
-        print("-" * 30)
-        print(f"LENDO ARQUIVO: {caminho_arquivo}")
-
         try:
-            with pdfplumber.open(caminho_arquivo) as pdf:
-                for i, page in enumerate(pdf.pages):
-                    print(f"--- Processando Página {i + 1} ---")
-
-                    leu_tabela_na_pagina = False  # Flag para evitar ler texto se já leu tabela
-
-                    # TENTA LER TABELAS
-                    tabelas = page.extract_tables()
-
-                    # Se achou tabelas, processa linha a linha
-                    if tabelas:
-                        for tabela in tabelas:
-                            for linha in tabela:
-                                # Verifica se a linha tem pelo menos 2 colunas (Data e Batidas)
-                                if len(linha) >= 2:
-                                    # Junta APENAS coluna 0 e 1 (Ignora Ajustes e Resultados)
-                                    raw_data = str(linha[0] or "")
-                                    raw_batidas = str(linha[1] or "")
-
-                                    linha_limpa = f"{raw_data} {raw_batidas}".replace("\n", " ")
-
-                                    if len(linha_limpa) > 5:
-                                        self._extrair_e_adicionar(linha_limpa, dados_temp)
-                                        leu_tabela_na_pagina = True
-
-                    # TENTA LER TEXTO (FALLBACK)
-                    # Só lê texto se NÃO conseguiu ler tabela nesta página
-                    if not leu_tabela_na_pagina:
-                        texto = page.extract_text()
-                        if texto:
-                            for linha_txt in texto.split('\n'):
-                                # Filtra linhas perigosas (Resultados)
-                                if "Banco de Horas" not in linha_txt and "Previstas" not in linha_txt:
-                                    if len(linha_txt) > 5:
-                                        self._extrair_e_adicionar(linha_txt, dados_temp)
-
+            # Na substituição que segue a prévia, a leitura vem do cache e isto é só a mescla
+            dados_temp = self.ler_pdf(caminho_arquivo, novo_hash)
             if not dados_temp:
                 print("ERRO: Nenhuma data válida encontrada no dicionário final.")
                 return "error", "Não foi possível identificar datas. Verifique o terminal para detalhes."
 
-            # GRAVAÇÃO
+            # GRAVAÇÃO (substituir troca o dia inteiro; senão só acrescenta o que falta)
             datas_processadas = []
-            for data, lista_horas in dados_temp.items():
-                lista_limpa = sorted(list(set(lista_horas)))
+            resultado = self.mesclar_batidas(dados_temp, substituir=substituir)
+            count_total = resultado["adicionadas"]
+            dias_fechados = resultado["dias_fechados"]  # Meses fechados só mudam depois de reabertos
 
-                if substituir:
-                    # Atualiza/Substitui o dia
-                    self.dados[data] = {"batidas": lista_limpa, "ajuste_manual": 0, "folga": False}
-                    count_total += len(lista_limpa)
-                else:
-                    # Modo seguro: Adiciona se não existir
-                    if data not in self.dados: self.dados[data] = {"batidas": [], "ajuste_manual": 0, "folga": False}
-                    for h in lista_limpa:
-                        if h not in self.dados[data]["batidas"]:
-                            self.dados[data]["batidas"].append(h)
-                            count_total += 1
-                    self.dados[data]["batidas"].sort()
-
-            self.config["ultimo_hash_pdf"] = novo_hash
-            self.salvar_config(None, None, None, None)
-            self.salvar_dados()
+            self._alterar_config(lambda config: config.update(ultimo_hash_pdf=novo_hash))
 
             ultima_data = sorted(datas_processadas)[-1] if datas_processadas else "N/A"
             print(f"SUCESSO: {count_total} batidas importadas. Última data: {ultima_data}")
 
-            return "ok", f"Sucesso! {count_total} batidas. (Última: {ultima_data})"
+            avisos = ""
+            if resultado["substituidas"]:
+                avisos += f" {resultado['substituidas']} batida(s) substituída(s)."
+            if dias_fechados:
+                avisos += f" {dias_fechados} dia(s) de meses fechados ignorado(s)."
+            if resultado["invalidas"]:
+                avisos += (f" {resultado['invalidas']} batida(s) com data ou hora inválida ignorada(s) "
+                           f"(ver {ARQUIVO_QUARENTENA}).")
+            return "ok", f"Sucesso! {count_total} batidas. (Última: {ultima_data}){avisos}"
 
         except Exception as ex:
             print(f"ERRO CRÍTICO: {ex}")
             return "error", f"Erro crítico: {ex}"
 
+    def ler_pdf(self, caminho_arquivo, hash_arquivo=None):
+        """
+        Lê o PDF e retorna {data: [horas ordenadas, sem repetição]}. O resultado fica em PDFS_LIDOS
+        pelo hash do arquivo, então ler de novo o mesmo PDF logo em seguida não passa pelo pdfplumber.
+        """
+        hash_arquivo = hash_arquivo or self.calcular_hash_arquivo(caminho_arquivo)
+        lido = PDFS_LIDOS.obter(hash_arquivo)
+        if lido is not None:
+            print(f"PDF já lido há pouco ({caminho_arquivo}); reaproveitando a leitura.")
+            return lido
+
+        pdfplumber = importar_opcional("pdfplumber")
+        if not pdfplumber:
+            raise RuntimeError("Biblioteca pdfplumber não instalada.")
+
+        dados_temp = {}
+
+        print("-" * 30)
+        print(f"LENDO ARQUIVO: {caminho_arquivo}")
+
+        with pdfplumber.open(caminho_arquivo) as pdf:
+            layout = self._layout_pdf(pdf)
+            alternativo = LAYOUT_PDF_TEXTO if layout["estrategia"] == "tabela" else LAYOUT_PDF_TABELA
+            print(f"Layout do PDF: {layout['nome']}")
+            for i, page in enumerate(pdf.pages):
+                print(f"--- Processando Página {i + 1} ---")
+                # Só tenta a outra estratégia quando a página não segue o layout do documento
+                if not self._ler_pagina_pdf(page, layout, dados_temp):
+                    self._ler_pagina_pdf(page, alternativo, dados_temp)
+
+        lido = {data: sorted(set(horas)) for data, horas in dados_temp.items()}
+        PDFS_LIDOS.guardar(hash_arquivo, lido)
+        return lido
+
+    def _layout_pdf(self, pdf):
+        """
+        Layout do documento: um modelo de MODELOS_PDF, se os marcadores aparecerem nas primeiras
+        páginas; senão "tabela", se elas tiverem tabelas com datas; senão "texto". Fica guardado em
+        LAYOUTS_PDF pelo gerador do PDF, então os próximos relatórios do mesmo sistema nem detectam.
+        """
+        metadados = getattr(pdf, "metadata", None) or {}
+        amostra = pdf.pages[:AMOSTRA_LAYOUT_PDF]
+        chave = None
+        if amostra and (metadados.get("Producer") or metadados.get("Creator")):
+            chave = (metadados.get("Producer"), metadados.get("Creator"),
+                     round(amostra[0].width), round(amostra[0].height))
+            if chave in LAYOUTS_PDF:
+                return LAYOUTS_PDF[chave]
+
+        textos = [page.extract_text() or "" for page in amostra]
+        layout = next((m for m in MODELOS_PDF if all(any(marcador in t for t in textos) for marcador in m["marcadores"])),
+                      None)
+        if layout is None:
+            com_datas = any(re.search(r"\d{2}[\W_]*\d{2}[\W_]*\d{4}", str(linha[0] or ""))
+                            for page in amostra for tabela in page.extract_tables() for linha in tabela
+                            if len(linha) >= 2)
+            layout = LAYOUT_PDF_TABELA if com_datas else LAYOUT_PDF_TEXTO
+        if chave is not None:
+            LAYOUTS_PDF[chave] = layout
+        return layout
+
+    def _ler_pagina_pdf(self, page, layout, dados_temp):
+        """Extrai as batidas da página com a estratégia do layout. Retorna True se achou alguma."""
+        achou = False
+        if layout["estrategia"] == "tabela":
+            for tabela in page.extract_tables(layout.get("config_tabela")):
+                for linha in tabela:
+                    # Verifica se a linha tem pelo menos 2 colunas (Data e Batidas)
+                    if len(linha) >= 2:
+                        # Junta APENAS coluna 0 e 1 (Ignora Ajustes e Resultados)
+                        linha_limpa = f"{linha[0] or ''} {linha[1] or ''}".replace("\n", " ")
+                        if len(linha_limpa) > 5:
+                            achou = self._extrair_e_adicionar(linha_limpa, dados_temp) or achou
+        else:
+            for linha_txt in (page.extract_text() or "").split("\n"):
+                # Filtra linhas perigosas (Resultados)
+                if "Banco de Horas" not in linha_txt and "Previstas" not in linha_txt and len(linha_txt) > 5:
+                    achou = self._extrair_e_adicionar(linha_txt, dados_temp) or achou
+        return achou
+
+    def previa_pdf(self, caminho_arquivo, substituir=True):
+        """
+        Simulação da importação, sem alterar nada: o que mudaria em cada dia comparado aos dados
+        atuais. Usa (e deixa no cache) a mesma leitura que a importação de verdade vai usar, conferida
+        como em mesclar_batidas (separar_batidas_invalidas), então os números batem com o que entra.
+        Retorna {"dias_novos", "dias_alterados", "batidas_novas", "batidas_removidas",
+        "dias_fechados", "invalidas", "mudancas": [(data, antes, depois)]}.
+        """
+        entrada, _, invalidas = separar_batidas_invalidas(self.ler_pdf(caminho_arquivo))
+        previa = {"dias_novos": 0, "dias_alterados": 0, "batidas_novas": 0, "batidas_removidas": 0,
+                  "dias_fechados": 0, "invalidas": invalidas, "mudancas": []}
+        self.sincronizar()
+        for data, horas in sorted(entrada.items()):
+            info = self.dados[data] if data in self.dados else None
+            atuais = list(info["batidas"]) if info else []
+            depois = sorted(set(horas)) if substituir else sorted(set(atuais) | set(horas))
+            # Substituir também zera o ajuste manual e a folga do dia
+            zera_extras = substituir and info is not None and bool(info.get("ajuste_manual") or info.get("folga"))
+            if info is not None and depois == atuais and not zera_extras:
+                continue
+            if self.mes_fechado(data):
+                previa["dias_fechados"] += 1
+                continue
+            previa["dias_novos" if info is None else "dias_alterados"] += 1
+            previa["batidas_novas"] += len(set(depois) - set(atuais))
+            previa["batidas_removidas"] += len(set(atuais) - set(depois))
+            previa["mudancas"].append((data, atuais, depois))
+        return previa
+
     def _extrair_e_adicionar(self, texto_linha, dic_dados):
         """
-        Extrai data e horas de uma string suja.
+        Extrai data e horas de uma string suja. Retorna True se achou batidas na linha.
         """
         try:
             # 1. ENCONTRAR DATA (Regex robusto)
@@ -2237,8 +3204,10 @@ class ControlePontoApp:
                 if horas_reais:
                     if data_iso not in dic_dados: dic_dados[data_iso] = []
                     dic_dados[data_iso].extend(horas_reais)
+                    return True
         except Exception as e:
             pass
+        return False
 
 
 # --- INTERFACE GRÁFICA ---
@@ -2266,6 +3235,9 @@ def main(page: ft.Page):
     data_edicao_atual = None
     var_mes_export = None
     var_formato_export = "xlsx"
+    # Tomada por quem mexe na tabela, no gráfico e no overlay: a pausa por ociosidade roda na thread
+    # do agendador e não pode desmontar a tela no meio de um handler (ver pausar_sessao)
+    trava_sessao = threading.RLock()
 
     # --- FUNÇÃO AUXILIAR: MÁSCARA AUTOMÁTICA PARA HORA ---
     def formatar_hora_input(e):
@@ -2283,8 +3255,36 @@ def main(page: ft.Page):
 
     def mostrar_mensagem(texto, cor=ft.Colors.GREEN):
         snack = ft.SnackBar(ft.Text(texto), bgcolor=cor)
-        page.overlay.append(snack)
-        snack.open = True
+        with trava_sessao:
+            page.overlay.append(snack)
+            snack.open = True
+            page.update()
+
+    # --- CONTROLES SOB DEMANDA ---
+    # Diálogos, pickers e o gráfico só são criados na primeira vez que são usados: o login envia
+    # apenas a tela principal, e a sessão não guarda controles que nunca abriu.
+
+    def sob_demanda(construtor, anexar_overlay=True):
+        """Retorna uma função que cria o controle na primeira chamada e depois devolve o mesmo."""
+        criado = []
+
+        def obter():
+            if not criado:
+                criado.append(construtor())
+                if anexar_overlay:
+                    page.overlay.append(criado[0])
+                    page.update()  # O cliente precisa conhecer o controle antes de abri-lo
+            return criado[0]
+        return obter
+
+    def abrir_dialogo(obter):
+        with trava_sessao:
+            SESSOES.tocar(chave_sessao)
+            obter().open = True
+            page.update()
+
+    def fechar_dialogo(obter):
+        obter().open = False
         page.update()
 
     # --- FILE PICKERS (Backup/Restore/Export/Import) ---
@@ -2293,7 +3293,7 @@ def main(page: ft.Page):
         if not e.files: return
 
         # 1. Limpa a tela (fecha configs)
-        dlg_config.open = False
+        dlg_config().open = False
         page.update()
 
         caminho = e.files[0].path
@@ -2311,7 +3311,6 @@ def main(page: ft.Page):
         page.update()
 
         # 3. Processa (Pode demorar um pouco)
-        import time
         # Pequena pausa para garantir que a UI atualizou a barra azul
         time.sleep(0.5)
 
@@ -2339,10 +3338,31 @@ def main(page: ft.Page):
                 page.overlay.append(ft.SnackBar(ft.Text(f"Resultado: {m2}"), bgcolor=cor, open=True))
                 page.update()
 
+            # Prévia do que a substituição mudaria (a leitura fica em cache para o "Sim, Substituir")
+            try:
+                previa = app.previa_pdf(caminho, substituir=True)
+                linhas_previa = [ft.Text(
+                    f"{previa['dias_novos']} dia(s) novos, {previa['dias_alterados']} alterados: "
+                    f"+{previa['batidas_novas']} / -{previa['batidas_removidas']} batidas."
+                    + (f" {previa['dias_fechados']} dia(s) em meses fechados ficam de fora." if previa["dias_fechados"] else "")
+                    + (f" {previa['invalidas']} batida(s) inválida(s) vão para a quarentena." if previa["invalidas"] else ""),
+                    weight="bold")]
+                for data, antes, depois in previa["mudancas"][:LIMITE_PREVIA_PDF]:
+                    linhas_previa.append(ft.Text(
+                        f"{data[8:10]}/{data[5:7]}/{data[:4]}: {' '.join(antes) or '—'}  →  {' '.join(depois) or '—'}",
+                        size=12))
+                if len(previa["mudancas"]) > LIMITE_PREVIA_PDF:
+                    linhas_previa.append(ft.Text(f"... e mais {len(previa['mudancas']) - LIMITE_PREVIA_PDF} dia(s).",
+                                                 size=12, color=ft.Colors.GREY))
+            except Exception as ex:
+                print(f"AVISO: prévia do PDF indisponível: {ex}")
+                linhas_previa = []
+
             dlg_duplicado = ft.AlertDialog(
                 title=ft.Text("Arquivo Duplicado"),
-                content=ft.Text(
+                content=ft.Column([ft.Text(
                     "Este arquivo já foi importado anteriormente.\nDeseja processar novamente e substituir os dados?"),
+                    *linhas_previa], tight=True, scroll=ft.ScrollMode.AUTO, height=300 if linhas_previa else None),
                 actions=[
                     ft.TextButton("Cancelar",
                                   on_click=lambda _: setattr(dlg_duplicado, 'open', False) or page.update()),
@@ -2371,10 +3391,30 @@ def main(page: ft.Page):
             dlg_resultado.open = True
             page.update()
 
+    def importar_afd_result(e):
+        if not e.files: return
+        dlg_config().open = False
+        mostrar_mensagem("Processando AFD... Aguarde...", ft.Colors.BLUE_800)
+        try:
+            r = app.importar_afd(e.files[0].path)
+        except Exception as ex:
+            print(f"ERRO ao importar AFD: {ex}")
+            mostrar_mensagem(f"Erro ao importar AFD: {ex}", ft.Colors.RED)
+            return
+        atualizar_tabela()
+        detalhes = f"{r['importadas']} batidas novas, {r['duplicadas']} já existiam"
+        if r["ja_importadas"]:
+            detalhes += f", {r['ja_importadas']} registros já importados antes"
+        if r["meses_fechados"]:
+            detalhes += f", {r['meses_fechados']} em meses fechados (reimporte depois de reabri-los)"
+        if r["invalidas"]:
+            detalhes += f", {r['invalidas']} inválidas"
+        mostrar_mensagem(f"AFD importado: {detalhes} ({r['linhas']} linhas em {r['segundos']:.1f}s).")
+
     def salvar_backup_result(e):
         if e.path:
             try:
-                shutil.copy(ARQUIVO_DADOS, e.path)
+                app.exportar_backup(e.path)
                 mostrar_mensagem("Backup salvo com sucesso!", ft.Colors.GREEN)
             except Exception as ex:
                 mostrar_mensagem(f"Erro ao salvar backup: {ex}", ft.Colors.RED)
@@ -2382,10 +3422,13 @@ def main(page: ft.Page):
     def restaurar_backup_result(e):
         if e.files:
             try:
-                shutil.copy(e.files[0].path, ARQUIVO_DADOS)
-                app.dados = app.carregar_dados()
+                quarentena = app.restaurar_backup(e.files[0].path)
                 atualizar_tabela()
-                mostrar_mensagem("Dados restaurados com sucesso!", ft.Colors.GREEN)
+                if quarentena:
+                    mostrar_mensagem(f"Dados restaurados; {len(quarentena)} dia(s) com dados inválidos foram "
+                                     f"corrigidos ou separados (ver {ARQUIVO_QUARENTENA}).", ft.Colors.ORANGE)
+                else:
+                    mostrar_mensagem("Dados restaurados com sucesso!", ft.Colors.GREEN)
             except Exception as ex:
                 mostrar_mensagem(f"Erro ao restaurar: {ex}", ft.Colors.RED)
 
@@ -2393,64 +3436,49 @@ def main(page: ft.Page):
         if not e.path:
             return
         try:
-            df = app.gerar_dataframe_exportacao(var_mes_export)
-
-            if var_formato_export == "xlsx":
-                df.to_excel(e.path, index=False)
-            else:
-                pdf = FPDF()
-                pdf.add_page()
-                pdf.set_font("Arial", size=10)
-                pdf.cell(200, 10, txt="Relatorio de Ponto", ln=1, align='C')
-                pdf.ln(10)
-                for col in df.columns:
-                    w = 40 if col == "Batidas" else 25
-                    pdf.cell(w, 10, str(col)[:12], border=1)
-                pdf.ln()
-                for i in range(len(df)):
-                    for col in df.columns:
-                        w = 40 if col == "Batidas" else 25
-                        val = str(df.iloc[i][col])
-                        pdf.cell(w, 10, val, border=1)
-                    pdf.ln()
-                pdf.output(e.path)
+            app.exportar_relatorio(var_mes_export, var_formato_export, e.path)
 
             mostrar_mensagem(f"Arquivo salvo em: {e.path}", ft.Colors.GREEN)
-            dlg_exportar.open = False
+            dlg_exportar().open = False
             page.update()
         except Exception as ex:
             mostrar_mensagem(f"Erro na exportação: {ex}", ft.Colors.RED)
 
     # --- DEFINIÇÃO DOS FILE PICKERS ---
-    fp_importar_pdf = ft.FilePicker(on_result=importar_pdf_result)  # CORREÇÃO AQUI
-    fp_backup = ft.FilePicker(on_result=salvar_backup_result)
-    fp_restore = ft.FilePicker(on_result=restaurar_backup_result)
-    fp_export = ft.FilePicker(on_result=exportar_result)
-
-    page.overlay.extend([fp_backup, fp_restore, fp_export, fp_importar_pdf])
+    fp_importar_pdf = sob_demanda(lambda: ft.FilePicker(on_result=importar_pdf_result))  # CORREÇÃO AQUI
+    fp_importar_afd = sob_demanda(lambda: ft.FilePicker(on_result=importar_afd_result))
+    fp_backup = sob_demanda(lambda: ft.FilePicker(on_result=salvar_backup_result))
+    fp_restore = sob_demanda(lambda: ft.FilePicker(on_result=restaurar_backup_result))
+    fp_export = sob_demanda(lambda: ft.FilePicker(on_result=exportar_result))
 
     # --- DIALOGO CONFIGURAÇÕES (AVANÇADO) ---
 
-    tf_meta = ft.TextField(label="Meta Diária (h)", value=str(app.config.get("meta_diaria", 8)), width=100)
-    tf_fator_util = ft.TextField(label="Fator Extra Dia Útil (Ex: 1.0 ou 1.5)",
-                                 value=str(app.config.get("fator_dia_util", 1.0)), width=250)
-    tf_fator_fds = ft.TextField(label="Fator Extra FDS (Ex: 2.0)", value=str(app.config.get("fator_fds", 2.0)),
-                                width=250)
-    dd_tema = ft.Dropdown(
-        label="Tema Padrão",
-        width=150,
-        options=[ft.dropdown.Option("light", "Claro"), ft.dropdown.Option("dark", "Escuro")],
-        value=app.config.get("tema_inicial", "light")
-    )
+    tf_meta = tf_fator_util = tf_fator_fds = tf_vigencia = dd_tema = dd_formato_dados = None  # Criados em criar_dlg_config
+    txt_linha_tempo = tf_afd_ids = dd_pontos_backup = None
+
+    def descrever_linha_tempo():
+        mudancas = app.config.get("regras_vigencia") or []
+        if not mudancas:
+            return "Sem mudanças de regra: as atuais valem para todo o histórico."
+        return "\n".join(f"A partir de {datetime.strptime(m['desde'], '%Y-%m-%d'):%d/%m/%Y}: "
+                         f"{m['meta_diaria']}h, x{m['fator_dia_util']} útil, x{m['fator_fds']} FDS"
+                         for m in mudancas)
 
     def salvar_configuracoes(e):
+        vigencia = tf_vigencia.value.strip() or None  # Em branco: muda as regras base (todo o histórico)
+        if vigencia is not None and not data_valida(vigencia):
+            mostrar_mensagem("Erro: data de vigência inválida. Use AAAA-MM-DD ou deixe em branco para mudar "
+                             "as regras de todo o histórico.", ft.Colors.RED)
+            return
         try:
             meta = int(tf_meta.value)
             f_util = float(tf_fator_util.value)
             f_fds = float(tf_fator_fds.value)
             tema = dd_tema.value
 
-            app.salvar_config(meta, f_util, f_fds, tema)
+            app.salvar_config(meta, f_util, f_fds, tema, dd_formato_dados.value, vigencia=vigencia,
+                              identificadores_afd=tf_afd_ids.value.split(","))
+            txt_linha_tempo.value = descrever_linha_tempo()
 
             # Aplica o tema imediatamente
             page.theme_mode = ft.ThemeMode.DARK if tema == "dark" else ft.ThemeMode.LIGHT
@@ -2458,40 +3486,212 @@ def main(page: ft.Page):
 
             mostrar_mensagem("Configurações salvas! Tabela recalculada.")
             atualizar_tabela()
-            dlg_config.open = False
+            dlg_config().open = False
             page.update()
-        except:
+        except ValueError:
             mostrar_mensagem("Erro: Verifique os números digitados.", ft.Colors.RED)
+        except Exception as ex:
+            mostrar_mensagem(f"Erro ao salvar as configurações: {ex}", ft.Colors.RED)
+
+    def atualizar_pontos_backup():
+        pontos = app.backups.pontos()
+        dd_pontos_backup.options = [
+            ft.dropdown.Option(p["arquivo"], f"{datetime.fromisoformat(p['em']):%d/%m/%Y %H:%M} - {p['tipo']} "
+                                             f"({p['dias']} dia(s), {max(1, p['bytes'] // 1024)} KB)")
+            for p in reversed(pontos)]
+        dd_pontos_backup.value = pontos[-1]["arquivo"] if pontos else None
+
+    def abrir_config(e):
+        dlg_config()
+        atualizar_pontos_backup()
+        abrir_dialogo(dlg_config)
+
+    def acao_backup_agora(e):
+        try:
+            app.salvar_dados(esperar=True)
+            entrada = app.backups.fazer()
+            atualizar_pontos_backup()
+            if entrada:
+                mostrar_mensagem(f"Backup {entrada['tipo']} feito: {entrada['dias']} dia(s) em "
+                                 f"{entrada['segundos']:.1f}s.", ft.Colors.GREEN)
+            else:
+                mostrar_mensagem("Nada mudou desde o último backup.")
+        except Exception as ex:
+            mostrar_mensagem(f"Erro no backup: {ex}", ft.Colors.RED)
 
-    dlg_config = ft.AlertDialog(
-        title=ft.Text("Configurações Gerais"),
-        content=ft.Container(
-            content=ft.Column([
-                ft.Text("Regras de Banco de Horas", weight="bold", size=16),
-                ft.Row([tf_meta, dd_tema]),
-                ft.Text("Multiplicadores:", weight="bold"),
-                tf_fator_util,
-                tf_fator_fds,
-                ft.Divider(),
-                ft.Text("Dados & Backup", weight="bold", size=16),
-                ft.Row([
-                    ft.ElevatedButton("Fazer Backup", icon=ft.Icons.SAVE, on_click=lambda _: fp_backup.save_file(
-                        file_name=f"backup_ponto_{datetime.now().strftime('%Y%m%d')}.json")),
-                    ft.ElevatedButton("Restaurar", icon=ft.Icons.RESTORE_PAGE,
-                                      on_click=lambda _: fp_restore.pick_files(allowed_extensions=["json"])),
-                ]),
-                # BOTÃO IMPORTAR PDF
-                ft.ElevatedButton("Importar PDF", icon=ft.Icons.PICTURE_AS_PDF, bgcolor=ft.Colors.RED_100,
-                                  color=ft.Colors.RED,
-                                  on_click=lambda _: fp_importar_pdf.pick_files(allowed_extensions=["pdf"])),
-            ], spacing=15, scroll=ft.ScrollMode.AUTO),
-            height=500, width=500
-        ),
-        actions=[ft.TextButton("Salvar Alterações", on_click=salvar_configuracoes)]
-    )
+    def acao_restaurar_ponto(e):
+        if not dd_pontos_backup.value:
+            mostrar_mensagem("Nenhum backup automático disponível.", ft.Colors.ORANGE)
+            return
+        try:
+            quarentena = app.restaurar_ponto(dd_pontos_backup.value)
+            atualizar_pontos_backup()
+            atualizar_tabela()
+            mostrar_mensagem(f"Dados restaurados ({len(quarentena)} dia(s) em quarentena)." if quarentena
+                             else "Dados restaurados com sucesso!", ft.Colors.GREEN)
+        except ErroMesFechado as ex:
+            mostrar_mensagem(str(ex), ft.Colors.ORANGE)
+        except Exception as ex:
+            mostrar_mensagem(f"Erro ao restaurar: {ex}", ft.Colors.RED)
+
+    def criar_dlg_config():
+        nonlocal tf_meta, tf_fator_util, tf_fator_fds, tf_vigencia, txt_linha_tempo, dd_tema, dd_formato_dados
+        nonlocal tf_afd_ids, dd_pontos_backup
+        regras = app.regras_em()  # As vigentes hoje
+        tf_meta = ft.TextField(label="Meta Diária (h)", value=str(regras["meta_diaria"]), width=100)
+        tf_fator_util = ft.TextField(label="Fator Extra Dia Útil (Ex: 1.0 ou 1.5)",
+                                     value=str(regras["fator_dia_util"]), width=250)
+        tf_fator_fds = ft.TextField(label="Fator Extra FDS (Ex: 2.0)", value=str(regras["fator_fds"]),
+                                    width=250)
+        tf_vigencia = ft.TextField(label="Vale a partir de (AAAA-MM-DD)", value=app.obter_hoje_str(), width=250,
+                                   tooltip="Dias anteriores continuam com as regras antigas; "
+                                           "em branco muda as regras de todo o histórico")
+        txt_linha_tempo = ft.Text(descrever_linha_tempo(), size=12, color=ft.Colors.GREY)
+        dd_tema = ft.Dropdown(
+            label="Tema Padrão",
+            width=150,
+            options=[ft.dropdown.Option("light", "Claro"), ft.dropdown.Option("dark", "Escuro")],
+            value=app.config.get("tema_inicial", "light")
+        )
+        dd_formato_dados = ft.Dropdown(
+            label="Formato do Arquivo de Dados",
+            width=250,
+            options=[ft.dropdown.Option("json", "JSON compacto"),
+                     ft.dropdown.Option("json_zlib", "JSON comprimido (zlib)"),
+                     ft.dropdown.Option("msgpack", "Binário (MessagePack)")],
+            value=app.config.get("formato_dados", "json")
+        )
+        tf_afd_ids = ft.TextField(label="PIS/CPF no relógio (AFD)", width=250,
+                                  value=", ".join(app.config.get("afd_identificadores") or []),
+                                  tooltip="Separe vários por vírgula; marcações de outros funcionários são ignoradas")
+        dd_pontos_backup = ft.Dropdown(label="Backups automáticos", width=330)
+
+        return ft.AlertDialog(
+            title=ft.Text("Configurações Gerais"),
+            content=ft.Container(
+                content=ft.Column([
+                    ft.Text("Regras de Banco de Horas", weight="bold", size=16),
+                    ft.Row([tf_meta, dd_tema]),
+                    ft.Text("Multiplicadores:", weight="bold"),
+                    tf_fator_util,
+                    tf_fator_fds,
+                    tf_vigencia,
+                    txt_linha_tempo,
+                    ft.Divider(),
+                    ft.Text("Dados & Backup", weight="bold", size=16),
+                    dd_formato_dados,
+                    ft.Row([
+                        ft.ElevatedButton("Fazer Backup", icon=ft.Icons.SAVE, on_click=lambda _: fp_backup().save_file(
+                            file_name=f"backup_ponto_{datetime.now().strftime('%Y%m%d')}.json")),
+                        ft.ElevatedButton("Restaurar", icon=ft.Icons.RESTORE_PAGE,
+                                          on_click=lambda _: fp_restore().pick_files(allowed_extensions=["json"])),
+                    ]),
+                    ft.Row([
+                        dd_pontos_backup,
+                        ft.IconButton(icon=ft.Icons.RESTORE, tooltip="Restaurar este backup",
+                                      on_click=acao_restaurar_ponto),
+                        ft.IconButton(icon=ft.Icons.BACKUP, tooltip="Backup incremental agora",
+                                      on_click=acao_backup_agora),
+                    ]),
+                    # BOTÃO IMPORTAR PDF
+                    ft.ElevatedButton("Importar PDF", icon=ft.Icons.PICTURE_AS_PDF, bgcolor=ft.Colors.RED_100,
+                                      color=ft.Colors.RED,
+                                      on_click=lambda _: fp_importar_pdf().pick_files(allowed_extensions=["pdf"])),
+                    ft.Row([
+                        tf_afd_ids,
+                        ft.ElevatedButton("Importar AFD", icon=ft.Icons.FINGERPRINT,
+                                          on_click=lambda _: fp_importar_afd().pick_files(allowed_extensions=["txt"])),
+                    ]),
+                    ft.Divider(),
+                    ft.TextButton("Sessões do Servidor", icon=ft.Icons.MONITOR_HEART, on_click=abrir_sessoes,
+                                  tooltip="Sessões abertas, memória por worker e pausa das ociosas"),
+                ], spacing=15, scroll=ft.ScrollMode.AUTO),
+                height=500, width=500
+            ),
+            actions=[ft.TextButton("Salvar Alterações", on_click=salvar_configuracoes)]
+        )
+
+    dlg_config = sob_demanda(criar_dlg_config)
+
+    # --- DIALOGO SESSÕES DO SERVIDOR ---
+
+    txt_resumo_sessoes = tabela_workers = tabela_sessoes = None  # Criados em criar_dlg_sessoes
+
+    def mb(n):
+        return f"{(n or 0) / (1024 * 1024):.1f} MB"
+
+    def atualizar_sessoes(e=None):
+        SESSOES.gravar_resumo()  # O deste worker sai medido agora; os outros, da última varredura
+        resumos = resumo_workers()
+        total = sum(r["sessoes"] for r in resumos)
+        pausadas = sum(r["pausadas"] for r in resumos)
+        txt_resumo_sessoes.value = (f"{total} sessão(ões) em {len(resumos)} worker(s): {total - pausadas} ativa(s), "
+                                    f"{pausadas} pausada(s). Memória das sessões: "
+                                    f"{mb(sum(r['bytes_sessoes'] for r in resumos))}; "
+                                    f"memória dos processos: {mb(sum(r['rss'] or 0 for r in resumos))}.")
+        tabela_workers.rows = [
+            ft.DataRow(cells=[
+                ft.DataCell(ft.Text(f"{r['pid']}{' (este)' if r['pid'] == os.getpid() else ''}")),
+                ft.DataCell(ft.Text(str(r["sessoes"]))),
+                ft.DataCell(ft.Text(str(r["pausadas"]))),
+                ft.DataCell(ft.Text(mb(r["bytes_sessoes"]))),
+                ft.DataCell(ft.Text(mb(r["rss"]) if r["rss"] else "-")),
+                ft.DataCell(ft.Text(datetime.fromtimestamp(r["em"]).strftime("%H:%M:%S"))),
+            ]) for r in resumos]
+        proprio = next((r for r in resumos if r["pid"] == os.getpid()), {"lista": []})
+        tabela_sessoes.rows = [
+            ft.DataRow(cells=[
+                ft.DataCell(ft.Text(f"{i}{' (esta)' if s['chave'] == str(chave_sessao) else ''}")),
+                ft.DataCell(ft.Text(datetime.fromtimestamp(s["inicio"]).strftime("%d/%m %H:%M"))),
+                ft.DataCell(ft.Text(app.formatar_duracao(s["ociosa_s"]))),
+                ft.DataCell(ft.Text("Pausada" if s["pausada"] else "Ativa")),
+                ft.DataCell(ft.Text(mb(s["bytes"]))),
+            ]) for i, s in enumerate(sorted(proprio["lista"], key=lambda s: s["inicio"]), 1)]
+        page.update()
+
+    def acao_pausar_ociosas(e):
+        pausadas = SESSOES.descartar_ociosas()
+        atualizar_sessoes()
+        mostrar_mensagem(f"{pausadas} sessão(ões) ociosa(s) pausada(s) neste worker.")
+
+    def abrir_sessoes(e):
+        dlg_sessoes()
+        atualizar_sessoes()
+        dlg_config().open = False
+        abrir_dialogo(dlg_sessoes)
+
+    def criar_dlg_sessoes():
+        nonlocal txt_resumo_sessoes, tabela_workers, tabela_sessoes
+        txt_resumo_sessoes = ft.Text(size=13)
+        tabela_workers = ft.DataTable(columns=[ft.DataColumn(ft.Text(t)) for t in (
+            "Worker (PID)", "Sessões", "Pausadas", "Memória das sessões", "RSS do processo", "Atualizado")])
+        tabela_sessoes = ft.DataTable(columns=[ft.DataColumn(ft.Text(t)) for t in (
+            "Sessão", "Aberta em", "Parada há", "Situação", "Memória")])
+        return ft.AlertDialog(
+            title=ft.Text("Sessões do Servidor"),
+            content=ft.Container(
+                content=ft.Column([
+                    txt_resumo_sessoes,
+                    ft.Row([tabela_workers], scroll=ft.ScrollMode.AUTO),
+                    ft.Text("Sessões deste worker", weight="bold"),
+                    ft.Row([tabela_sessoes], scroll=ft.ScrollMode.AUTO),
+                    ft.Text(f"Pausa automática após {app.config.get('sessao_ociosidade_min', OCIOSIDADE_SESSAO_MIN)} "
+                            f"min sem interação; a memória é estimada pelos controles e caches de cada sessão.",
+                            size=12, color=ft.Colors.GREY),
+                ], spacing=10, scroll=ft.ScrollMode.AUTO),
+                height=500, width=650
+            ),
+            actions=[ft.TextButton("Pausar Ociosas", icon=ft.Icons.PAUSE_CIRCLE, on_click=acao_pausar_ociosas),
+                     ft.TextButton("Atualizar", icon=ft.Icons.REFRESH, on_click=atualizar_sessoes),
+                     ft.TextButton("Fechar", on_click=lambda e: fechar_dialogo(dlg_sessoes))]
+        )
+
+    dlg_sessoes = sob_demanda(criar_dlg_sessoes)
 
     # --- DIALOGO EXPORTAR ---
 
+    dd_mes_export = tab_export = None  # Criados em criar_dlg_exportar
+
     def acao_escolher_tipo_export(e, tipo):
         nonlocal var_mes_export
         if tipo == "relatorio":
@@ -2510,68 +3710,142 @@ def main(page: ft.Page):
     def acao_escolher_formato_export(e, fmt):
         nonlocal var_formato_export
         var_formato_export = fmt
-        ext = "xlsx" if fmt == "xlsx" else "pdf"
-        nome_arq = f"Relatorio_Ponto_{datetime.now().strftime('%Y%m%d')}.{ext}"
-        fp_export.save_file(file_name=nome_arq, allowed_extensions=[ext])
-
-    dd_mes_export = ft.Dropdown(
-        label="Selecione o Período",
-        options=[ft.dropdown.Option(key=None, text="Todo o Histórico")] +
-                [ft.dropdown.Option(key=f"2025-{m:02d}", text=f"{m:02d}/2025") for m in range(1, 13)]
-    )
+        if fmt in FORMATOS_LEGAIS:
+            ext = "txt"
+            nome_arq = f"{fmt.upper()}_{(var_mes_export or 'historico').replace('-', '')}.txt"
+        else:
+            ext = "xlsx" if fmt == "xlsx" else "pdf"
+            nome_arq = f"Relatorio_Ponto_{datetime.now().strftime('%Y%m%d')}.{ext}"
+        fp_export().save_file(file_name=nome_arq, allowed_extensions=[ext])
+
+    def criar_dlg_exportar():
+        nonlocal dd_mes_export, tab_export
+        dd_mes_export = ft.Dropdown(
+            label="Selecione o Período",
+            options=[ft.dropdown.Option(key=None, text="Todo o Histórico")] +
+                    [ft.dropdown.Option(key=f"2025-{m:02d}", text=f"{m:02d}/2025") for m in range(1, 13)]
+        )
 
-    tab_export = ft.Tabs(
-        selected_index=0,
-        animation_duration=300,
-        tabs=[
-            ft.Tab(
-                text="1. Tipo",
-                content=ft.Column([
-                    ft.Text("O que deseja exportar?", size=16, weight="bold"),
-                    ft.ElevatedButton("Relatório Mensal (Mês Atual)",
-                                      on_click=lambda e: acao_escolher_tipo_export(e, "relatorio"), width=300),
-                    ft.ElevatedButton("Planilha Completa (Selecionar)",
-                                      on_click=lambda e: acao_escolher_tipo_export(e, "planilha"), width=300),
-                ], spacing=20, alignment=ft.MainAxisAlignment.CENTER)
-            ),
-            ft.Tab(
-                text="2. Período",
+        tab_export = ft.Tabs(
+            selected_index=0,
+            animation_duration=300,
+            tabs=[
+                ft.Tab(
+                    text="1. Tipo",
+                    content=ft.Column([
+                        ft.Text("O que deseja exportar?", size=16, weight="bold"),
+                        ft.ElevatedButton("Relatório Mensal (Mês Atual)",
+                                          on_click=lambda e: acao_escolher_tipo_export(e, "relatorio"), width=300),
+                        ft.ElevatedButton("Planilha Completa (Selecionar)",
+                                          on_click=lambda e: acao_escolher_tipo_export(e, "planilha"), width=300),
+                    ], spacing=20, alignment=ft.MainAxisAlignment.CENTER)
+                ),
+                ft.Tab(
+                    text="2. Período",
+                    content=ft.Column([
+                        ft.Text("Qual período deseja?", size=16, weight="bold"),
+                        dd_mes_export,
+                        ft.ElevatedButton("Próximo >", on_click=acao_escolher_mes_export)
+                    ], spacing=20, alignment=ft.MainAxisAlignment.CENTER)
+                ),
+                ft.Tab(
+                    text="3. Formato",
+                    content=ft.Column([
+                        ft.Text("Qual formato de arquivo?", size=16, weight="bold"),
+                        ft.Row([
+                            ft.ElevatedButton("Excel (.xlsx)", icon=ft.Icons.TABLE_VIEW,
+                                              on_click=lambda e: acao_escolher_formato_export(e, "xlsx")),
+                            ft.ElevatedButton("PDF (.pdf)", icon=ft.Icons.PICTURE_AS_PDF,
+                                              on_click=lambda e: acao_escolher_formato_export(e, "pdf")),
+                        ], alignment=ft.MainAxisAlignment.CENTER),
+                        ft.Text("Arquivos legais para a folha (Portaria 671):", size=12, color=ft.Colors.GREY),
+                        ft.Row([
+                            ft.ElevatedButton("AFD (.txt)", icon=ft.Icons.FINGERPRINT,
+                                              on_click=lambda e: acao_escolher_formato_export(e, "afd")),
+                            ft.ElevatedButton("AEJ (.txt)", icon=ft.Icons.DESCRIPTION,
+                                              on_click=lambda e: acao_escolher_formato_export(e, "aej")),
+                        ], alignment=ft.MainAxisAlignment.CENTER)
+                    ], spacing=20, alignment=ft.MainAxisAlignment.CENTER)
+                )
+            ]
+        )
+
+        return ft.AlertDialog(
+            title=ft.Text("Exportar Dados"),
+            content=ft.Container(content=tab_export, width=400, height=300)
+        )
+
+    dlg_exportar = sob_demanda(criar_dlg_exportar)
+
+    # --- DIALOGO RELATÓRIOS POR PERÍODO ---
+
+    dd_granularidade = tf_rel_ini = tf_rel_fim = tabela_relatorio = None  # Criados em criar_dlg_relatorios
+
+    def gerar_relatorio_click(e):
+        try:
+            linhas = app.gerar_relatorio(dd_granularidade.value, tf_rel_ini.value.strip(), tf_rel_fim.value.strip())
+        except ValueError as ex:
+            mostrar_mensagem(f"Erro no relatório: {ex}", ft.Colors.RED)
+            return
+
+        tabela_relatorio.rows = []
+        for linha in linhas:
+            extras = " | ".join(f"x{fator}: {app.formatar_duracao(seg)}" for fator, seg in sorted(linha["extras"].items()))
+            tabela_relatorio.rows.append(ft.DataRow(cells=[
+                ft.DataCell(ft.Text(linha["periodo"])),
+                ft.DataCell(ft.Text(app.formatar_duracao(linha["trabalhado"]))),
+                ft.DataCell(ft.Text(app.formatar_duracao(linha["previsto"]))),
+                ft.DataCell(ft.Text(app.formatar_duracao(linha["saldo"]), weight="bold",
+                                    color=ft.Colors.GREEN if linha["saldo"] >= 0 else ft.Colors.RED)),
+                ft.DataCell(ft.Text(extras or "-")),
+                ft.DataCell(ft.Text(str(linha["folgas"]))),
+                ft.DataCell(ft.Text(str(linha["ferias"]))),
+            ]))
+        page.update()
+
+    def criar_dlg_relatorios():
+        nonlocal dd_granularidade, tf_rel_ini, tf_rel_fim, tabela_relatorio
+        dd_granularidade = ft.Dropdown(
+            label="Agrupar por",
+            width=160,
+            value="mes",
+            options=[ft.dropdown.Option("semana", "Semana"), ft.dropdown.Option("mes", "Mês"),
+                     ft.dropdown.Option("trimestre", "Trimestre"), ft.dropdown.Option("personalizado", "Período todo")]
+        )
+        tf_rel_ini = ft.TextField(label="Início (AAAA-MM-DD)", width=170, value=datetime.now().strftime("%Y-01-01"))
+        tf_rel_fim = ft.TextField(label="Fim (AAAA-MM-DD)", width=170, value=datetime.now().strftime("%Y-%m-%d"))
+
+        tabela_relatorio = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Período", weight="bold")),
+                ft.DataColumn(ft.Text("Trabalhado")),
+                ft.DataColumn(ft.Text("Previsto")),
+                ft.DataColumn(ft.Text("Saldo")),
+                ft.DataColumn(ft.Text("Extras (por fator)")),
+                ft.DataColumn(ft.Text("Folgas")),
+                ft.DataColumn(ft.Text("Férias")),
+            ],
+            column_spacing=15,
+        )
+
+        return ft.AlertDialog(
+            title=ft.Text("Relatórios por Período"),
+            content=ft.Container(
                 content=ft.Column([
-                    ft.Text("Qual período deseja?", size=16, weight="bold"),
-                    dd_mes_export,
-                    ft.ElevatedButton("Próximo >", on_click=acao_escolher_mes_export)
-                ], spacing=20, alignment=ft.MainAxisAlignment.CENTER)
+                    ft.Row([dd_granularidade, tf_rel_ini, tf_rel_fim]),
+                    ft.ElevatedButton("Gerar Relatório", icon=ft.Icons.ASSESSMENT, on_click=gerar_relatorio_click),
+                    ft.Row([tabela_relatorio], scroll=ft.ScrollMode.AUTO),
+                ], spacing=15, scroll=ft.ScrollMode.AUTO),
+                width=800, height=500
             ),
-            ft.Tab(
-                text="3. Formato",
-                content=ft.Column([
-                    ft.Text("Qual formato de arquivo?", size=16, weight="bold"),
-                    ft.Row([
-                        ft.ElevatedButton("Excel (.xlsx)", icon=ft.Icons.TABLE_VIEW,
-                                          on_click=lambda e: acao_escolher_formato_export(e, "xlsx")),
-                        ft.ElevatedButton("PDF (.pdf)", icon=ft.Icons.PICTURE_AS_PDF,
-                                          on_click=lambda e: acao_escolher_formato_export(e, "pdf")),
-                    ], alignment=ft.MainAxisAlignment.CENTER)
-                ], spacing=20, alignment=ft.MainAxisAlignment.CENTER)
-            )
-        ]
-    )
+            actions=[ft.TextButton("Fechar", on_click=lambda e: fechar_dialogo(dlg_relatorios))]
+        )
 
-    dlg_exportar = ft.AlertDialog(
-        title=ft.Text("Exportar Dados"),
-        content=ft.Container(content=tab_export, width=400, height=300)
-    )
+    dlg_relatorios = sob_demanda(criar_dlg_relatorios)
 
     # --- DIALOGO DE EDIÇÃO GRANULAR ---
 
-    lv_batidas = ft.ListView(expand=True, spacing=10, height=150)
-
-    # Input Nova Batida com MÁSCARA e ENTER
-    input_nova_batida = ft.TextField(
-        hint_text="00:00", width=100, text_align=ft.TextAlign.CENTER,
-        on_change=formatar_hora_input,  # Máscara
-        on_submit=lambda e: adicionar_batida_individual(e)  # Enter
-    )
+    lv_batidas = input_nova_batida = None  # Criados em criar_dlg_editar
 
     def salvar_alteracao_batida(e, data, hora_antiga, novo_valor):
         try:
@@ -2580,6 +3854,8 @@ def main(page: ft.Page):
             mostrar_mensagem("Horário atualizado com sucesso!")
             carregar_lista_edicao(data)
             atualizar_tabela()
+        except ErroMesFechado as ex:
+            mostrar_mensagem(str(ex), ft.Colors.RED)
         except ValueError:
             mostrar_mensagem("Formato inválido! Use HH:MM", ft.Colors.RED)
 
@@ -2631,7 +3907,11 @@ def main(page: ft.Page):
         page.update()
 
     def remover_batida_individual(data, hora):
-        app.remover_batida(data, hora)
+        try:
+            app.remover_batida(data, hora)
+        except ErroMesFechado as ex:
+            mostrar_mensagem(str(ex), ft.Colors.RED)
+            return
         carregar_lista_edicao(data)
         atualizar_tabela()
         mostrar_mensagem(f"Batida {hora} removida.")
@@ -2644,218 +3924,261 @@ def main(page: ft.Page):
             input_nova_batida.value = ""
             carregar_lista_edicao(data_edicao_atual)
             atualizar_tabela()
+        except ErroMesFechado as ex:
+            mostrar_mensagem(str(ex), ft.Colors.RED)
         except:
             mostrar_mensagem("Formato inválido. Use HH:MM", ft.Colors.RED)
 
     def abrir_edicao(e):
         nonlocal data_edicao_atual
         data_edicao_atual = e.control.data
+        dlg = dlg_editar()
         carregar_lista_edicao(data_edicao_atual)
-        page.dialog = dlg_editar
-        dlg_editar.open = True
+        page.dialog = dlg
+        dlg.open = True
         page.update()
 
-    dlg_editar = ft.AlertDialog(
-        title=ft.Text("Gerenciar Batidas"),
-        content=ft.Container(
-            content=ft.Column([
-                ft.Text("Edite ou remova batidas específicas:"),
-                ft.Divider(),
-                lv_batidas,
-                ft.Divider(),
-                ft.Row([
-                    ft.Text("Adicionar Nova:"),
-                    input_nova_batida,
-                    ft.IconButton(ft.Icons.ADD_CIRCLE, icon_color=ft.Colors.BLUE, on_click=adicionar_batida_individual)
-                ], alignment=ft.MainAxisAlignment.CENTER)
-            ]),
-            width=400, height=400
-        ),
-        actions=[
-            ft.TextButton("Concluir", on_click=lambda e: setattr(dlg_editar, 'open', False) or page.update()),
-        ],
-    )
+    def criar_dlg_editar():
+        nonlocal lv_batidas, input_nova_batida
+        lv_batidas = ft.ListView(expand=True, spacing=10, height=150)
+
+        # Input Nova Batida com MÁSCARA e ENTER
+        input_nova_batida = ft.TextField(
+            hint_text="00:00", width=100, text_align=ft.TextAlign.CENTER,
+            on_change=formatar_hora_input,  # Máscara
+            on_submit=lambda e: adicionar_batida_individual(e)  # Enter
+        )
+
+        return ft.AlertDialog(
+            title=ft.Text("Gerenciar Batidas"),
+            content=ft.Container(
+                content=ft.Column([
+                    ft.Text("Edite ou remova batidas específicas:"),
+                    ft.Divider(),
+                    lv_batidas,
+                    ft.Divider(),
+                    ft.Row([
+                        ft.Text("Adicionar Nova:"),
+                        input_nova_batida,
+                        ft.IconButton(ft.Icons.ADD_CIRCLE, icon_color=ft.Colors.BLUE, on_click=adicionar_batida_individual)
+                    ], alignment=ft.MainAxisAlignment.CENTER)
+                ]),
+                width=400, height=400
+            ),
+            actions=[
+                ft.TextButton("Concluir", on_click=lambda e: fechar_dialogo(dlg_editar)),
+            ],
+        )
+
+    dlg_editar = sob_demanda(criar_dlg_editar)
 
     # --- DIALOGO AJUSTE MANUAL ---
 
-    dlg_ajuste_input = ft.TextField(
-        label="Valor (ex: 60 ou 01:00)", hint_text="Minutos ou HH:MM",
-        on_change=formatar_hora_input,
-        on_submit=lambda e: salvar_ajuste_click(e)
-    )
-    dlg_ajuste_data_ref = ft.Text(visible=False)
+    dlg_ajuste_input = dlg_ajuste_data_ref = None  # Criados em criar_dlg_ajuste
 
     def salvar_ajuste_click(e):
         val_minutos = app.converter_input_tempo_para_minutos(dlg_ajuste_input.value)
-        app.ajustar_manual(dlg_ajuste_data_ref.value, val_minutos)
-        dlg_ajuste.open = False
+        try:
+            app.ajustar_manual(dlg_ajuste_data_ref.value, val_minutos)
+        except ErroMesFechado as ex:
+            mostrar_mensagem(str(ex), ft.Colors.RED)
+            return
+        dlg_ajuste().open = False
         atualizar_tabela()
         mostrar_mensagem("Ajuste salvo!")
 
     def abrir_ajuste(e):
         data = e.control.data
+        dlg = dlg_ajuste()
         dlg_ajuste_data_ref.value = data
         ajuste_atual = app.dados[data].get("ajuste_manual", 0)
         dlg_ajuste_input.value = app.formatar_duracao(ajuste_atual * 60)
-        page.dialog = dlg_ajuste
-        dlg_ajuste.open = True
+        page.dialog = dlg
+        dlg.open = True
         page.update()
 
-    dlg_ajuste = ft.AlertDialog(
-        title=ft.Text("Ajuste Manual de Banco"),
-        content=ft.Column([
-            ft.Text("Adicione tempo (ex: 01:30) ou subtraia (ex: -00:15)"),
-            dlg_ajuste_data_ref,
-            dlg_ajuste_input
-        ], height=120),
-        actions=[ft.TextButton("Confirmar", on_click=salvar_ajuste_click)]
-    )
+    def criar_dlg_ajuste():
+        nonlocal dlg_ajuste_input, dlg_ajuste_data_ref
+        dlg_ajuste_input = ft.TextField(
+            label="Valor (ex: 60 ou 01:00)", hint_text="Minutos ou HH:MM",
+            on_change=formatar_hora_input,
+            on_submit=lambda e: salvar_ajuste_click(e)
+        )
+        dlg_ajuste_data_ref = ft.Text(visible=False)
+
+        return ft.AlertDialog(
+            title=ft.Text("Ajuste Manual de Banco"),
+            content=ft.Column([
+                ft.Text("Adicione tempo (ex: 01:30) ou subtraia (ex: -00:15)"),
+                dlg_ajuste_data_ref,
+                dlg_ajuste_input
+            ], height=120),
+            actions=[ft.TextButton("Confirmar", on_click=salvar_ajuste_click)]
+        )
+
+    dlg_ajuste = sob_demanda(criar_dlg_ajuste)
 
     # --- DIALOGO FÉRIAS EM LOTE ---
-    txt_ini_ferias = ft.TextField(label="Início", width=120, read_only=True)
-    txt_fim_ferias = ft.TextField(label="Fim", width=120, read_only=True)
+    txt_ini_ferias = txt_fim_ferias = None  # Criados em criar_dlg_ferias
 
     def confirmar_ferias_click(e):
         if txt_ini_ferias.value and txt_fim_ferias.value:
-            app.registrar_ferias_lote(txt_ini_ferias.value, txt_fim_ferias.value)
-            dlg_ferias.open = False
+            try:
+                app.registrar_ferias_lote(txt_ini_ferias.value, txt_fim_ferias.value)
+            except ErroMesFechado as ex:
+                mostrar_mensagem(str(ex), ft.Colors.RED)
+                return
+            dlg_ferias().open = False
             atualizar_tabela()
             mostrar_mensagem("Férias registradas com sucesso!")
         else:
             mostrar_mensagem("Selecione início e fim.", ft.Colors.RED)
 
     def abrir_dp_ini(e):
-        page.open(dp_ini_ferias)
+        page.open(dp_ini_ferias())
 
     def abrir_dp_fim(e):
-        page.open(dp_fim_ferias)
+        page.open(dp_fim_ferias())
 
-    dp_ini_ferias = ft.DatePicker(
+    # page.open já anexa os pickers à página; não precisam ir para o overlay
+    dp_ini_ferias = sob_demanda(lambda: ft.DatePicker(
         on_change=lambda e: setattr(txt_ini_ferias, 'value', e.control.value.strftime("%Y-%m-%d")) or page.update()
-    )
-    dp_fim_ferias = ft.DatePicker(
+    ), anexar_overlay=False)
+    dp_fim_ferias = sob_demanda(lambda: ft.DatePicker(
         on_change=lambda e: setattr(txt_fim_ferias, 'value', e.control.value.strftime("%Y-%m-%d")) or page.update()
-    )
+    ), anexar_overlay=False)
 
-    dlg_ferias = ft.AlertDialog(
-        title=ft.Text("Registrar Férias"),
-        content=ft.Column([
-            ft.Text("Selecione o período para marcar como folga:"),
-            ft.Row([
-                txt_ini_ferias,
-                ft.IconButton(ft.Icons.CALENDAR_MONTH, on_click=abrir_dp_ini)
-            ]),
-            ft.Row([
-                txt_fim_ferias,
-                ft.IconButton(ft.Icons.CALENDAR_MONTH, on_click=abrir_dp_fim)
-            ])
-        ], height=200),
-        actions=[
-            ft.TextButton("Cancelar", on_click=lambda e: setattr(dlg_ferias, 'open', False) or page.update()),
-            ft.TextButton("Confirmar", on_click=confirmar_ferias_click),
-        ]
-    )
+    def criar_dlg_ferias():
+        nonlocal txt_ini_ferias, txt_fim_ferias
+        txt_ini_ferias = ft.TextField(label="Início", width=120, read_only=True)
+        txt_fim_ferias = ft.TextField(label="Fim", width=120, read_only=True)
+
+        return ft.AlertDialog(
+            title=ft.Text("Registrar Férias"),
+            content=ft.Column([
+                ft.Text("Selecione o período para marcar como folga:"),
+                ft.Row([
+                    txt_ini_ferias,
+                    ft.IconButton(ft.Icons.CALENDAR_MONTH, on_click=abrir_dp_ini)
+                ]),
+                ft.Row([
+                    txt_fim_ferias,
+                    ft.IconButton(ft.Icons.CALENDAR_MONTH, on_click=abrir_dp_fim)
+                ])
+            ], height=200),
+            actions=[
+                ft.TextButton("Cancelar", on_click=lambda e: fechar_dialogo(dlg_ferias)),
+                ft.TextButton("Confirmar", on_click=confirmar_ferias_click),
+            ]
+        )
+
+    dlg_ferias = sob_demanda(criar_dlg_ferias)
 
     # --- DIALOGOS DE EXCLUSÃO E LIMPEZA ---
 
-    dlg_excluir_data_ref = ft.Text(visible=False)
+    dlg_excluir_data_ref = None  # Criado em criar_dlg_confirmar_exclusao
 
     def confirmar_exclusao_click(e):
-        app.excluir_dia(dlg_excluir_data_ref.value)
-        dlg_confirmar_exclusao.open = False
+        try:
+            app.excluir_dia(dlg_excluir_data_ref.value)
+        except ErroMesFechado as ex:
+            mostrar_mensagem(str(ex), ft.Colors.RED)
+            return
+        dlg_confirmar_exclusao().open = False
         atualizar_tabela()
         mostrar_mensagem("Dia excluído.")
 
     def abrir_exclusao(e):
+        dlg = dlg_confirmar_exclusao()
         dlg_excluir_data_ref.value = e.control.data
-        page.dialog = dlg_confirmar_exclusao
-        dlg_confirmar_exclusao.open = True
+        page.dialog = dlg
+        dlg.open = True
         page.update()
 
-    dlg_confirmar_exclusao = ft.AlertDialog(
-        title=ft.Text("Excluir Dia Inteiro?"),
-        content=ft.Column([ft.Text("Isso apagará todos os registros desta data."), dlg_excluir_data_ref], height=50),
-        actions=[
-            ft.TextButton("Cancelar",
-                          on_click=lambda e: setattr(dlg_confirmar_exclusao, 'open', False) or page.update()),
-            ft.TextButton("Sim, Excluir", on_click=confirmar_exclusao_click, style=ft.ButtonStyle(color=ft.Colors.RED)),
-        ]
-    )
+    def criar_dlg_confirmar_exclusao():
+        nonlocal dlg_excluir_data_ref
+        dlg_excluir_data_ref = ft.Text(visible=False)
+        return ft.AlertDialog(
+            title=ft.Text("Excluir Dia Inteiro?"),
+            content=ft.Column([ft.Text("Isso apagará todos os registros desta data."), dlg_excluir_data_ref], height=50),
+            actions=[
+                ft.TextButton("Cancelar", on_click=lambda e: fechar_dialogo(dlg_confirmar_exclusao)),
+                ft.TextButton("Sim, Excluir", on_click=confirmar_exclusao_click, style=ft.ButtonStyle(color=ft.Colors.RED)),
+            ]
+        )
+
+    dlg_confirmar_exclusao = sob_demanda(criar_dlg_confirmar_exclusao)
 
     def limpar_tudo_final(e):
         app.limpar_tudo()
-        dlg_certeza_absoluta.open = False
+        dlg_certeza_absoluta().open = False
         atualizar_tabela()
         mostrar_mensagem("Banco Reiniciado! (Histórico preservado)", ft.Colors.GREEN)
 
-    dlg_certeza_absoluta = ft.AlertDialog(
+    dlg_certeza_absoluta = sob_demanda(lambda: ft.AlertDialog(
         title=ft.Text("ZERAR BANCO?"),
         content=ft.Text("Isso zerará o saldo total, começando a contagem de agora.\nO histórico antigo será mantido."),
         actions=[
-            ft.TextButton("CANCELAR", on_click=lambda e: setattr(dlg_certeza_absoluta, 'open', False) or page.update()),
+            ft.TextButton("CANCELAR", on_click=lambda e: fechar_dialogo(dlg_certeza_absoluta)),
             ft.TextButton("ZERAR", on_click=limpar_tudo_final,
                           style=ft.ButtonStyle(color=ft.Colors.RED, bgcolor=ft.Colors.RED_50)),
         ]
-    )
+    ))
 
-    dlg_confirmar_limpeza = ft.AlertDialog(
+    dlg_confirmar_limpeza = sob_demanda(lambda: ft.AlertDialog(
         title=ft.Text("Zerar Banco de Horas?"),
         content=ft.Text("Deseja zerar o banco atual e começar um novo ciclo?"),
         actions=[
-            ft.TextButton("Não", on_click=lambda e: setattr(dlg_confirmar_limpeza, 'open', False) or page.update()),
+            ft.TextButton("Não", on_click=lambda e: fechar_dialogo(dlg_confirmar_limpeza)),
             ft.TextButton("Sim", on_click=lambda e: (
-                    setattr(dlg_confirmar_limpeza, 'open', False) or setattr(dlg_certeza_absoluta, 'open',
-                                                                             True) or page.update()),
+                    setattr(dlg_confirmar_limpeza(), 'open', False) or abrir_dialogo(dlg_certeza_absoluta)),
                           style=ft.ButtonStyle(color=ft.Colors.RED)),
         ]
-    )
+    ))
 
     # --- SISTEMA DE INSERÇÃO MANUAL ---
 
     def abrir_calendario_manual(e):
-        page.open(date_picker)
+        page.open(date_picker())
 
     def ao_escolher_data_manual(e):
         nonlocal data_manual_temp
-        if date_picker.value:
-            data_manual_temp = date_picker.value
-            page.open(time_picker)
+        if date_picker().value:
+            data_manual_temp = date_picker().value
+            page.open(time_picker())
 
     def ao_escolher_hora_manual(e):
-        if time_picker.value and data_manual_temp:
+        if time_picker().value and data_manual_temp:
             data_str = data_manual_temp.strftime("%Y-%m-%d")
-            hora_str = time_picker.value.strftime("%H:%M")
-            if app.registrar_batida(data_str, hora_str):
+            hora_str = time_picker().value.strftime("%H:%M")
+            if app.mes_fechado(data_str):
+                mostrar_mensagem(f"O mês {data_str[5:7]}/{data_str[:4]} está fechado. Reabra-o para inserir.",
+                                 ft.Colors.RED)
+            elif app.registrar_batida(data_str, hora_str):
                 mostrar_mensagem(f"Inserido: {data_str} às {hora_str}")
                 atualizar_tabela()
             else:
                 mostrar_mensagem("Horário já existe para este dia.", ft.Colors.ORANGE)
 
-    date_picker = ft.DatePicker(
+    date_picker = sob_demanda(lambda: ft.DatePicker(
         on_change=ao_escolher_data_manual,
         confirm_text="Confirmar", cancel_text="Cancelar",
         help_text="Selecione a data",
-    )
-    time_picker = ft.TimePicker(
+    ), anexar_overlay=False)
+    time_picker = sob_demanda(lambda: ft.TimePicker(
         on_change=ao_escolher_hora_manual,
         confirm_text="Confirmar", cancel_text="Cancelar",
         help_text="Selecione o horário"
-    )
-
-    # --- ADICIONAR COMPONENTES AO OVERLAY ---
-    page.overlay.extend([
-        dlg_editar, dlg_ajuste, dlg_ferias,
-        dlg_confirmar_exclusao, dlg_confirmar_limpeza, dlg_certeza_absoluta,
-        dlg_exportar, dlg_config,
-        date_picker, time_picker, dp_ini_ferias, dp_fim_ferias,
-        fp_backup, fp_restore, fp_export, fp_importar_pdf
-    ])
+    ), anexar_overlay=False)
 
     # --- FUNÇÕES DA UI (BOTÕES) ---
 
     def toggle_folga(e):
         # Se clicou no Checkbox, é FOLGA MANUAL (is_ferias=False)
-        app.definir_folga(e.control.data, e.control.value, eh_ferias=False)
+        try:
+            app.definir_folga(e.control.data, e.control.value, eh_ferias=False)
+        except ErroMesFechado as ex:
+            mostrar_mensagem(str(ex), ft.Colors.RED)
         atualizar_tabela()
 
     def bater_ponto_click(e):
@@ -2875,39 +4198,53 @@ def main(page: ft.Page):
         atualizar_tabela()
 
     # --- GRÁFICO VISUAL ---
-
-    chart = ft.LineChart(
-        data_series=[],
-        border=ft.border.all(1, ft.Colors.GREY_400),
-        left_axis=ft.ChartAxis(labels_size=40, title=ft.Text("Horas Saldo")),
-        bottom_axis=ft.ChartAxis(
-            labels_size=30,
-            title=ft.Text("Dia do Mês"),
-            labels_interval=1
-        ),
-        horizontal_grid_lines=ft.ChartGridLines(color=ft.Colors.GREY_200, width=1, dash_pattern=[3, 3]),
-        vertical_grid_lines=ft.ChartGridLines(color=ft.Colors.GREY_200, width=1),
-        tooltip_bgcolor=ft.Colors.with_opacity(0.9, ft.Colors.BLACK),
-        min_y=-10, max_y=10,
-        expand=True, height=250
+    ultimo_grafico = None  # Chave do último gráfico desenhado (evita recriar os pontos sem mudança)
+
+    dd_modo_grafico = ft.Dropdown(
+        width=180,
+        options=[ft.dropdown.Option("mes", "Mês filtrado"), ft.dropdown.Option("ano", "Ano"),
+                 ft.dropdown.Option("historico", "Todo o Histórico")],
+        value="mes",
+        on_change=lambda e: atualizar_tabela()
     )
+    lbl_titulo_grafico = ft.Text("Evolução do Banco no Mês:", weight="bold", size=16)
+    chart = None  # Criado por criar_grafico() no primeiro desenho com dados
+
+    def criar_grafico():
+        nonlocal chart
+        chart = ft.LineChart(
+            data_series=[],
+            border=ft.border.all(1, ft.Colors.GREY_400),
+            left_axis=ft.ChartAxis(labels_size=40, title=ft.Text("Horas Saldo")),
+            bottom_axis=ft.ChartAxis(
+                labels_size=30,
+                title=ft.Text("Dia do Mês"),
+                labels_interval=1
+            ),
+            horizontal_grid_lines=ft.ChartGridLines(color=ft.Colors.GREY_200, width=1, dash_pattern=[3, 3]),
+            vertical_grid_lines=ft.ChartGridLines(color=ft.Colors.GREY_200, width=1),
+            tooltip_bgcolor=ft.Colors.with_opacity(0.9, ft.Colors.BLACK),
+            min_y=-10, max_y=10,
+            expand=True, height=250
+        )
 
-    # --- ALTERAÇÃO NO GRÁFICO (ROLAGEM HORIZONTAL) ---
-    container_grafico = ft.Container(
-        content=ft.Column([
-            ft.Text("Evolução do Banco no Mês:", weight="bold", size=16),
+        # --- ALTERAÇÃO NO GRÁFICO (ROLAGEM HORIZONTAL) ---
+        container_grafico.content = ft.Column([
+            ft.Row([lbl_titulo_grafico, dd_modo_grafico], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
             # Envolvemos o gráfico em uma Row com Scroll
             ft.Row(
                 controls=[
                     ft.Container(
                         content=chart,
-                        width=1000,  # LARGURA FIXA: O gráfico sempre terá 1000px
+                        width=tabela.width or 1000,  # LARGURA FIXA: acompanha a tabela (1000px por padrão)
                         height=250  # Isso garante que ele fique "bonito" e rolável no celular
                     )
                 ],
                 scroll=ft.ScrollMode.ALWAYS  # Habilita o scroll horizontal
             )
-        ]),
+        ])
+
+    container_grafico = ft.Container(
         padding=20,
         bgcolor=ft.Colors.with_opacity(0.05, ft.Colors.BLUE),
         border_radius=10,
@@ -2974,18 +4311,43 @@ def main(page: ft.Page):
         "FÉRIAS",
         icon=ft.Icons.BEACH_ACCESS,
         color=ft.Colors.ORANGE,
-        on_click=lambda e: (setattr(dlg_ferias, 'open', True), page.update())
+        on_click=lambda e: abrir_dialogo(dlg_ferias)
     )
 
     btn_exportar = ft.IconButton(icon=ft.Icons.PIE_CHART, tooltip="Exportar Relatório",
-                                 on_click=lambda e: (setattr(dlg_exportar, 'open', True), page.update()))
+                                 on_click=lambda e: abrir_dialogo(dlg_exportar))
+    btn_relatorios = ft.IconButton(icon=ft.Icons.ASSESSMENT, tooltip="Relatórios por Período",
+                                   on_click=lambda e: abrir_dialogo(dlg_relatorios))
     btn_config = ft.IconButton(icon=ft.Icons.SETTINGS, tooltip="Configurações/Backup",
-                               on_click=lambda e: (setattr(dlg_config, 'open', True), page.update()))
+                               on_click=abrir_config)
+
+    def alternar_fechamento(e):
+        mes = e.control.data
+        try:
+            if app.mes_fechado(mes):
+                reabertos = app.reabrir_mes(mes)
+                mostrar_mensagem(f"Reaberto(s): {', '.join(m[5:7] + '/' + m[:4] for m in reabertos)}", ft.Colors.ORANGE)
+            else:
+                fechados = app.fechar_mes(mes)
+                mostrar_mensagem(f"Fechado(s): {', '.join(m[5:7] + '/' + m[:4] for m in fechados)}")
+        except ValueError as ex:
+            mostrar_mensagem(str(ex), ft.Colors.RED)
+        atualizar_tabela()
+
+    btn_fechamento = ft.TextButton("Fechar Mês", icon=ft.Icons.LOCK, icon_color="blue", on_click=alternar_fechamento,
+                                   tooltip="Congela o saldo do mês (e dos anteriores); editar exige reabrir")
 
     # 4. A FUNÇÃO QUE TINHA SUMIDO (Restaurada)
     def atualizar_tabela():
+        with trava_sessao:
+            redesenhar_tabela()
+
+    def redesenhar_tabela():
+        nonlocal txt_saida_hoje, txt_trabalhado_hoje
+        retomar_layout()
+        app.sincronizar()  # Pega o que outros workers/sessões gravaram
         tabela.rows.clear()
-        datas_ordenadas = sorted(app.dados.keys())
+        txt_saida_hoje = txt_trabalhado_hoje = None
 
         filtro_input = txt_filtro.value.strip()
         filtro_ano_mes = ""
@@ -2997,56 +4359,52 @@ def main(page: ft.Page):
         except:
             filtro_ano_mes = datetime.now().strftime("%Y-%m")
 
+        # Só o mês filtrado é carregado; meses anteriores entram pelos totais do manifesto
+
         soma_trab_mes = 0
         soma_banco_mes = 0
-        soma_banco_anterior = 0
+        soma_banco_anterior = app.saldo_anterior(filtro_ano_mes)
+        fechado = app.mes_fechado(filtro_ano_mes)  # Mês fechado: a tabela fica só para consulta
 
         hoje_str = app.obter_hoje_str()
         is_dark = page.theme_mode == ft.ThemeMode.DARK
         data_corte = app.config.get("data_inicio_contagem")
 
-        pontos_grafico = []
+        serie_mes = []
         saldo_acumulado_grafico = 0
 
-        for i, data in enumerate(datas_ordenadas):
-            info = app.dados[data]
+        for i, (data, info) in enumerate(app.iterar_mes(filtro_ano_mes)):
             trabalhado, meta, saldo_final, eh_feriado = app.obter_saldo_dia(data, info)
 
             ajuste_min = info.get("ajuste_manual", 0)
             saldo_puro_segundos = saldo_final - (ajuste_min * 60)
 
-            eh_mes_corrente = data.startswith(filtro_ano_mes)
-
             if not data_corte or data >= data_corte:
-                if eh_mes_corrente:
-                    soma_trab_mes += trabalhado
-                    soma_banco_mes += saldo_final
-                    saldo_acumulado_grafico += saldo_final
-                    dia_mes = int(data.split("-")[2])
-                    pontos_grafico.append(ft.LineChartDataPoint(
-                        x=dia_mes,
-                        y=saldo_acumulado_grafico / 3600,
-                        tooltip=f"Dia {dia_mes}: {app.formatar_duracao(saldo_acumulado_grafico)}",
-                        show_tooltip=True, point=True
-                    ))
-                elif data < (filtro_ano_mes + "-01"):
-                    soma_banco_anterior += saldo_final
-
-            if not eh_mes_corrente:
-                continue
+                soma_trab_mes += trabalhado
+                soma_banco_mes += saldo_final
+                saldo_acumulado_grafico += saldo_final
+                dia_mes = int(data.split("-")[2])
+                serie_mes.append((dia_mes, saldo_acumulado_grafico, f"Dia {dia_mes}"))
 
             # Montagem visual da linha
             batidas_str = " | ".join(info['batidas'])
             coluna_batidas_content = [ft.Text(batidas_str)]
 
-            # Badge de Saída
+            # Badge de Saída (na linha de hoje os textos são atualizados ao vivo pelo TICKER)
             if len(info['batidas']) % 2 != 0:
                 batidas_str += " ..."
-                parcial = app.calcular_segundos_trabalhados(info['batidas'] + [datetime.now().strftime("%H:%M")])
-                meta_atual = app.config.get("meta_diaria", 8)
-                falta = (meta_atual * 3600) - parcial
-                if falta > 0:
-                    saida_dt = datetime.now() + timedelta(seconds=falta)
+                saida_dt = app.previsao_saida(data)
+                if data == hoje_str:
+                    txt_saida_hoje = ft.Text(size=12, color=ft.Colors.WHITE, weight="bold")
+                    txt_trabalhado_hoje = ft.Text(size=12, color=ft.Colors.BLUE_700)
+                    preencher_mostradores()
+                    coluna_batidas_content.append(ft.Container(
+                        content=txt_saida_hoje,
+                        bgcolor=ft.Colors.BLUE_700, padding=ft.padding.symmetric(horizontal=6, vertical=2),
+                        border_radius=4, margin=ft.margin.only(top=4)
+                    ))
+                    coluna_batidas_content.append(txt_trabalhado_hoje)
+                elif saida_dt is not None:
                     badge_saida = ft.Container(
                         content=ft.Text(f"Saída: {saida_dt.strftime('%H:%M')}", size=12, color=ft.Colors.WHITE,
                                         weight="bold"),
@@ -3084,7 +4442,7 @@ def main(page: ft.Page):
                 txt_saldo_ui = ft.Text(f"{str_saldo} (FERIADO)", color=cor_feriado, weight="bold")
                 dia_txt += " (F)"
             elif dt_obj.weekday() >= 5:
-                fator_fds_show = app.config.get('fator_fds', 2.0)
+                fator_fds_show = app.regras_em(data)["fator_fds"]
                 txt_saldo_ui = ft.Text(f"{str_saldo} (x{fator_fds_show})", color=ft.Colors.GREEN, weight="bold")
 
             tabela.rows.append(
@@ -3100,16 +4458,15 @@ def main(page: ft.Page):
                         ft.DataCell(ft.Row([
                             ft.Text(txt_ajuste, color=color_ajuste, size=12, weight="bold"),
                             ft.IconButton(icon=ft.Icons.TUNE, tooltip="Ajuste Manual", on_click=abrir_ajuste, data=data,
-                                          icon_size=20),
+                                          icon_size=20, disabled=fechado),
                         ], spacing=5)),
                         ft.DataCell(ft.Row([
-                            ft.Checkbox(value=info['folga'], label="Folga",
+                            ft.Checkbox(value=info['folga'], label="Folga", data=data, disabled=fechado,
                                         on_change=lambda e, d=data: toggle_folga(e)),
                             ft.IconButton(ft.Icons.EDIT_NOTE, on_click=abrir_edicao, data=data,
-                                          icon_color=ft.Colors.BLUE),
-                            ft.IconButton(ft.Icons.DELETE, icon_color="red", on_click=lambda e, d=data: (
-                            setattr(dlg_excluir_data_ref, 'value', d), setattr(dlg_confirmar_exclusao, 'open', True),
-                            page.update()))
+                                          icon_color=ft.Colors.BLUE, disabled=fechado),
+                            ft.IconButton(ft.Icons.DELETE, icon_color="red", on_click=abrir_exclusao, data=data,
+                                          disabled=fechado)
                         ]))
                     ]
                 )
@@ -3118,12 +4475,14 @@ def main(page: ft.Page):
         lbl_trab_mes.value = app.formatar_duracao(soma_trab_mes)
         try:
             partes_data = filtro_ano_mes.split("-")
-            dias_uteis = app.calcular_dias_uteis_mes(int(partes_data[0]), int(partes_data[1]))
-            previsto_seg = dias_uteis * app.config.get("meta_diaria", 8) * 3600
+            ultimo_dia = calendar.monthrange(int(partes_data[0]), int(partes_data[1]))[1]
+            previsto_seg = app.meta_periodo(f"{filtro_ano_mes[:7]}-01", f"{filtro_ano_mes[:7]}-{ultimo_dia:02d}")
             lbl_prev_mes.value = app.formatar_duracao(previsto_seg)
         except:
             lbl_prev_mes.value = "--:--"
 
+        if fechado:
+            soma_banco_mes = app.saldo_mes(filtro_ano_mes[:7])  # O saldo congelado no fechamento
         lbl_banco_mes.value = app.formatar_duracao(soma_banco_mes)
         lbl_banco_mes.color = ft.Colors.GREEN if soma_banco_mes >= 0 else ft.Colors.RED
         lbl_banco_ant.value = app.formatar_duracao(soma_banco_anterior)
@@ -3133,26 +4492,196 @@ def main(page: ft.Page):
         lbl_banco_total.value = app.formatar_duracao(total_geral)
         lbl_banco_total.color = ft.Colors.GREEN if total_geral >= 0 else ft.Colors.RED
 
+        mes_filtro = filtro_ano_mes[:7]
+        btn_fechamento.data = mes_filtro
+        btn_fechamento.text = f"{'Reabrir' if fechado else 'Fechar'} Mês {mes_filtro[5:7]}/{mes_filtro[:4]}"
+        btn_fechamento.icon = ft.Icons.LOCK_OPEN if fechado else ft.Icons.LOCK
+        btn_fechamento.disabled = not fechado and mes_filtro >= datetime.now().strftime("%Y-%m")
+
         # Atualiza Gráfico
-        if pontos_grafico:
-            container_grafico.visible = True
-            cor_linha = (ft.Colors.GREEN_400 if saldo_acumulado_grafico >= 0 else ft.Colors.RED_400) if is_dark else (
-                ft.Colors.GREEN if saldo_acumulado_grafico >= 0 else ft.Colors.RED)
-            chart.data_series = [
-                ft.LineChartData(data_points=pontos_grafico, stroke_width=4, color=cor_linha, curved=True,
-                                 stroke_cap_round=True, below_line_bgcolor=ft.Colors.with_opacity(0.1, cor_linha),
-                                 point=True)]
-            vals = [p.y for p in pontos_grafico]
-            chart.min_y = min(vals) - 2 if vals else -10
-            chart.max_y = max(vals) + 2 if vals else 10
-            chart.bottom_axis.labels = [ft.ChartAxisLabel(value=p.x, label=ft.Container(
-                ft.Text(str(int(p.x)), size=10, weight=ft.FontWeight.BOLD), padding=ft.padding.only(top=5))) for p in
-                                        pontos_grafico]
+        modo_grafico = dd_modo_grafico.value
+        if modo_grafico == "ano":
+            serie = app.serie_saldo("ano", filtro_ano_mes[:4]) if re.match(r"\d{4}", filtro_ano_mes) else []
+        elif modo_grafico == "historico":
+            serie = app.serie_saldo("historico")
         else:
-            container_grafico.visible = False
+            serie = serie_mes
+        desenhar_grafico(serie, modo_grafico, is_dark)
+        agendar_lembrete_saida()
+        if txt_saida_hoje is not None:
+            TICKER.inscrever(chave_lembrete, atualizar_mostradores)
+        else:
+            TICKER.desinscrever(chave_lembrete)
 
         page.update()
 
+    def desenhar_grafico(serie, modo, is_dark):
+        """Monta o LineChart a partir de uma série [(x, segundos, rótulo)], reduzida por LTTB."""
+        nonlocal ultimo_grafico
+        if not serie:
+            container_grafico.visible = False
+            ultimo_grafico = None
+            return
+
+        pontos = reduzir_lttb(serie, PONTOS_MAX_GRAFICO)
+        chave = (modo, is_dark, tuple(pontos))
+        if chart is None:
+            criar_grafico()
+        container_grafico.visible = True
+        if chave == ultimo_grafico:
+            return  # Nada mudou: não recria os pontos nem reenvia o gráfico
+        ultimo_grafico = chave
+
+        titulos = {"mes": ("Evolução do Banco no Mês:", "Dia do Mês"),
+                   "ano": ("Evolução do Banco no Ano:", "Dia"),
+                   "historico": ("Evolução do Banco (Histórico):", "Mês")}
+        lbl_titulo_grafico.value, titulo_eixo = titulos.get(modo, titulos["mes"])
+        chart.bottom_axis.title = ft.Text(titulo_eixo)
+
+        saldo_final = pontos[-1][1]
+        cor_linha = (ft.Colors.GREEN_400 if saldo_final >= 0 else ft.Colors.RED_400) if is_dark else (
+            ft.Colors.GREEN if saldo_final >= 0 else ft.Colors.RED)
+        pontos_grafico = [ft.LineChartDataPoint(x=x, y=segundos / 3600,
+                                                tooltip=f"{rotulo}: {app.formatar_duracao(segundos)}",
+                                                show_tooltip=True, point=True)
+                          for x, segundos, rotulo in pontos]
+        chart.data_series = [
+            ft.LineChartData(data_points=pontos_grafico, stroke_width=4, color=cor_linha, curved=True,
+                             stroke_cap_round=True, below_line_bgcolor=ft.Colors.with_opacity(0.1, cor_linha),
+                             point=modo == "mes")]
+        vals = [p.y for p in pontos_grafico]
+        chart.min_y = min(vals) - 2
+        chart.max_y = max(vals) + 2
+
+        # No mês cada dia ganha rótulo; nos períodos longos só alguns, espaçados
+        passo = 1 if modo == "mes" else max(1, -(-len(pontos) // ROTULOS_MAX_GRAFICO))
+        chart.bottom_axis.labels = [
+            ft.ChartAxisLabel(value=x, label=ft.Container(
+                ft.Text(str(int(x)) if modo == "mes" else rotulo, size=10, weight=ft.FontWeight.BOLD),
+                padding=ft.padding.only(top=5)))
+            for x, _, rotulo in pontos[::passo]]
+
+    # --- LEMBRETE DE SAÍDA ---
+    chave_lembrete = ("saida", id(page))
+    ultimo_lembrete = None
+
+    def agendar_lembrete_saida():
+        """(Re)agenda no LEMBRETES o aviso de saída de hoje desta sessão, se houver batida em aberto."""
+        nonlocal ultimo_lembrete
+        saida = app.previsao_saida()
+        if saida == ultimo_lembrete:
+            return
+        ultimo_lembrete = saida
+        if saida is None:
+            LEMBRETES.cancelar(chave_lembrete)
+        else:
+            LEMBRETES.agendar(chave_lembrete, saida, lambda: mostrar_mensagem(
+                f"⏰ Meta do dia cumprida ({saida.strftime('%H:%M')}): hora de registrar a saída!", ft.Colors.BLUE))
+
+    # --- MOSTRADORES AO VIVO (TRABALHADO HOJE / TEMPO ATÉ A SAÍDA) ---
+    txt_saida_hoje = txt_trabalhado_hoje = None  # Criados por atualizar_tabela na linha de hoje
+
+    def preencher_mostradores():
+        agora = datetime.now().replace(second=0, microsecond=0)
+        hoje = agora.strftime("%Y-%m-%d")
+        saida = app.previsao_saida(hoje, agora)
+        if saida is None:
+            txt_saida_hoje.value = "Meta cumprida ✓"
+        else:
+            falta = app.formatar_duracao((saida - agora).total_seconds())
+            txt_saida_hoje.value = f"Saída: {saida.strftime('%H:%M')} (faltam {falta})"
+        txt_trabalhado_hoje.value = f"Hoje: {app.formatar_duracao(app.trabalhado_ate_agora(hoje, agora))}"
+
+    def atualizar_mostradores():
+        """Chamado pelo TICKER a cada minuto: reenvia só os dois textos, sem redesenhar a tabela."""
+        with trava_sessao:
+            info = app.dados.get(app.obter_hoje_str())
+            if txt_saida_hoje is None or not info or len(info["batidas"]) % 2 == 0:
+                return False  # Saída registrada (ou virou o dia): a próxima atualizar_tabela resolve
+            preencher_mostradores()
+            txt_saida_hoje.update()
+            txt_trabalhado_hoje.update()
+            return True
+
+    def encerrar_sessao(e):
+        LEMBRETES.cancelar(chave_lembrete)
+        TICKER.desinscrever(chave_lembrete)
+        SESSOES.remover(chave_sessao)
+
+    page.on_close = encerrar_sessao
+
+    # --- SESSÃO OCIOSA (PAUSA E RETOMADA) ---
+    # Sem interação por "sessao_ociosidade_min", a varredura do SESSOES troca a tela por um aviso
+    # leve e solta o estado pesado: linhas da tabela, gráfico, avisos já exibidos e caches do app.
+    # A volta (aba visível de novo, reconexão, "Continuar" ou qualquer redesenho) refaz tudo.
+    chave_sessao = ("sessao", id(page))
+    conteudo_pagina = []  # Layout principal, guardado depois do page.add
+    pausada = False
+
+    def medir_sessao():
+        return memoria_aproximada([*conteudo_pagina, *page.overlay, app._cache_series, app._cache_dias_uteis])
+
+    def pausar_sessao(limite):
+        """
+        Chamado pela varredura do SESSOES, na thread do agendador: pausa se não houve interação
+        desde `limite` (conferido de novo sob a trava da sessão). Retorna False se não pausou.
+        """
+        with trava_sessao:
+            return desmontar_tela(limite)
+
+    def desmontar_tela(limite):
+        nonlocal pausada, chart, ultimo_grafico, txt_saida_hoje, txt_trabalhado_hoje
+        if pausada or SESSOES.ultima_atividade(chave_sessao) > limite:
+            return False  # Voltou a ser usada depois da varredura escolher a sessão
+        if any(isinstance(c, ft.AlertDialog) and c.open for c in page.overlay):
+            return False  # Com um diálogo aberto pode haver algo sendo digitado
+        pausada = True
+        TICKER.desinscrever(chave_lembrete)
+        tabela.rows.clear()
+        txt_saida_hoje = txt_trabalhado_hoje = None
+        chart = ultimo_grafico = None
+        container_grafico.content = None
+        container_grafico.visible = False
+        page.overlay[:] = [c for c in page.overlay if not isinstance(c, ft.SnackBar)]
+        app._cache_series.clear()
+        app._cache_dias_uteis.clear()
+        page.controls[:] = [ft.Container(
+            content=ft.Column([
+                ft.Text("Sessão pausada por inatividade", size=20, weight="bold"),
+                ft.Text("Os registros continuam salvos; a tela é refeita ao continuar.", color=ft.Colors.GREY),
+                ft.ElevatedButton("Continuar", icon=ft.Icons.PLAY_ARROW, on_click=lambda e: retomar_sessao())
+            ], horizontal_alignment=ft.CrossAxisAlignment.CENTER),
+            alignment=ft.alignment.center, padding=40)]
+        try:
+            page.update()
+        except Exception:
+            pass  # Cliente desconectado: recebe a tela pausada se reconectar
+        return True
+
+    def retomar_layout():
+        """Marca interação e, se a sessão estava pausada, devolve o layout principal (atualizar_tabela redesenha)."""
+        nonlocal pausada
+        with trava_sessao:
+            SESSOES.tocar(chave_sessao)
+            if pausada:
+                pausada = False
+                page.controls[:] = conteudo_pagina
+
+    def retomar_sessao():
+        with trava_sessao:
+            if pausada:
+                atualizar_tabela()
+                ajustar_layout(None)
+            else:
+                SESSOES.tocar(chave_sessao)
+
+    def ao_mudar_ciclo_de_vida(e):
+        if e.state in (ft.AppLifecycleState.SHOW, ft.AppLifecycleState.RESUME):
+            retomar_sessao()
+
+    page.on_app_lifecycle_state_change = ao_mudar_ciclo_de_vida
+    page.on_connect = lambda e: retomar_sessao()
+
     # 5. HEADER, FOOTER E LÓGICA DE RESPONSIVIDADE
 
     header_content = ft.Row([
@@ -3163,7 +4692,7 @@ def main(page: ft.Page):
         ft.Container(width=20),
         txt_filtro,
         ft.IconButton(ft.Icons.SEARCH, on_click=lambda e: atualizar_tabela()),
-        btn_exportar, btn_config,
+        btn_exportar, btn_relatorios, btn_config,
         ft.IconButton(ft.Icons.DARK_MODE, on_click=alternar_tema, tooltip="Tema"),
         btn_manual, btn_ferias, btn_bater
     ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN)
@@ -3177,7 +4706,8 @@ def main(page: ft.Page):
             ft.Row([linha_resumo_1], scroll=ft.ScrollMode.AUTO),
             ft.Divider(height=10, color="transparent"),
             ft.Row([ft.TextButton("Zerar Banco (Mantém Histórico)", icon=ft.Icons.RESTART_ALT, icon_color="orange",
-                                  on_click=lambda e: (setattr(dlg_confirmar_limpeza, 'open', True), page.update()))]),
+                                  on_click=lambda e: abrir_dialogo(dlg_confirmar_limpeza)),
+                    btn_fechamento]),
             ft.Row([ft.Text("© 2025 Controle de Ponto - Desenvolvido por YannaMedova", size=12, color=ft.Colors.GREY)],
                    alignment=ft.MainAxisAlignment.CENTER)
         ]),
@@ -3190,6 +4720,10 @@ def main(page: ft.Page):
     # --- 5. LÓGICA DE REDIMENSIONAMENTO
 
     def ajustar_layout(e):
+        with trava_sessao:
+            redimensionar()
+
+    def redimensionar():
         # Calcula a largura disponível na tela
         largura_tela = page.width if page.width else (page.window_width if page.window_width else 1000)
 
@@ -3262,6 +4796,9 @@ def main(page: ft.Page):
         footer,
         container_grafico
     )
+    conteudo_pagina[:] = page.controls
+    SESSOES.ociosidade = app.config.get("sessao_ociosidade_min", OCIOSIDADE_SESSAO_MIN) * 60
+    SESSOES.registrar(chave_sessao, medir_sessao, pausar_sessao)
 
     # INICIALIZAÇÃO
     atualizar_tabela()
@@ -3274,8 +4811,6 @@ def main(page: ft.Page):
 # =============================
 
 # >>> SENHA: carregar via variável de ambiente (segurança)
-import os
-
 _ENV_KEY_SENHA = "PONTO_PASSWORD"
 
 # Tenta ler a senha do ambiente
@@ -1,4 +1,5 @@
-import os, time
+import os, time, signal, sys
+import asyncio, ipaddress, secrets, subprocess, threading, zlib
 import main
 import flet as ft
 
@@ -10,14 +11,242 @@ except:
     pass
 # <<<
 
-def _run():
+# --- MODO COM VÁRIOS WORKERS ---
+# PONTO_WORKERS=N (N > 1) sobe N processos do Flet em 127.0.0.1:PORTA_BASE_WORKERS+i e um
+# balanceador TCP na porta pública. Todos usam a mesma pasta de dados (trava + mescla por dia,
+# ver DadosParticionados) e cada sessão relê o que os outros processos gravaram ao redesenhar.
+PORTA_PUBLICA = int(os.environ.get("PORT", 8000))
+PORTA_BASE_WORKERS = int(os.environ.get("PONTO_PORTA_BASE", 8100))
+TAMANHO_MAX_CABECALHO = 64 * 1024
+INTERVALO_SUPERVISAO = 2  # segundos entre verificações de workers que caíram
+COOKIE_AFINIDADE = "ponto_afinidade"
+# IPs/redes dos proxies na frente do balanceador, separados por vírgula (ex.: "10.0.0.0/8"). Só de
+# conexões vindas deles o X-Forwarded-For é aceito; sem isso vale o IP da conexão.
+PROXIES_CONFIAVEIS = os.environ.get("PONTO_PROXIES_CONFIAVEIS", "")
+
+
+def _run(porta=PORTA_PUBLICA, host="0.0.0.0"):
+    # SIGTERM (parada do Render) vira uma saída normal, para o atexit esvaziar a fila de gravação
+    try:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    except ValueError:
+        pass  # Fora da thread principal não dá para instalar o handler
+
     ft.app(
         target=main.tela_login,
         view=ft.WEB_BROWSER,   # Abre no navegador no Render
-        port=8000,             # Porta padrão correta do Render
-        host="0.0.0.0"         # Necessário para Render aceitar conexões externas
+        port=porta,            # Porta padrão correta do Render
+        host=host              # Necessário para Render aceitar conexões externas
     )
 
-if __name__ == "__main__":
-    _run()
 
+def redes_confiaveis(texto):
+    """Converte "ip, rede/máscara, ..." (PONTO_PROXIES_CONFIAVEIS) em redes; entradas inválidas são ignoradas."""
+    redes = []
+    for item in texto.split(","):
+        if item.strip():
+            try:
+                redes.append(ipaddress.ip_network(item.strip(), strict=False))
+            except ValueError:
+                print(f"AVISO: proxy confiável inválido ignorado: {item.strip()!r}")
+    return redes
+
+
+def _confiavel(ip, proxies):
+    try:
+        endereco = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(endereco in rede for rede in proxies)
+
+
+def _campos_cabecalho(cabecalho):
+    """[(nome em minúsculas, valor)] das linhas do cabeçalho HTTP (a linha da requisição fica de fora)."""
+    campos = []
+    for linha in cabecalho.split(b"\r\n")[1:]:
+        nome, _, valor = linha.partition(b":")
+        if nome.strip():
+            campos.append((nome.strip().lower(), valor.strip()))
+    return campos
+
+
+def ip_cliente_real(campos, ip_conexao, proxies):
+    """
+    IP do cliente. O X-Forwarded-For só vale quando a conexão vem de um proxy confiável: a lista é
+    lida da direita para a esquerda, pulando os proxies confiáveis, e o primeiro IP de fora é o
+    cliente (os anteriores podem ter sido forjados por ele).
+    """
+    ip = ip_conexao or ""
+    if not _confiavel(ip, proxies):
+        return ip
+    encaminhados = [parte.strip().decode("latin-1") for nome, valor in campos if nome == b"x-forwarded-for"
+                    for parte in valor.split(b",") if parte.strip()]
+    for anterior in reversed(encaminhados):
+        ip = anterior
+        if not _confiavel(ip, proxies):
+            break
+    return ip
+
+
+def cookie_afinidade(campos):
+    """Valor do cookie de afinidade na requisição, ou None."""
+    for nome, valor in campos:
+        if nome != b"cookie":
+            continue
+        for par in valor.split(b";"):
+            chave, _, conteudo = par.strip().partition(b"=")
+            if chave == COOKIE_AFINIDADE.encode() and conteudo:
+                return conteudo[:64]
+    return None
+
+
+def chave_afinidade(cabecalho, ip_conexao, proxies=()):
+    """
+    Chave de afinidade da conexão. Retorna (chave, cookie_novo):
+    - com o cookie de afinidade, a chave é ele (cada aba/navegador tem o seu, mesmo atrás de um NAT);
+    - sem o cookie, uma requisição comum ganha um cookie novo (cookie_novo, a ser devolvido na
+      resposta), que já é a chave dela;
+    - um WebSocket sem o cookie (navegador que recusa cookies) cai no IP do cliente (ver ip_cliente_real).
+    """
+    campos = _campos_cabecalho(cabecalho)
+    cookie = cookie_afinidade(campos)
+    if cookie:
+        return cookie, None
+    if any(nome == b"upgrade" and valor.lower() == b"websocket" for nome, valor in campos):
+        return ip_cliente_real(campos, ip_conexao, proxies).encode(), None
+    novo = secrets.token_hex(16).encode()
+    return novo, novo
+
+
+class Balanceador:
+    """
+    Balanceador TCP com afinidade de sessão: o mesmo navegador sempre cai no mesmo worker
+    (hash da chave de afinidade, ver chave_afinidade), o que mantém o WebSocket da sessão do Flet
+    e as reconexões no processo que tem o estado da página. Se o worker escolhido não responde,
+    tenta o próximo.
+    """
+
+    def __init__(self, destinos, proxies=()):
+        self.destinos = destinos  # [(host, porta), ...]
+        self.proxies = proxies  # Redes cujo X-Forwarded-For é aceito (ver redes_confiaveis)
+
+    def ordem(self, chave):
+        inicio = zlib.crc32(chave) % len(self.destinos)
+        return self.destinos[inicio:] + self.destinos[:inicio]
+
+    async def _encaminhar(self, leitor, escritor):
+        try:
+            while True:
+                dados = await leitor.read(65536)
+                if not dados:
+                    break
+                escritor.write(dados)
+                await escritor.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            escritor.close()
+
+    async def _responder_com_cookie(self, leitor_worker, escritor_cliente, cookie):
+        """Repassa a primeira resposta do worker com o Set-Cookie de afinidade; o resto passa direto."""
+        try:
+            cabecalho = await leitor_worker.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as ex:
+            cabecalho = ex.partial  # Resposta sem cabeçalho completo: vai como veio
+        except asyncio.LimitOverrunError as ex:
+            cabecalho = await leitor_worker.read(ex.consumed)
+        except ConnectionError:
+            escritor_cliente.close()
+            return
+        if cabecalho.endswith(b"\r\n\r\n"):
+            cabecalho = (cabecalho[:-2] + b"Set-Cookie: " + COOKIE_AFINIDADE.encode() + b"=" + cookie
+                         + b"; Path=/; HttpOnly; SameSite=Lax\r\n\r\n")
+        escritor_cliente.write(cabecalho)
+        await self._encaminhar(leitor_worker, escritor_cliente)
+
+    async def _atender(self, leitor_cliente, escritor_cliente):
+        # Lê só o cabeçalho da primeira requisição para escolher o worker; o resto passa direto
+        try:
+            cabecalho = await leitor_cliente.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as ex:
+            cabecalho = ex.partial
+        except asyncio.LimitOverrunError as ex:
+            cabecalho = await leitor_cliente.read(ex.consumed)
+        except ConnectionError:
+            escritor_cliente.close()
+            return
+        if not cabecalho:
+            escritor_cliente.close()
+            return
+
+        ip_conexao = (escritor_cliente.get_extra_info("peername") or ("",))[0]
+        chave, cookie_novo = chave_afinidade(cabecalho, ip_conexao, self.proxies)
+        for host, porta in self.ordem(chave):
+            try:
+                leitor_worker, escritor_worker = await asyncio.open_connection(host, porta)
+                break
+            except OSError:
+                continue
+        else:
+            print("ERRO no balanceador: nenhum worker disponível.")
+            escritor_cliente.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            escritor_cliente.close()
+            return
+
+        escritor_worker.write(cabecalho)
+        resposta = (self._responder_com_cookie(leitor_worker, escritor_cliente, cookie_novo) if cookie_novo
+                    else self._encaminhar(leitor_worker, escritor_cliente))
+        await asyncio.gather(self._encaminhar(leitor_cliente, escritor_worker), resposta)
+
+    async def servir(self, host, porta):
+        servidor = await asyncio.start_server(self._atender, host, porta, limit=TAMANHO_MAX_CABECALHO)
+        async with servidor:
+            await servidor.serve_forever()
+
+
+def _iniciar_worker(porta):
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", str(porta)])
+
+
+def _run_workers(quantidade, porta=PORTA_PUBLICA, host="0.0.0.0"):
+    """Sobe os workers, reinicia os que caírem e serve o balanceador na porta pública."""
+    try:
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    except ValueError:
+        pass
+
+    portas = [PORTA_BASE_WORKERS + i for i in range(quantidade)]
+    workers = {p: _iniciar_worker(p) for p in portas}
+    encerrando = threading.Event()
+
+    def supervisionar():
+        while not encerrando.wait(INTERVALO_SUPERVISAO):
+            for p, processo in list(workers.items()):
+                if processo.poll() is not None:
+                    print(f"AVISO: worker da porta {p} saiu (código {processo.returncode}); reiniciando.")
+                    workers[p] = _iniciar_worker(p)
+
+    threading.Thread(target=supervisionar, name="supervisor-workers", daemon=True).start()
+    print(f"Balanceador em {host}:{porta} -> {quantidade} workers ({portas[0]}-{portas[-1]})")
+    try:
+        balanceador = Balanceador([("127.0.0.1", p) for p in portas], redes_confiaveis(PROXIES_CONFIAVEIS))
+        asyncio.run(balanceador.servir(host, porta))
+    finally:
+        encerrando.set()
+        # SIGTERM deixa cada worker esvaziar a própria fila de gravação antes de sair
+        for processo in workers.values():
+            processo.terminate()
+        for processo in workers.values():
+            try:
+                processo.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        _run(porta=int(sys.argv[2]), host="127.0.0.1")
+    elif int(os.environ.get("PONTO_WORKERS", 1)) > 1:
+        _run_workers(int(os.environ["PONTO_WORKERS"]))
+    else:
+        _run()
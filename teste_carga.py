@@ -0,0 +1,450 @@
+"""
+Teste de carga do servidor (ver README, "Vários workers").
+
+Sobe N processos (os workers), cada um com várias sessões simultâneas na MESMA pasta de dados,
+como fazem as sessões do navegador. Dois modos:
+- batidas (padrão): o pico das 08:00 no caminho do servidor. Cada operação é registrar_batida +
+  sincronizar + recálculo do saldo do mês (o que atualizar_tabela faz). No fim confere se
+  nenhuma batida se perdeu, compara vazão e p95 com as metas e confere os backups incrementais
+  depois de uma restauração (ver conferir_backups).
+- interface: cada sessão é uma página do Flet de verdade (tela_login -> main) ligada a uma
+  conexão simulada no lugar do WebSocket. A sessão entra pela senha, bate ponto, abre meses e
+  exporta disparando nos controles os mesmos eventos que o navegador envia. Mede a latência de
+  cada handler (inclui montar e serializar o que iria para o cliente), os bytes enviados e os
+  erros (exceções e avisos vermelhos na tela).
+
+--workers e --formato aceitam listas (ex: 1,2,4 e json,msgpack): cada combinação roda numa pasta
+nova, com o formato de armazenamento no config.json, e no fim sai uma tabela comparando todas.
+
+Uso: python teste_carga.py [--workers 4] [--formato json] [--sessoes 25] [--batidas 20]
+                           [--meta-vazao 1000] [--meta-p95-ms 50]
+     python teste_carga.py --modo interface [--workers 2] [--sessoes 10] [--operacoes 30]
+                           [--mix bater=5,mes=4,exportar=1] [--exportar xlsx] [--meses-historico 12]
+                           [--pausa-ms 0] [--meta-erros 0] [--meta-p95-ms 200]
+Roda numa pasta temporária; os dados reais não são tocados.
+"""
+import argparse, asyncio, itertools, json, multiprocessing, os, random, sys, tempfile, threading, time
+from collections import Counter
+from datetime import datetime
+
+import flet as ft
+from flet.core.connection import Connection
+from flet.core.control_event import ControlEvent
+from flet.core.file_picker import FilePickerResultEvent, FilePickerState
+from flet.core.protocol import CommandEncoder, PageCommandResponsePayload, PageCommandsBatchResponsePayload
+
+MES_TESTE = "2099-01"  # Mês fictício, longe de qualquer dado real
+BATIDAS_POR_DIA = 24 * 60
+OPERACOES_INTERFACE = ("bater", "mes", "exportar")
+ROTULOS_EXPORTACAO = {"xlsx": "Excel (.xlsx)", "pdf": "PDF (.pdf)", "afd": "AFD (.txt)", "aej": "AEJ (.txt)"}
+
+
+def _batida(indice):
+    """Data e hora únicas para a batida de número `indice` (até 28 dias x 1440 minutos)."""
+    dia, minuto = divmod(indice, BATIDAS_POR_DIA)
+    return f"{MES_TESTE}-{dia + 1:02d}", f"{minuto // 60:02d}:{minuto % 60:02d}"
+
+
+def _processo(numero, pasta, sessoes, batidas, inicio, saida):
+    """Um worker: `sessoes` threads, cada uma com seu ControlePontoApp (como main(page) faz)."""
+    os.chdir(pasta)
+    import main
+
+    latencias = []
+    trava = threading.Lock()
+
+    def sessao(numero_sessao):
+        app = main.ControlePontoApp()
+        base = (numero * sessoes + numero_sessao) * batidas
+        minhas = []
+        for k in range(batidas):
+            data, hora = _batida(base + k)
+            t0 = time.perf_counter()
+            app.registrar_batida(data, hora)
+            app.sincronizar()
+            app.saldo_mes(MES_TESTE)
+            minhas.append(time.perf_counter() - t0)
+        with trava:
+            latencias.extend(minhas)
+
+    while time.time() < inicio:
+        time.sleep(0.001)
+    threads = [threading.Thread(target=sessao, args=(s,)) for s in range(sessoes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    main.GRAVADOR.aguardar()
+    saida.put((numero, time.time(), latencias))
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def _preparar_pasta(formato):
+    """
+    Pasta temporária nova com o formato de armazenamento escolhido no config.json (e um
+    funcionário/empregador fictício, para as exportações AFD/AEJ funcionarem).
+    """
+    pasta = tempfile.mkdtemp(prefix="teste_carga_ponto_")
+    with open(os.path.join(pasta, "config.json"), "w", encoding="utf-8") as f:
+        json.dump({"formato_dados": formato, "afd_identificadores": ["12345678909"],
+                   "empregador_cnpj": "11222333000181", "empregador_razao_social": "Empresa do Teste de Carga",
+                   "funcionario_nome": "Sessão de Teste"}, f, ensure_ascii=False)
+    return pasta
+
+
+def _rodar_workers(alvo, workers, argumentos):
+    """Sobe os workers (spawn: cada um com seu GRAVADOR), espera todos e devolve (inicio, resultados)."""
+    contexto = multiprocessing.get_context("spawn")
+    saida = contexto.Queue()
+    inicio = time.time() + 3  # Tempo para todos os processos importarem o app
+    processos = [contexto.Process(target=alvo, args=(i, *argumentos, inicio, saida)) for i in range(workers)]
+    for p in processos:
+        p.start()
+    resultados = [saida.get() for _ in processos]
+    for p in processos:
+        p.join()
+    return inicio, resultados
+
+
+def conferir_backups(main, formato):
+    """
+    Regressão dos backups: com os dados do teste, duas vezes seguidas restaura o mesmo backup,
+    edita um dia restaurado (cada vez de um jeito) e faz um incremental. A segunda edição chega à
+    mesma _versao da primeira se a restauração zerar as versões. O último ponto (estado_em) tem
+    que ser igual ao disco; retorna as datas que divergem.
+    """
+    app = main.ControlePontoApp()
+    app.backups.fazer()
+    app.exportar_backup("backup_teste.json")
+    for rodada in range(2):
+        app.restaurar_backup("backup_teste.json")
+        data = app.dados.datas_com_prefixo(MES_TESTE)[0]
+        batidas = app.dados[data]["batidas"]
+        app.dados[data] = {**app.dados[data], "batidas": batidas[:rodada] + batidas[rodada + 1:]}
+        app.salvar_dados(esperar=True)
+        app.backups.fazer()
+    estado = app.backups.estado_em(app.backups.ultimo()["arquivo"])
+    disco = main.DadosParticionados(main.PASTA_DADOS, formato)
+    return sorted(d for d in set(estado) | set(disco) if estado.get(d) != main._conteudo_dia(disco.get(d)))
+
+
+def executar(workers, sessoes, batidas, formato="json"):
+    total = workers * sessoes * batidas
+    if total > 28 * BATIDAS_POR_DIA:
+        raise ValueError("Carga grande demais para um mês de teste (máx. 40320 batidas).")
+
+    pasta = _preparar_pasta(formato)
+    inicio, resultados = _rodar_workers(_processo, workers, (pasta, sessoes, batidas))
+    fim = max(r[1] for r in resultados)
+    latencias = [lat for r in resultados for lat in r[2]]
+
+    # Confere no disco: toda batida de todos os processos tem que estar lá
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(pasta)
+    import main
+    dados = main.DadosParticionados(main.PASTA_DADOS, formato)
+    gravadas = sum(len(dados[d]["batidas"]) for d in dados.datas_com_prefixo(MES_TESTE))
+    divergentes = conferir_backups(main, formato)
+
+    return {
+        "pasta": pasta,
+        "workers": workers,
+        "formato": formato,
+        "batidas": total,
+        "gravadas": gravadas,
+        "backup_divergentes": divergentes,
+        "segundos": fim - inicio,
+        "vazao": total / (fim - inicio),
+        "p50_ms": percentil(latencias, 50) * 1000,
+        "p95_ms": percentil(latencias, 95) * 1000,
+        "p99_ms": percentil(latencias, 99) * 1000,
+    }
+
+
+# --- MODO INTERFACE (SESSÕES DO FLET SIMULADAS) ---
+
+class ConexaoSimulada(Connection):
+    """
+    No lugar do WebSocket: serializa os comandos como o servidor do Flet faria (conta os bytes)
+    e responde como o cliente, dando ids aos controles adicionados.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.bytes = 0
+        self._ids = itertools.count(1)
+
+    def send_command(self, session_id, command):
+        self.bytes += len(json.dumps(command, cls=CommandEncoder, separators=(",", ":")))
+        return PageCommandResponsePayload(result="", error="")
+
+    def send_commands(self, session_id, commands):
+        self.bytes += len(json.dumps(commands, cls=CommandEncoder, separators=(",", ":")))
+        resultados = [" ".join(f"_{next(self._ids)}" for _ in c.commands) for c in commands if c.name == "add"]
+        return PageCommandsBatchResponsePayload(results=resultados, error="")
+
+
+def _achar(raiz, condicao):
+    """Primeiro controle (em profundidade) da árvore de `raiz` que satisfaz `condicao`, ou None."""
+    pilha = [raiz]
+    while pilha:
+        controle = pilha.pop()
+        if condicao(controle):
+            return controle
+        pilha.extend(reversed(controle._get_children()))
+    return None
+
+
+def _disparar(page, controle, evento, dados=""):
+    """Entrega um evento ao controle como a página faz com o que chega do navegador (sem a fila de threads)."""
+    handler = controle.event_handlers.get(evento)
+    if handler is None:
+        raise RuntimeError(f"{type(controle).__name__} sem handler de '{evento}'")
+    handler(ControlEvent(controle.uid, evento, dados, controle, page))
+
+
+def _sessao_interface(main, numero, operacoes, mix, formato_exportacao, meses, pausa, pasta_exportacao):
+    """Uma aba do navegador: login, depois `operacoes` sorteadas do `mix`. Retorna [(operação, s, bytes, erro)]."""
+    sorteio = random.Random(numero)
+    conexao = ConexaoSimulada()
+    laco = asyncio.new_event_loop()  # A página exige um; os handlers rodam direto nesta thread
+    page = ft.Page(conexao, f"carga-{numero}", laco)
+    registros = []
+
+    def medir(nome, acao):
+        antes, bytes_antes = len(page.overlay), conexao.bytes
+        t0 = time.perf_counter()
+        erro = None
+        try:
+            acao()
+        except Exception as ex:
+            erro = f"{type(ex).__name__}: {ex}"
+        segundos = time.perf_counter() - t0
+        if erro is None:  # Erros tratados pelo app aparecem como aviso vermelho
+            erro = next((s.content.value for s in page.overlay[antes:]
+                         if isinstance(s, ft.SnackBar) and s.bgcolor == ft.Colors.RED), None)
+        registros.append((nome, segundos, conexao.bytes - bytes_antes, erro))
+        return erro is None
+
+    try:
+        medir("tela_login", lambda: main.tela_login(page))
+        senha = _achar(page, lambda c: isinstance(c, ft.TextField) and c.password)
+        senha.value = main.SENHA_CORRETA
+        medir("login", lambda: _disparar(page, senha, "submit"))
+        filtro = _achar(page, lambda c: isinstance(c, ft.TextField) and c.label == "Filtro")
+        if filtro is None:
+            registros[-1] = registros[-1][:3] + ("Login recusado",)
+            return registros
+        btn_bater = _achar(page, lambda c: isinstance(c, ft.ElevatedButton) and c.text == "BATER PONTO")
+        btn_exportar = _achar(page, lambda c: isinstance(c, ft.IconButton) and c.tooltip == "Exportar Relatório")
+        extensao = "txt" if formato_exportacao in ("afd", "aej") else formato_exportacao
+        caminho = os.path.join(pasta_exportacao, f"sessao_{numero}.{extensao}")
+
+        def abrir_mes():
+            filtro.value = sorteio.choice(meses)
+            _disparar(page, filtro, "submit")
+
+        def exportar():
+            # Mesmo caminho do navegador: ícone -> "Relatório Mensal" -> formato -> resposta do seletor
+            _disparar(page, btn_exportar, "click")
+            dialogo = next(c for c in page.overlay if isinstance(c, ft.AlertDialog) and c.open)
+            _disparar(page, _achar(dialogo, lambda c: isinstance(c, ft.ElevatedButton)
+                                   and (c.text or "").startswith("Relatório Mensal")), "click")
+            _disparar(page, _achar(dialogo, lambda c: isinstance(c, ft.ElevatedButton)
+                                   and c.text == ROTULOS_EXPORTACAO[formato_exportacao]), "click")
+            seletor = next(c for c in page.overlay
+                           if isinstance(c, ft.FilePicker) and c.state == FilePickerState.SAVE_FILE)
+            # O "result" do seletor passa por um EventHandler assíncrono; entrega o evento já convertido
+            seletor.on_result(FilePickerResultEvent(
+                ControlEvent(seletor.uid, "result", json.dumps({"path": caminho}), seletor, page)))
+            dialogo.open = False  # Se a exportação falhou o diálogo ficou aberto
+
+        acoes = {"bater": lambda: _disparar(page, btn_bater, "click"), "mes": abrir_mes, "exportar": exportar}
+        nomes, pesos = zip(*mix.items())
+        for _ in range(operacoes):
+            if pausa:
+                time.sleep(pausa)
+            nome = sorteio.choices(nomes, pesos)[0]
+            medir(nome, acoes[nome])
+    except Exception as ex:
+        registros.append(("sessao", 0.0, 0, f"{type(ex).__name__}: {ex}"))
+    finally:
+        if page.on_close:
+            page.on_close(None)  # Cancela lembretes e tira a sessão do SESSOES, como no fechamento da aba
+        laco.close()
+    return registros
+
+
+def _processo_interface(numero, pasta, sessoes, operacoes, mix, formato_exportacao, meses, pausa, inicio, saida):
+    """Um worker do modo interface: `sessoes` threads, cada uma uma página do Flet."""
+    os.chdir(pasta)
+    import main
+
+    registros = []
+    trava = threading.Lock()
+    pasta_exportacao = os.path.join(pasta, "exportacoes")
+    os.makedirs(pasta_exportacao, exist_ok=True)
+
+    def sessao(numero_sessao):
+        meus = _sessao_interface(main, numero * sessoes + numero_sessao, operacoes, mix, formato_exportacao,
+                                 meses, pausa, pasta_exportacao)
+        with trava:
+            registros.extend(meus)
+
+    while time.time() < inicio:
+        time.sleep(0.001)
+    threads = [threading.Thread(target=sessao, args=(s,)) for s in range(sessoes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    main.GRAVADOR.aguardar()
+    saida.put((numero, time.time(), registros))
+
+
+def _meses_historico(quantidade):
+    """O mês atual e os `quantidade` anteriores, do mais antigo ao atual (AAAA-MM)."""
+    hoje = datetime.now()
+    indice = hoje.year * 12 + hoje.month - 1
+    return [f"{i // 12:04d}-{i % 12 + 1:02d}" for i in range(indice - quantidade, indice + 1)]
+
+
+def _semear_historico(pasta, meses):
+    """Histórico de dias úteis com 4 batidas nos meses anteriores ao atual, para as sessões abrirem."""
+    os.chdir(pasta)
+    import main
+
+    app = main.ControlePontoApp()
+    batidas = {}
+    for mes in meses[:-1]:
+        ano, numero_mes = map(int, mes.split("-"))
+        for dia in range(1, 29):
+            if datetime(ano, numero_mes, dia).weekday() < 5:
+                batidas[f"{mes}-{dia:02d}"] = ["08:00", "12:00", "13:00", "17:00"]
+    app.mesclar_batidas(batidas)
+    app.salvar_dados(esperar=True)
+
+
+def _resumir_operacoes(registros, segundos):
+    resumo = {}
+    for nome in sorted({r[0] for r in registros}):
+        deles = [r for r in registros if r[0] == nome]
+        latencias = [r[1] for r in deles]
+        erros = sum(1 for r in deles if r[3])
+        resumo[nome] = {"n": len(deles), "erros": erros, "taxa_erros": erros / len(deles),
+                        "p50_ms": percentil(latencias, 50) * 1000, "p95_ms": percentil(latencias, 95) * 1000,
+                        "p99_ms": percentil(latencias, 99) * 1000,
+                        "kb_medio": sum(r[2] for r in deles) / len(deles) / 1024}
+    erros = sum(1 for r in registros if r[3])
+    resumo["total"] = {"n": len(registros), "erros": erros, "taxa_erros": erros / max(1, len(registros)),
+                       "ops_s": len(registros) / segundos,
+                       "p95_ms": percentil([r[1] for r in registros], 95) * 1000}
+    return resumo
+
+
+def executar_interface(workers, sessoes, operacoes, mix, formato="json", formato_exportacao="xlsx",
+                       meses_historico=12, pausa=0.0):
+    pasta = _preparar_pasta(formato)
+    meses = _meses_historico(meses_historico)
+    contexto = multiprocessing.get_context("spawn")
+    semeador = contexto.Process(target=_semear_historico, args=(pasta, meses))
+    semeador.start()
+    semeador.join()
+
+    inicio, resultados = _rodar_workers(_processo_interface, workers,
+                                        (pasta, sessoes, operacoes, mix, formato_exportacao, meses, pausa))
+    fim = max(r[1] for r in resultados)
+    registros = [reg for r in resultados for reg in r[2]]
+    return {
+        "pasta": pasta,
+        "workers": workers,
+        "formato": formato,
+        "sessoes": workers * sessoes,
+        "segundos": fim - inicio,
+        "operacoes": _resumir_operacoes(registros, fim - inicio),
+        "erros_mais_comuns": Counter(r[3] for r in registros if r[3]).most_common(5),
+    }
+
+
+def _mix(texto):
+    mix = {}
+    for parte in texto.split(","):
+        nome, _, peso = parte.partition("=")
+        if nome.strip() not in OPERACOES_INTERFACE:
+            raise argparse.ArgumentTypeError(f"operação desconhecida: {nome!r} (use {', '.join(OPERACOES_INTERFACE)})")
+        mix[nome.strip()] = float(peso or 1)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teste de carga do servidor: batidas em massa ou sessões do Flet.")
+    parser.add_argument("--modo", choices=("batidas", "interface"), default="batidas")
+    parser.add_argument("--workers", default="4", help="processos; lista separada por vírgula para comparar")
+    parser.add_argument("--formato", default="json",
+                        help="formato de armazenamento (json, json_zlib, msgpack); lista para comparar")
+    parser.add_argument("--sessoes", type=int, default=25, help="sessões simultâneas por worker")
+    parser.add_argument("--batidas", type=int, default=20, help="batidas por sessão (modo batidas)")
+    parser.add_argument("--operacoes", type=int, default=30, help="operações por sessão depois do login (modo interface)")
+    parser.add_argument("--mix", type=_mix, default="bater=5,mes=4,exportar=1",
+                        help="peso de cada operação no sorteio (modo interface)")
+    parser.add_argument("--exportar", choices=tuple(ROTULOS_EXPORTACAO), default="xlsx",
+                        help="formato das exportações (modo interface)")
+    parser.add_argument("--meses-historico", type=int, default=12,
+                        help="meses de histórico criados antes do teste (modo interface)")
+    parser.add_argument("--pausa-ms", type=float, default=0, help="espera entre operações de uma sessão")
+    parser.add_argument("--meta-vazao", type=float, default=1000, help="batidas por segundo, no mínimo (modo batidas)")
+    parser.add_argument("--meta-p95-ms", type=float, default=None,
+                        help="p95 máximo por batida (modo batidas, padrão 50) ou do 'bater' (modo interface)")
+    parser.add_argument("--meta-erros", type=float, default=0, help="taxa de erros máxima (modo interface)")
+    args = parser.parse_args()
+
+    combinacoes = [(int(w), f.strip()) for f in args.formato.split(",") for w in args.workers.split(",")]
+    resultados, ok = [], True
+    for workers, formato in combinacoes:
+        if args.modo == "batidas":
+            meta_p95 = 50 if args.meta_p95_ms is None else args.meta_p95_ms
+            r = executar(workers, args.sessoes, args.batidas, formato)
+            print(json.dumps(r, indent=2, ensure_ascii=False))
+            passou = (r["gravadas"] == r["batidas"] and r["vazao"] >= args.meta_vazao and r["p95_ms"] <= meta_p95
+                      and not r["backup_divergentes"])
+            print(f"{'OK' if passou else 'FALHOU'}: {r['vazao']:.0f} batidas/s (meta {args.meta_vazao:.0f}), "
+                  f"p95 {r['p95_ms']:.1f} ms (meta {meta_p95:.0f}), {r['gravadas']}/{r['batidas']} no disco, "
+                  f"backup após restauração {'confere' if not r['backup_divergentes'] else 'diverge'}")
+        else:
+            r = executar_interface(workers, args.sessoes, args.operacoes, args.mix, formato, args.exportar,
+                                   args.meses_historico, args.pausa_ms / 1000)
+            print(json.dumps(r, indent=2, ensure_ascii=False))
+            print(f"{'operação':<12}{'n':>7}{'erros':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'KB/op':>9}")
+            for nome, o in r["operacoes"].items():
+                if nome != "total":
+                    print(f"{nome:<12}{o['n']:>7}{o['erros']:>8}{o['p50_ms']:>10.1f}{o['p95_ms']:>10.1f}"
+                          f"{o['p99_ms']:>10.1f}{o['kb_medio']:>9.1f}")
+            total = r["operacoes"]["total"]
+            p95_bater = r["operacoes"].get("bater", {}).get("p95_ms", 0.0)
+            passou = total["taxa_erros"] <= args.meta_erros and (args.meta_p95_ms is None or p95_bater <= args.meta_p95_ms)
+            print(f"{'OK' if passou else 'FALHOU'}: {total['ops_s']:.0f} operações/s, "
+                  f"erros {total['taxa_erros']:.1%} (meta {args.meta_erros:.1%}), p95 do bater {p95_bater:.1f} ms"
+                  + (f" (meta {args.meta_p95_ms:.0f})" if args.meta_p95_ms is not None else ""))
+        resultados.append(r)
+        ok = ok and passou
+
+    if len(resultados) > 1:
+        print("\nComparação:")
+        if args.modo == "batidas":
+            print(f"{'workers':>8} {'formato':<10}{'batidas/s':>10}{'p95 ms':>9}{'p99 ms':>9}  no disco")
+            for r in resultados:
+                print(f"{r['workers']:>8} {r['formato']:<10}{r['vazao']:>10.0f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}"
+                      f"  {r['gravadas']}/{r['batidas']}")
+        else:
+            print(f"{'workers':>8} {'formato':<10}{'ops/s':>8}{'p95 ms':>9}{'p95 bater':>11}{'erros':>8}")
+            for r in resultados:
+                total = r["operacoes"]["total"]
+                print(f"{r['workers']:>8} {r['formato']:<10}{total['ops_s']:>8.0f}{total['p95_ms']:>9.1f}"
+                      f"{r['operacoes'].get('bater', {}).get('p95_ms', 0.0):>11.1f}{total['taxa_erros']:>8.1%}")
+    sys.exit(0 if ok else 1)